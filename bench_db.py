@@ -0,0 +1,230 @@
+import argparse
+import os
+import random
+import sys
+import psycopg2
+from psycopg2 import OperationalError
+import config
+import seed_data
+from bench_utils import (measure, new_results, save_results, print_results,
+                         add_compare_command, run_compare_command)
+
+SIZES = {
+    'small': {'brands': 20, 'products': 1000, 'users': 200, 'carts': 50, 'orders': 2000},
+    'medium': {'brands': 50, 'products': 10000, 'users': 2000, 'carts': 300, 'orders': 20000},
+    'large': {'brands': 200, 'products': 100000, 'users': 20000, 'carts': 2000, 'orders': 200000}
+}
+
+
+def add_bench_connection_arguments(parser):
+    # Временная база создается и удаляется только на локальном сервере, поэтому параметры
+    # подключения берутся из опций бенчмарка, а не из настроек приложения
+    parser.add_argument('--host', default=seed_data.LOCAL_HOST, help="Хост локального PostgreSQL")
+    parser.add_argument('--port', default='5432', help="Порт локального PostgreSQL")
+    parser.add_argument('--user', default='postgres', help="Пользователь с правом CREATE DATABASE")
+    parser.add_argument('--password', default='', help="Пароль (по умолчанию PGPASSWORD или .pgpass)")
+
+
+def admin_connection(args):
+    try:
+        connection = psycopg2.connect(host=args.host, port=args.port, user=args.user,
+                                      password=args.password, dbname=args.admin_database)
+    except OperationalError:
+        return None
+    connection.autocommit = True
+    return connection
+
+
+def use_database(args, database):
+    # Функции config и генератор данных подключаются к временной базе через переменные окружения
+    for variable, value in [('STORE_DB_HOST', args.host), ('STORE_DB_PORT', args.port),
+                            ('STORE_DB_USER', args.user), ('STORE_DB_PASSWORD', args.password),
+                            ('STORE_DB_NAME', database)]:
+        os.environ[variable] = value
+
+
+def create_database(args, name):
+    connection = admin_connection(args)
+    if not connection:
+        return False
+    cursor = connection.cursor()
+    cursor.execute(f'DROP DATABASE IF EXISTS "{name}"')
+    cursor.execute(f'CREATE DATABASE "{name}"')
+    cursor.close()
+    connection.close()
+    return True
+
+
+def drop_database(args, name):
+    connection = admin_connection(args)
+    if not connection:
+        return
+    cursor = connection.cursor()
+    cursor.execute(f'DROP DATABASE IF EXISTS "{name}"')
+    cursor.close()
+    connection.close()
+
+
+def load_fixture(seed):
+    connection = config.connect_postgres()
+    cursor = connection.cursor()
+
+    cursor.execute("""
+        SELECT user_id, COUNT(*)
+        FROM orders
+        GROUP BY user_id
+        ORDER BY COUNT(*) DESC
+        LIMIT 1
+    """)
+    heavy_user_id, heavy_user_orders = cursor.fetchone()
+
+    cursor.execute("""
+        SELECT user_id FROM users
+        WHERE user_id != (SELECT MIN(user_id) FROM users)
+        AND user_id != %s
+        ORDER BY user_id
+        LIMIT 1
+    """, (heavy_user_id,))
+    shopper_id = cursor.fetchone()[0]
+
+    cursor.execute("""
+        SELECT order_id FROM orders
+        WHERE user_id = %s
+        ORDER BY items_count DESC, order_id
+        LIMIT 1
+    """, (heavy_user_id,))
+    order_id = cursor.fetchone()[0]
+
+    cursor.execute("SELECT MIN(order_date), MAX(order_date) FROM orders")
+    first_date, last_date = cursor.fetchone()
+
+    cursor.execute("SELECT product_id, article FROM products ORDER BY product_id")
+    products = cursor.fetchall()
+
+    cursor.close()
+    connection.close()
+
+    rng = random.Random(seed)
+    return {
+        'rng': rng,
+        'heavy_user_id': heavy_user_id,
+        'heavy_user_orders': heavy_user_orders,
+        'shopper_id': shopper_id,
+        'order_id': order_id,
+        'month_start': last_date.replace(day=1).strftime('%Y-%m-%d'),
+        'month_end': last_date.strftime('%Y-%m-%d'),
+        'products': products
+    }
+
+
+def build_benchmarks(fixture):
+    rng = fixture['rng']
+    shopper_id = fixture['shopper_id']
+    products = fixture['products']
+    state = {}
+
+    def random_product():
+        return rng.choice(products)
+
+    def fill_cart():
+        config.clear_cart(shopper_id)
+        for _ in range(3):
+            config.add_to_cart(shopper_id, random_product()[0])
+        state['cart'] = config.get_user_cart(shopper_id)
+
+    def ensure_cart_line():
+        if not state.get('line'):
+            product_id, article = random_product()
+            config.add_to_cart(shopper_id, product_id)
+            state['line'] = article
+
+    return [
+        ('get_all_products', config.get_all_products, None),
+        ('get_all_brands', config.get_all_brands, None),
+        ('add_to_cart', lambda: config.add_to_cart(shopper_id, random_product()[0]), None),
+        ('update_cart_item', lambda: config.update_cart_item(shopper_id, state['line'], rng.randint(1, 5)),
+         ensure_cart_line),
+        ('create_order', lambda: config.create_order(shopper_id, state['cart']), fill_cart),
+        ('get_user_orders', lambda: config.get_user_orders(fixture['heavy_user_id']), None),
+        ('get_sales_data', config.get_sales_data, None),
+        ('get_sales_data_month', lambda: config.get_sales_data(fixture['month_start'], fixture['month_end']), None),
+        ('get_order_details', lambda: config.get_order_details(fixture['order_id']), None)
+    ]
+
+
+def run_size(size, args, results):
+    volumes = SIZES[size]
+    seed_args = ['--truncate', '--seed', str(args.seed)]
+    for option, value in volumes.items():
+        seed_args.extend([f'--{option}', str(value)])
+
+    print(f"[{size}] заполнение базы: {volumes}")
+    if seed_data.main(seed_args) != 0:
+        raise RuntimeError("не удалось заполнить базу данных")
+
+    fixture = load_fixture(args.seed)
+    for name, function, setup in build_benchmarks(fixture):
+        if args.only and name not in args.only:
+            continue
+        stats = measure(function, setup, rounds=args.rounds, warmup=args.warmup, max_time=args.max_time)
+        stats.update(volumes)
+        results['results'][f"{size}/{name}"] = stats
+        print(f"[{size}] {name}: median {stats['median'] * 1000:.2f} ms ({stats['rounds']} раз)")
+
+
+def run_command(args):
+    if not seed_data.is_local_host(args.host):
+        print(f"Временная база создается только на локальном сервере, а не на {args.host}", file=sys.stderr)
+        return 1
+
+    database = args.bench_database or f"store_bench_{os.getpid()}"
+    if not create_database(args, database):
+        print("Не удалось создать временную базу данных", file=sys.stderr)
+        return 1
+
+    use_database(args, database)
+    results = new_results('db')
+    results['meta']['database'] = database
+    results['meta']['rounds'] = args.rounds
+
+    try:
+        for size in args.sizes.split(','):
+            run_size(size.strip(), args, results)
+    finally:
+        if not args.keep_database:
+            drop_database(args, database)
+
+    save_results(results, args.output)
+    print_results(results)
+    print(f"Результаты сохранены в {args.output}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки функций доступа к данным на временной базе PostgreSQL")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Запустить бенчмарки")
+    add_bench_connection_arguments(run_parser)
+    run_parser.add_argument('--admin-database', default='postgres',
+                            help="База для создания и удаления временной базы")
+    run_parser.add_argument('--bench-database', help="Имя временной базы (по умолчанию store_bench_<pid>)")
+    run_parser.add_argument('--keep-database', action='store_true', help="Не удалять временную базу")
+    run_parser.add_argument('--sizes', default='small,medium', help=f"Размеры данных: {', '.join(SIZES)}")
+    run_parser.add_argument('--only', nargs='*', help="Запустить только указанные бенчмарки")
+    run_parser.add_argument('--rounds', type=int, default=20)
+    run_parser.add_argument('--warmup', type=int, default=2)
+    run_parser.add_argument('--max-time', type=float, default=15.0, help="Предел времени на один бенчмарк, с")
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--output', default='bench_db.json', help="Файл для результатов")
+
+    add_compare_command(subparsers)
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        return run_command(args)
+    return run_compare_command(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
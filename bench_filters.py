@@ -0,0 +1,270 @@
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import seed_data
+import index_file
+from filters import ProductFilter, RESULTS_PAGE_SIZE
+from bench_utils import (measure, summarize_timings, new_results, save_results, print_results,
+                         add_compare_command, run_compare_command)
+
+SIZES = {
+    'small': {'brands': 20, 'products': 1000},
+    'medium': {'brands': 100, 'products': 100000},
+    'large': {'brands': 500, 'products': 1000000}
+}
+
+# Наборы фильтров: имя -> (категории, число самых популярных брендов, цена, характеристики, текст поиска)
+FILTER_CASES = {
+    'no_filters': ([], 0, None, {}, ""),
+    'category': (["Одежда и обувь"], 0, None, {}, ""),
+    'rare_category': (["Единоборства и бокс"], 0, None, {}, ""),
+    'brand': ([], 1, None, {}, ""),
+    'brands_5': ([], 5, None, {}, ""),
+    'category_brand': (["Велоспорт"], 1, None, {}, ""),
+    'price_range': ([], 0, (1000, 3000), {}, ""),
+    'attributes': ([], 0, None, {'color': ["Черный"], 'season': ["Зима"]}, ""),
+    'search_word': ([], 0, None, {}, "кроссовки"),
+    'search_article': ([], 0, None, {}, "sd-0000042"),
+    'search_short': ([], 0, None, {}, "ма"),
+    'search_category': (["Спортивный инвентарь"], 0, None, {}, "мяч"),
+    'query': ([], 0, None, {}, 'brand:Nike category:"Велоспорт" price<5000 color:Черный'),
+    'everything': (["Одежда и обувь"], 3, (2000, 8000), {'gender': ["Женский"]}, "pro")
+}
+
+# Набор запроса по буквам: каждая буква - новый запрос результатов и первая страница карточек
+KEYSTROKE_CASES = {
+    'word': "кроссовки air",
+    'layout': "rhjccjdrb",
+    'article': "sd-00012",
+    'typo': "кросовки"
+}
+
+
+def generate_catalog(rng, volumes):
+    # Товары в том же виде, что отдает config.get_all_products, без базы данных:
+    # категории и бренды распределены так же неравномерно, как в seed_data
+    brands = []
+    for i in range(volumes['brands']):
+        name = seed_data.BRAND_NAMES[i] if i < len(seed_data.BRAND_NAMES) else f"{rng.choice(seed_data.BRAND_NAMES)} {i}"
+        brands.append({'id': i + 1, 'name': name})
+    brand_cum_weights = seed_data.zipf_cum_weights(len(brands), 1.1)
+
+    products = []
+    for i in range(volumes['products']):
+        category = rng.choices(seed_data.CATEGORIES, weights=seed_data.CATEGORY_WEIGHTS)[0]
+        brand = rng.choices(brands, cum_weights=brand_cum_weights)[0]
+        item = rng.choice(seed_data.CATEGORY_ITEMS[category])
+        products.append({
+            'id': i + 1,
+            'article': f"SD-{i + 1:07d}",
+            'name': f"{item} {rng.choice(seed_data.ADJECTIVES)} {rng.randrange(100, 1000)}",
+            'price': str(seed_data.generate_price(rng, category)),
+            'category': category,
+            'material': rng.choice(seed_data.MATERIALS),
+            'color': rng.choice(seed_data.COLORS),
+            'size': rng.choice(seed_data.SIZES),
+            'country': rng.choice(seed_data.COUNTRIES),
+            'gender': rng.choice(seed_data.GENDERS),
+            'season': rng.choice(seed_data.SEASONS),
+            'image_url': '',
+            'brand': brand['name'],
+            'brand_id': brand['id']
+        })
+
+    # Продажи тоже по закону Ципфа: немногие товары продаются чаще остальных
+    sales_cum_weights = seed_data.zipf_cum_weights(len(products), 1.0)
+    sales = {}
+    for product in rng.choices(products, cum_weights=sales_cum_weights, k=len(products) // 2):
+        sales[product['article']] = sales.get(product['article'], 0) + 1
+
+    return brands, products, sales
+
+
+def new_filter(brands, sales):
+    product_filter = ProductFilter()
+    product_filter.set_brand_mappings(brands)
+    product_filter.sales = sales
+    return product_filter
+
+
+def reset_caches(product_filter):
+    product_filter.refinements = []
+    product_filter.result_cache.clear()
+    product_filter.facet_counts = (None, None)
+
+
+def apply_case(product_filter, brands, case):
+    categories, brand_count, price_range, attributes, text = case
+    product_filter.reset_filters()
+    product_filter.set_selected_categories(categories)
+    product_filter.set_selected_brands([brand['id'] for brand in brands[:brand_count]])
+    if price_range:
+        product_filter.set_price_range(*price_range)
+    for name, values in attributes.items():
+        product_filter.set_selected_attribute(name, values)
+    product_filter.set_search_text(text)
+
+
+def measure_memory(function):
+    # Сколько памяти осталось занято после вызова и пиковое потребление во время него
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, current - before, peak - before
+
+
+def build_benchmarks(brands, products, sales, product_filter):
+    benchmarks = []
+
+    def add(name, function, setup=None):
+        benchmarks.append((name, function, setup))
+
+    def catalog_setup():
+        state['filter'] = new_filter(brands, sales)
+
+    state = {}
+    add('set_catalog', lambda: state['filter'].set_catalog(products), catalog_setup)
+
+    for name, case in FILTER_CASES.items():
+        def setup(case=case):
+            apply_case(product_filter, brands, case)
+            reset_caches(product_filter)
+
+        def cached_setup(case=case):
+            apply_case(product_filter, brands, case)
+
+        add(f"filter/{name}", lambda: product_filter.filter_products(products), setup)
+        add(f"filter_cached/{name}", lambda: product_filter.filter_products(products), cached_setup)
+        add(f"ranked_page/{name}",
+            lambda: product_filter.get_ranked_results(products).take(RESULTS_PAGE_SIZE), setup)
+        add(f"facets/{name}", product_filter.get_facet_counts, setup)
+
+    for sort_order in ('price_asc', 'sales', 'name'):
+        def setup(sort_order=sort_order):
+            apply_case(product_filter, brands, FILTER_CASES['category'])
+            product_filter.set_sort_order(sort_order)
+            reset_caches(product_filter)
+
+        def sorted_page():
+            page = product_filter.get_ranked_results(products).take(RESULTS_PAGE_SIZE)
+            product_filter.set_sort_order("relevance")
+            return page
+
+        add(f"sorted_page/{sort_order}", sorted_page, setup)
+
+    for name, text in KEYSTROKE_CASES.items():
+        mode = "fuzzy" if name == 'typo' else "exact"
+
+        def setup(mode=mode):
+            product_filter.reset_filters()
+            product_filter.set_search_mode(mode)
+            reset_caches(product_filter)
+
+        def type_text(text=text):
+            for length in range(1, len(text) + 1):
+                product_filter.set_search_text(text[:length])
+                product_filter.get_ranked_results(products).take(RESULTS_PAGE_SIZE)
+            product_filter.set_search_mode("exact")
+
+        add(f"keystrokes/{name}", type_text, setup)
+        add(f"suggestions/{name}",
+            lambda text=text: [product_filter.get_suggestions(text[:length]) for length in range(1, len(text) + 1)])
+
+    def summary_setup():
+        apply_case(product_filter, brands, FILTER_CASES['everything'])
+        product_filter.set_selected_brands([brand['id'] for brand in brands])
+
+    add('get_filter_summary', product_filter.get_filter_summary, summary_setup)
+    add('set_brand_mappings', lambda: product_filter.set_brand_mappings(brands))
+    add('get_selected_brand_names', product_filter.get_selected_brand_names, summary_setup)
+
+    return benchmarks
+
+
+def run_size(size, args, results):
+    volumes = SIZES[size]
+    rng = random.Random(args.seed)
+
+    print(f"[{size}] генерация каталога: {volumes}")
+    brands, products, sales = generate_catalog(rng, volumes)
+
+    # Файл индексов собирается один раз, а загружается при каждом запуске приложения
+    index_path = os.path.join(tempfile.gettempdir(), f"bench_catalog_index_{size}.bin")
+    loaded_filter = new_filter(brands, sales)
+
+    product_filter = new_filter(brands, sales)
+    for name, function in (('set_catalog', lambda: product_filter.set_catalog(products)),
+                           ('build_fuzzy_index', product_filter.build_fuzzy_index),
+                           ('build_index_file', lambda: index_file.write_index_file(
+                               index_path, index_file.build_index(products, 0, args.workers))),
+                           ('load_index_file', lambda: index_file.load_catalog(
+                               loaded_filter, products, 0, index_path))):
+        _, elapsed, retained, peak = measure_memory(function)
+        stats = summarize_timings([elapsed])
+        stats.update(volumes, memory_bytes=retained, peak_bytes=peak)
+        results['results'][f"{size}/memory/{name}"] = stats
+        print(f"[{size}] память {name}: {retained / 1024 / 1024:.1f} MiB, пик {peak / 1024 / 1024:.1f} MiB, "
+              f"{elapsed:.2f} с")
+    os.remove(index_path)
+
+    for name, function, setup in build_benchmarks(brands, products, sales, product_filter):
+        if args.only and not any(name.startswith(prefix) for prefix in args.only):
+            continue
+        # Полная перестройка каталога на миллионе товаров слишком долгая для многих повторов
+        rounds = min(args.rounds, 3) if name == 'set_catalog' else args.rounds
+        stats = measure(function, setup, rounds=rounds, warmup=args.warmup, max_time=args.max_time)
+        stats.update(volumes)
+        results['results'][f"{size}/{name}"] = stats
+        print(f"[{size}] {name}: median {stats['median'] * 1000:.2f} ms ({stats['rounds']} раз)")
+
+
+def run_command(args):
+    results = new_results('filters')
+    results['meta']['rounds'] = args.rounds
+    results['meta']['seed'] = args.seed
+
+    for size in args.sizes.split(','):
+        run_size(size.strip(), args, results)
+
+    save_results(results, args.output)
+    print_results(results)
+    print(f"Результаты сохранены в {args.output}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки фильтрации и поиска товаров на синтетическом каталоге")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Запустить бенчмарки")
+    run_parser.add_argument('--sizes', default='small,medium', help=f"Размеры каталога: {', '.join(SIZES)}")
+    run_parser.add_argument('--only', nargs='*', help="Запустить только бенчмарки с указанными префиксами")
+    run_parser.add_argument('--rounds', type=int, default=20)
+    run_parser.add_argument('--warmup', type=int, default=1)
+    run_parser.add_argument('--max-time', type=float, default=15.0, help="Предел времени на один бенчмарк, с")
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--workers', type=int, default=None, help="Число процессов сборки файла индексов")
+    run_parser.add_argument('--output', default='bench_filters.json', help="Файл для результатов")
+
+    add_compare_command(subparsers)
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        return run_command(args)
+    return run_compare_command(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
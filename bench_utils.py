@@ -0,0 +1,141 @@
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    weight = position - lower
+    return sorted_values[lower] * (1 - weight) + sorted_values[upper] * weight
+
+
+def measure(function, setup=None, rounds=20, warmup=1, max_time=None):
+    for _ in range(warmup):
+        if setup:
+            setup()
+        function()
+
+    timings = []
+    started = time.perf_counter()
+    for _ in range(rounds):
+        if setup:
+            setup()
+        begin = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - begin)
+        if max_time is not None and time.perf_counter() - started > max_time:
+            break
+
+    return summarize_timings(timings)
+
+
+def summarize_timings(timings):
+    values = sorted(timings)
+    return {
+        'rounds': len(values),
+        'min': values[0],
+        'max': values[-1],
+        'mean': statistics.fmean(values),
+        'median': statistics.median(values),
+        'p95': percentile(values, 0.95),
+        'stdev': statistics.stdev(values) if len(values) > 1 else 0.0
+    }
+
+
+def new_results(suite):
+    return {
+        'meta': {
+            'suite': suite,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'machine': platform.node()
+        },
+        'results': {}
+    }
+
+
+def save_results(results, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare_results(baseline, current, tolerance=0.10, metric='median'):
+    rows = []
+    for name in sorted(set(baseline['results']) | set(current['results'])):
+        old = baseline['results'].get(name)
+        new = current['results'].get(name)
+        if old is None or new is None:
+            rows.append((name, old and old.get(metric), new and new.get(metric), None, 'missing'))
+            continue
+
+        old_value = old[metric]
+        new_value = new[metric]
+        change = (new_value - old_value) / old_value if old_value else 0.0
+        if change > tolerance:
+            status = 'REGRESSION'
+        elif change < -tolerance:
+            status = 'faster'
+        else:
+            status = 'ok'
+        rows.append((name, old_value, new_value, change, status))
+    return rows
+
+
+def format_seconds(value):
+    if value is None:
+        return '-'
+    if value >= 1:
+        return f"{value:.3f} s"
+    if value >= 1e-3:
+        return f"{value * 1e3:.2f} ms"
+    return f"{value * 1e6:.1f} us"
+
+
+def print_results(results, metric='median'):
+    for name, stats in sorted(results['results'].items()):
+        extra = ''
+        if 'memory_bytes' in stats:
+            extra = f"  mem {stats['memory_bytes'] / 1024 / 1024:.1f} MiB"
+        print(f"{name:<55}{format_seconds(stats.get(metric)):>12}"
+              f"  (min {format_seconds(stats.get('min'))}, rounds {stats.get('rounds', 0)}){extra}")
+
+
+def print_comparison(rows, metric='median'):
+    print(f"{'benchmark':<55}{'baseline':>12}{'current':>12}{'change':>9}  status ({metric})")
+    for name, old_value, new_value, change, status in rows:
+        change_text = f"{change * 100:+.1f}%" if change is not None else '-'
+        print(f"{name:<55}{format_seconds(old_value):>12}{format_seconds(new_value):>12}"
+              f"{change_text:>9}  {status}")
+
+
+def add_compare_command(subparsers):
+    parser = subparsers.add_parser('compare', help="Сравнить результаты с базовыми")
+    parser.add_argument('baseline', help="JSON-файл с базовыми результатами")
+    parser.add_argument('current', help="JSON-файл с текущими результатами")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="Допустимое замедление, доля (0.10 = 10%%)")
+    parser.add_argument('--metric', default='median', choices=['min', 'median', 'mean', 'p95'])
+    return parser
+
+
+def run_compare_command(args):
+    rows = compare_results(load_results(args.baseline), load_results(args.current),
+                           args.tolerance, args.metric)
+    print_comparison(rows, args.metric)
+    regressions = [row for row in rows if row[4] == 'REGRESSION']
+    if regressions:
+        print(f"Замедлений сверх допуска: {len(regressions)}")
+        return 1
+    return 0
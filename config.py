@@ -1,3 +1,4 @@
+import os
 import psycopg2
 from psycopg2 import OperationalError
 import hashlib
@@ -5,11 +6,11 @@ from datetime import datetime
 
 def connect_postgres():
     db_params = {
-        'host': '5.183.188.132',
-        'database': '2025_psql_gri',
-        'user': '2025_psql_g_usr',
-        'password': 'aYQ2XzT2plld4zli', 
-        'port': '5432'
+        'host': os.environ.get('STORE_DB_HOST', '5.183.188.132'),
+        'database': os.environ.get('STORE_DB_NAME', '2025_psql_gri'),
+        'user': os.environ.get('STORE_DB_USER', '2025_psql_g_usr'),
+        'password': os.environ.get('STORE_DB_PASSWORD', 'aYQ2XzT2plld4zli'), 
+        'port': os.environ.get('STORE_DB_PORT', '5432')
     }
     
     try:
@@ -18,6 +19,19 @@ def connect_postgres():
     except OperationalError:
         return None
 
+def get_data_path(name):
+    # Файлы индексов каталога лежат в каталоге данных пользователя, а не в рабочем каталоге:
+    # их оглавление разбирается pickle, и записывать их должно только само приложение
+    directory = os.environ.get('STORE_DATA_DIR')
+    if not directory:
+        if os.name == 'nt':
+            base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+        else:
+            base = os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+        directory = os.path.join(base, 'sport-store')
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    return os.path.join(directory, name)
+
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
@@ -123,6 +137,91 @@ def authenticate_user(username, password):
         connection.close()
         return False, f"Ошибка аутентификации: {e}"
 
+def _create_recommendation_tables(cursor):
+    # Сколько раз пара товаров встретилась в одном заказе и лучшие пары для каждого артикула.
+    # Таблицы не ссылаются на products: удаленные товары отсекаются при чтении
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS product_pairs (
+            article VARCHAR(50) NOT NULL,
+            paired_article VARCHAR(50) NOT NULL,
+            orders_count INTEGER NOT NULL,
+            PRIMARY KEY (article, paired_article)
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS product_recommendations (
+            article VARCHAR(50) NOT NULL,
+            position SMALLINT NOT NULL,
+            recommended_article VARCHAR(50) NOT NULL,
+            orders_count INTEGER NOT NULL,
+            PRIMARY KEY (article, position)
+        )
+    """)
+    
+    # Все заказы с номером не больше last_order_id уже учтены. Номера выдаются при создании
+    # заказа, а видны заказы после фиксации, поэтому учтенные заказы новее этой границы
+    # перечисляются в recommendation_orders
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS recommendation_state (
+            state_id INTEGER PRIMARY KEY DEFAULT 1 CHECK (state_id = 1),
+            last_order_id INTEGER NOT NULL DEFAULT 0,
+            refreshed_at TIMESTAMP
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS recommendation_orders (
+            order_id INTEGER PRIMARY KEY
+        )
+    """)
+
+def _create_catalog_revision(cursor):
+    # Номер версии каталога растет при любом изменении товаров или брендов: по нему
+    # приложение понимает, что файл индексов каталога (index_file) еще актуален
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_revision (
+            state_id INTEGER PRIMARY KEY DEFAULT 1 CHECK (state_id = 1),
+            revision BIGINT NOT NULL DEFAULT 0
+        )
+    """)
+    
+    cursor.execute("INSERT INTO catalog_revision (state_id) VALUES (1) ON CONFLICT DO NOTHING")
+    
+    # Функция и триггеры создаются, только если их еще нет: DDL на products и brands
+    # блокирует таблицы каталога для всех клиентов, а upgrade_tables выполняется при каждом запуске
+    cursor.execute("""
+        SELECT EXISTS (
+            SELECT FROM pg_proc
+            WHERE proname = 'bump_catalog_revision' AND pg_function_is_visible(oid)
+        )
+    """)
+    
+    if not cursor.fetchone()[0]:
+        cursor.execute("""
+            CREATE FUNCTION bump_catalog_revision() RETURNS trigger AS $$
+            BEGIN
+                UPDATE catalog_revision SET revision = revision + 1 WHERE state_id = 1;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+    
+    for table in ('products', 'brands'):
+        cursor.execute("""
+            SELECT EXISTS (
+                SELECT FROM pg_trigger
+                WHERE tgname = %s AND tgrelid = %s::regclass
+            )
+        """, (f"{table}_catalog_revision", table))
+        
+        if not cursor.fetchone()[0]:
+            cursor.execute(f"""
+                CREATE TRIGGER {table}_catalog_revision
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_revision()
+            """)
+
 def create_tables():
     connection = connect_postgres()
     if not connection:
@@ -204,10 +303,16 @@ def create_tables():
                 user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
                 order_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 total_amount DECIMAL(10, 2) NOT NULL,
-                status VARCHAR(20) DEFAULT 'Завершен'
+                status VARCHAR(20) DEFAULT 'Завершен',
+                items_count INTEGER NOT NULL DEFAULT 0
             )
         """)
         
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_orders_user_date
+            ON orders (user_id, order_date, order_id)
+        """)
+        
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS order_items (
                 order_item_id SERIAL PRIMARY KEY,
@@ -220,6 +325,9 @@ def create_tables():
             )
         """)
         
+        _create_recommendation_tables(cursor)
+        _create_catalog_revision(cursor)
+        
         connection.commit()
         cursor.close()
         connection.close()
@@ -232,51 +340,115 @@ def create_tables():
             connection.close()
         return False
 
-def get_all_products():
+def upgrade_tables():
     connection = connect_postgres()
     if not connection:
-        return []
+        return False
     
     try:
         cursor = connection.cursor()
         
         cursor.execute("""
-            SELECT 
-                p.product_id,
-                p.article,
-                p.name,
-                p.price,
-                p.category,
-                p.material,
-                p.color,
-                p.size,
-                p.country,
-                p.gender,
-                p.season,
-                p.image_url,
-                b.brand_name
-            FROM products p
-            LEFT JOIN brands b ON p.brand_id = b.brand_id
-            ORDER BY p.name
+            SELECT EXISTS (
+                SELECT FROM information_schema.columns
+                WHERE table_name = 'orders' AND column_name = 'items_count'
+            )
         """)
         
-        products = []
-        for row in cursor.fetchall():
-            products.append({
-                'id': row[0],
-                'article': row[1],
-                'name': row[2],
-                'price': str(row[3]),
-                'category': row[4] if row[4] else '',
-                'material': row[5] if row[5] else '',
-                'color': row[6] if row[6] else '',
-                'size': row[7] if row[7] else '',
-                'country': row[8] if row[8] else '',
-                'gender': row[9] if row[9] else '',
-                'season': row[10] if row[10] else '',
-                'image_url': row[11] if row[11] else '',
-                'brand': row[12] if row[12] else ''
-            })
+        if not cursor.fetchone()[0]:
+            cursor.execute("""
+                ALTER TABLE orders
+                ADD COLUMN items_count INTEGER NOT NULL DEFAULT 0
+            """)
+            cursor.execute("""
+                UPDATE orders o
+                SET items_count = counts.items_count
+                FROM (
+                    SELECT order_id, COUNT(*) AS items_count
+                    FROM order_items
+                    GROUP BY order_id
+                ) counts
+                WHERE counts.order_id = o.order_id
+            """)
+        
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_orders_user_date
+            ON orders (user_id, order_date, order_id)
+        """)
+        
+        _create_recommendation_tables(cursor)
+        connection.commit()
+        
+        # Отдельная транзакция: если у пользователя нет прав на триггеры таблиц каталога,
+        # миграции выше все равно сохраняются
+        _create_catalog_revision(cursor)
+        connection.commit()
+        
+        cursor.close()
+        connection.close()
+        return True
+        
+    except Exception:
+        connection.rollback()
+        cursor.close()
+        connection.close()
+        return False
+
+CATALOG_PRODUCT_COLUMNS = """
+        p.product_id,
+        p.article,
+        p.name,
+        p.price,
+        p.category,
+        p.material,
+        p.color,
+        p.size,
+        p.country,
+        p.gender,
+        p.season,
+        p.image_url,
+        b.brand_name,
+        p.brand_id"""
+
+CATALOG_PRODUCT_QUERY = f"""
+    SELECT {CATALOG_PRODUCT_COLUMNS}
+    FROM products p
+    LEFT JOIN brands b ON p.brand_id = b.brand_id
+"""
+
+def _catalog_product(row):
+    return {
+        'id': row[0],
+        'article': row[1],
+        'name': row[2],
+        'price': str(row[3]),
+        'category': row[4] if row[4] else '',
+        'material': row[5] if row[5] else '',
+        'color': row[6] if row[6] else '',
+        'size': row[7] if row[7] else '',
+        'country': row[8] if row[8] else '',
+        'gender': row[9] if row[9] else '',
+        'season': row[10] if row[10] else '',
+        'image_url': row[11] if row[11] else '',
+        'brand': row[12] if row[12] else '',
+        'brand_id': row[13]
+    }
+
+def _fetch_catalog_products(cursor):
+    # Порядок должен повторяться от запуска к запуску: номера строк в файле индексов -
+    # позиции товаров в этом списке
+    cursor.execute(CATALOG_PRODUCT_QUERY + " ORDER BY p.name, p.product_id")
+    return [_catalog_product(row) for row in cursor.fetchall()]
+
+def get_all_products():
+    connection = connect_postgres()
+    if not connection:
+        return []
+    
+    try:
+        cursor = connection.cursor()
+        
+        products = _fetch_catalog_products(cursor)
         
         cursor.close()
         connection.close()
@@ -287,6 +459,74 @@ def get_all_products():
         connection.close()
         return []
 
+def get_catalog_snapshot():
+    # (версия каталога, товары) из одного снимка базы: файл индексов, помеченный этой версией,
+    # собран именно по этим строкам. Если правка товара зафиксировалась между запросами,
+    # снимок не видит ни ее строк, ни новой версии
+    connection = connect_postgres()
+    if not connection:
+        return None, []
+    
+    try:
+        cursor = connection.cursor()
+        
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        cursor.execute("SELECT revision FROM catalog_revision WHERE state_id = 1")
+        row = cursor.fetchone()
+        products = _fetch_catalog_products(cursor)
+        
+        connection.commit()
+        cursor.close()
+        connection.close()
+        return (row[0] if row else None), products
+        
+    except Exception:
+        # Без таблицы версий каталог все равно показывается - индексы соберутся без файла
+        connection.rollback()
+        cursor.close()
+        connection.close()
+        return None, get_all_products()
+
+def get_catalog_revision():
+    connection = connect_postgres()
+    if not connection:
+        return None
+    
+    try:
+        cursor = connection.cursor()
+        
+        cursor.execute("SELECT revision FROM catalog_revision WHERE state_id = 1")
+        row = cursor.fetchone()
+        
+        cursor.close()
+        connection.close()
+        return row[0] if row else None
+        
+    except Exception:
+        cursor.close()
+        connection.close()
+        return None
+
+def get_catalog_product(product_id):
+    connection = connect_postgres()
+    if not connection:
+        return None
+    
+    try:
+        cursor = connection.cursor()
+        
+        cursor.execute(CATALOG_PRODUCT_QUERY + " WHERE p.product_id = %s", (product_id,))
+        row = cursor.fetchone()
+        
+        cursor.close()
+        connection.close()
+        return _catalog_product(row) if row else None
+        
+    except Exception:
+        cursor.close()
+        connection.close()
+        return None
+
 def add_product(product_data):
     connection = connect_postgres()
     if not connection:
@@ -668,6 +908,15 @@ def get_user_cart(user_id):
         connection.close()
         return []
 
+def _cart_line(row):
+    return {
+        'product_id': row[0],
+        'article': row[1],
+        'name': row[2],
+        'price': str(row[3]),
+        'quantity': row[4]
+    }
+
 def add_to_cart(user_id, product_id, quantity=1):
     connection = connect_postgres()
     if not connection:
@@ -676,44 +925,36 @@ def add_to_cart(user_id, product_id, quantity=1):
     try:
         cursor = connection.cursor()
         
-        cursor.execute("SELECT article FROM products WHERE product_id = %s", (product_id,))
-        product_result = cursor.fetchone()
-        
-        if not product_result:
-            cursor.close()
-            connection.close()
-            return False, "Товар не найден"
-        
-        article = product_result[0]
-        
         cursor.execute("""
-            SELECT quantity FROM cart 
-            WHERE user_id = %s AND article = %s
-        """, (user_id, article))
+            WITH product AS (
+                SELECT product_id, article, name, price
+                FROM products
+                WHERE product_id = %s
+            ),
+            line AS (
+                INSERT INTO cart (user_id, article, quantity)
+                SELECT %s, article, %s FROM product
+                ON CONFLICT (user_id, article)
+                DO UPDATE SET quantity = cart.quantity + EXCLUDED.quantity
+                RETURNING article, quantity
+            )
+            SELECT p.product_id, p.article, p.name, p.price, l.quantity
+            FROM product p
+            JOIN line l ON l.article = p.article
+        """, (product_id, user_id, quantity))
         
         result = cursor.fetchone()
         
-        if result:
-            new_quantity = result[0] + quantity
-            cursor.execute("""
-                UPDATE cart 
-                SET quantity = %s
-                WHERE user_id = %s AND article = %s
-            """, (new_quantity, user_id, article))
-        else:
-            cursor.execute("""
-                INSERT INTO cart (user_id, article, quantity)
-                VALUES (%s, %s, %s)
-            """, (user_id, article, quantity))
+        if not result:
+            connection.rollback()
+            cursor.close()
+            connection.close()
+            return False, "Товар не найден"
         
         connection.commit()
-        
-        cursor.execute("SELECT name FROM products WHERE article = %s", (article,))
-        product_name = cursor.fetchone()[0]
-        
         cursor.close()
         connection.close()
-        return True, f"Товар '{product_name}' добавлен в корзину"
+        return True, _cart_line(result)
         
     except Exception as e:
         connection.rollback()
@@ -722,6 +963,9 @@ def add_to_cart(user_id, product_id, quantity=1):
         return False, f"Ошибка при добавлении в корзину: {e}"
 
 def update_cart_item(user_id, article, quantity):
+    if quantity <= 0:
+        return remove_from_cart(user_id, article)
+    
     connection = connect_postgres()
     if not connection:
         return False, "Ошибка подключения к базе данных"
@@ -729,30 +973,23 @@ def update_cart_item(user_id, article, quantity):
     try:
         cursor = connection.cursor()
         
-        if quantity <= 0:
-            cursor.execute("""
-                DELETE FROM cart 
-                WHERE user_id = %s AND article = %s
-            """, (user_id, article))
-        else:
-            cursor.execute("""
-                UPDATE cart 
-                SET quantity = %s
-                WHERE user_id = %s AND article = %s
-            """, (quantity, user_id, article))
-        
-        connection.commit()
+        cursor.execute("""
+            UPDATE cart c
+            SET quantity = %s
+            FROM products p
+            WHERE c.user_id = %s AND c.article = %s AND p.article = c.article
+            RETURNING p.product_id, c.article, p.name, p.price, c.quantity
+        """, (quantity, user_id, article))
         
-        cursor.execute("SELECT name FROM products WHERE article = %s", (article,))
-        product_name = cursor.fetchone()
+        result = cursor.fetchone()
         
+        connection.commit()
         cursor.close()
         connection.close()
         
-        if quantity <= 0:
-            return True, f"Товар удален из корзины"
-        else:
-            return True, f"Количество товара обновлено"
+        if not result:
+            return False, "Товар не найден в корзине"
+        return True, _cart_line(result)
         
     except Exception as e:
         connection.rollback()
@@ -769,18 +1006,21 @@ def remove_from_cart(user_id, article):
         cursor = connection.cursor()
         
         cursor.execute("""
-            DELETE FROM cart 
-            WHERE user_id = %s AND article = %s
+            DELETE FROM cart c
+            USING products p
+            WHERE c.user_id = %s AND c.article = %s AND p.article = c.article
+            RETURNING p.product_id, c.article, p.name, p.price, 0
         """, (user_id, article))
         
-        connection.commit()
-        
-        cursor.execute("SELECT name FROM products WHERE article = %s", (article,))
-        product_name = cursor.fetchone()
+        result = cursor.fetchone()
         
+        connection.commit()
         cursor.close()
         connection.close()
-        return True, f"Товар удален из корзины"
+        
+        if not result:
+            return True, {'product_id': None, 'article': article, 'name': '', 'price': '0', 'quantity': 0}
+        return True, _cart_line(result)
         
     except Exception as e:
         connection.rollback()
@@ -921,10 +1161,10 @@ def create_order(user_id, cart_items):
         total_amount = sum(float(item['price']) * item['quantity'] for item in cart_items)
         
         cursor.execute("""
-            INSERT INTO orders (user_id, total_amount, status)
-            VALUES (%s, %s, %s)
+            INSERT INTO orders (user_id, total_amount, status, items_count)
+            VALUES (%s, %s, %s, %s)
             RETURNING order_id
-        """, (user_id, total_amount, 'Завершен'))
+        """, (user_id, total_amount, 'Завершен', len(cart_items)))
         
         order_id = cursor.fetchone()[0]
         
@@ -954,7 +1194,9 @@ def create_order(user_id, cart_items):
         connection.close()
         return False, f"Ошибка при создании заказа: {e}"
 
-def get_user_orders(user_id):
+ORDERS_PAGE_SIZE = 30
+
+def get_user_orders(user_id, before_date=None, before_id=None, limit=ORDERS_PAGE_SIZE):
     connection = connect_postgres()
     if not connection:
         return []
@@ -962,27 +1204,34 @@ def get_user_orders(user_id):
     try:
         cursor = connection.cursor()
         
-        cursor.execute("SELECT MIN(user_id) FROM users")
-        first_user_id = cursor.fetchone()[0]
-        
-        if user_id == first_user_id:
-            cursor.close()
-            connection.close()
-            return []
-        
-        cursor.execute("""
+        query = """
             SELECT 
                 o.order_id,
                 o.order_date,
                 o.total_amount,
                 o.status,
-                COUNT(oi.order_item_id) as items_count
+                o.items_count
             FROM orders o
-            LEFT JOIN order_items oi ON o.order_id = oi.order_id
             WHERE o.user_id = %s
-            GROUP BY o.order_id, o.order_date, o.total_amount, o.status
-            ORDER BY o.order_date DESC
-        """, (user_id,))
+            AND o.user_id != (SELECT MIN(user_id) FROM users)
+        """
+        
+        params = [user_id]
+        
+        if before_date is not None and before_id is not None:
+            query += " AND (o.order_date, o.order_id) < (%s, %s)"
+            params.extend([before_date, before_id])
+        elif before_date is not None:
+            query += " AND o.order_date < %s"
+            params.append(before_date)
+        
+        query += """
+            ORDER BY o.order_date DESC, o.order_id DESC
+            LIMIT %s
+        """
+        params.append(limit)
+        
+        cursor.execute(query, params)
         
         orders = []
         for row in cursor.fetchall():
@@ -991,7 +1240,8 @@ def get_user_orders(user_id):
                 'order_date': row[1].strftime('%d.%m.%Y %H:%M') if row[1] else '',
                 'total_amount': str(row[2]),
                 'status': row[3],
-                'items_count': row[4]
+                'items_count': row[4],
+                'cursor': (row[1], row[0])
             })
         
         cursor.close()
@@ -1054,6 +1304,85 @@ def get_sales_data(start_date=None, end_date=None):
         connection.close()
         return []
 
+def get_product_sales():
+    connection = connect_postgres()
+    if not connection:
+        return {}
+    
+    try:
+        cursor = connection.cursor()
+        
+        cursor.execute("""
+            SELECT oi.article, SUM(oi.quantity)
+            FROM order_items oi
+            JOIN orders o ON o.order_id = oi.order_id
+            WHERE oi.article IS NOT NULL
+            AND o.user_id != (SELECT MIN(user_id) FROM users)
+            GROUP BY oi.article
+        """)
+        sales = {article: int(quantity) for article, quantity in cursor.fetchall()}
+        
+        cursor.close()
+        connection.close()
+        return sales
+        
+    except Exception:
+        cursor.close()
+        connection.close()
+        return {}
+
+def _fetch_order_details(cursor, order_ids):
+    cursor.execute("""
+        SELECT 
+            o.order_id,
+            o.order_date,
+            o.total_amount,
+            o.status,
+            u.first_name,
+            u.last_name,
+            u.email,
+            COALESCE((
+                SELECT json_agg(
+                    json_build_array(
+                        oi.product_name,
+                        oi.quantity,
+                        oi.price::text,
+                        oi.total_price::text,
+                        oi.article
+                    )
+                    ORDER BY oi.order_item_id
+                )
+                FROM order_items oi
+                WHERE oi.order_id = o.order_id
+            ), '[]'::json)
+        FROM orders o
+        JOIN users u ON o.user_id = u.user_id
+        WHERE o.order_id = ANY(%s)
+        AND o.user_id != (SELECT MIN(user_id) FROM users)
+    """, (list(order_ids),))
+    
+    details = {}
+    for row in cursor.fetchall():
+        details[row[0]] = {
+            'order_id': row[0],
+            'order_date': row[1].strftime('%d.%m.%Y %H:%M') if row[1] else '',
+            'total_amount': str(row[2]),
+            'status': row[3],
+            'customer_name': f"{row[4]} {row[5]}",
+            'customer_email': row[6],
+            'items': [
+                {
+                    'product_name': item[0],
+                    'quantity': item[1],
+                    'price': item[2],
+                    'total_price': item[3],
+                    'article': item[4] if item[4] else 'Не указан'
+                }
+                for item in row[7]
+            ]
+        }
+    return details
+
 def get_order_details(order_id):
     connection = connect_postgres()
     if not connection:
@@ -1061,68 +1390,219 @@ def get_order_details(order_id):
     
     try:
         cursor = connection.cursor()
+        details = _fetch_order_details(cursor, [order_id])
+        cursor.close()
+        connection.close()
+        return details.get(order_id)
         
-        cursor.execute("SELECT MIN(user_id) FROM users")
-        first_user_id = cursor.fetchone()[0]
+    except Exception:
+        cursor.close()
+        connection.close()
+        return None
+
+def get_orders_details(order_ids):
+    if not order_ids:
+        return {}
+    
+    connection = connect_postgres()
+    if not connection:
+        return {}
+    
+    try:
+        cursor = connection.cursor()
+        details = _fetch_order_details(cursor, order_ids)
+        cursor.close()
+        connection.close()
+        return details
         
-        cursor.execute("""
-            SELECT 
-                o.order_id,
-                o.order_date,
-                o.total_amount,
-                o.status,
-                u.first_name,
-                u.last_name,
-                u.email
-            FROM orders o
-            JOIN users u ON o.user_id = u.user_id
-            WHERE o.order_id = %s
-            AND o.user_id != %s
-        """, (order_id, first_user_id))
+    except Exception:
+        cursor.close()
+        connection.close()
+        return {}
+
+# Сколько рекомендаций хранится для каждого артикула, сколько раз пара должна встретиться
+# в заказах, чтобы попасть в них, и сколько рекомендаций показывается
+RECOMMENDATIONS_PER_ARTICLE = 10
+RECOMMENDATION_MIN_SUPPORT = 2
+RECOMMENDATIONS_SHOWN = 5
+
+# Граница last_order_id сдвигается только по заказам старше этого числа секунд: к тому времени
+# заказы с меньшими номерами уже зафиксированы
+RECOMMENDATION_ORDER_LAG = 3600
+
+# Окно приложения после оформления заказа обновляет рекомендации не чаще этого числа секунд:
+# основное обновление - пакетный запуск recommendations.py
+RECOMMENDATION_REFRESH_INTERVAL = 600
+
+def refresh_recommendations(min_support=RECOMMENDATION_MIN_SUPPORT, top_k=RECOMMENDATIONS_PER_ARTICLE, rebuild=False,
+                            min_interval=None):
+    # Пары считаются только по еще не учтенным заказам, а списки рекомендаций
+    # пересобираются только для артикулов из этих заказов. rebuild пересчитывает все заново,
+    # например после смены min_support или top_k. С min_interval (секунды) обновление
+    # пропускается, если оно было недавно или его уже выполняет другой клиент
+    connection = connect_postgres()
+    if not connection:
+        return False, "Ошибка подключения к базе данных"
+    
+    try:
+        cursor = connection.cursor()
         
-        order_result = cursor.fetchone()
+        if rebuild:
+            cursor.execute("""
+                TRUNCATE product_pairs, product_recommendations, recommendation_state, recommendation_orders
+            """)
         
-        if not order_result:
+        # Блокировка строки состояния не дает двум обновлениям учесть одни заказы дважды
+        cursor.execute("INSERT INTO recommendation_state (state_id) VALUES (1) ON CONFLICT DO NOTHING")
+        if min_interval is None:
+            cursor.execute("SELECT last_order_id FROM recommendation_state WHERE state_id = 1 FOR UPDATE")
+        else:
+            # Клиенты не ждут друг друга на строке состояния: занятая строка пропускается
+            cursor.execute("""
+                SELECT last_order_id FROM recommendation_state
+                WHERE state_id = 1
+                AND (refreshed_at IS NULL OR refreshed_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+                FOR UPDATE SKIP LOCKED
+            """, (min_interval,))
+        row = cursor.fetchone()
+        if row is None:
+            connection.rollback()
             cursor.close()
             connection.close()
-            return None
+            return True, 0
+        last_order_id = row[0]
         
+        # Заказ, зафиксированный позже заказа с большим номером, не будет пропущен:
+        # учитываются все заказы за границей, которых нет в recommendation_orders
         cursor.execute("""
-            SELECT 
-                oi.product_name,
-                oi.quantity,
-                oi.price,
-                oi.total_price,
-                oi.article
+            CREATE TEMP TABLE new_orders ON COMMIT DROP AS
+            SELECT o.order_id, o.user_id
+            FROM orders o
+            WHERE o.order_id > %s
+            AND NOT EXISTS (SELECT 1 FROM recommendation_orders r WHERE r.order_id = o.order_id)
+        """, (last_order_id,))
+        
+        # Как и в get_product_sales, заказы первого пользователя не учитываются
+        cursor.execute("""
+            CREATE TEMP TABLE new_order_items ON COMMIT DROP AS
+            SELECT DISTINCT oi.order_id, oi.article
             FROM order_items oi
-            WHERE oi.order_id = %s
-            ORDER BY oi.order_item_id
-        """, (order_id,))
+            JOIN new_orders o ON o.order_id = oi.order_id
+            WHERE oi.article IS NOT NULL
+            AND o.user_id != (SELECT MIN(user_id) FROM users)
+        """)
         
-        items = []
-        for row in cursor.fetchall():
-            items.append({
-                'product_name': row[0],
-                'quantity': row[1],
-                'price': str(row[2]),
-                'total_price': str(row[3]),
-                'article': row[4] if row[4] else 'Не указан'
-            })
+        cursor.execute("""
+            INSERT INTO product_pairs (article, paired_article, orders_count)
+            SELECT a.article, b.article, COUNT(*)
+            FROM new_order_items a
+            JOIN new_order_items b ON b.order_id = a.order_id AND b.article != a.article
+            GROUP BY a.article, b.article
+            ON CONFLICT (article, paired_article)
+            DO UPDATE SET orders_count = product_pairs.orders_count + EXCLUDED.orders_count
+        """)
+        
+        cursor.execute("""
+            CREATE TEMP TABLE changed_articles ON COMMIT DROP AS
+            SELECT DISTINCT article FROM new_order_items
+        """)
+        
+        cursor.execute("""
+            DELETE FROM product_recommendations r
+            USING changed_articles c
+            WHERE r.article = c.article
+        """)
+        
+        cursor.execute("""
+            INSERT INTO product_recommendations (article, position, recommended_article, orders_count)
+            SELECT article, position, paired_article, orders_count
+            FROM (
+                SELECT 
+                    p.article,
+                    p.paired_article,
+                    p.orders_count,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY p.article
+                        ORDER BY p.orders_count DESC, p.paired_article
+                    ) AS position
+                FROM product_pairs p
+                JOIN changed_articles c ON c.article = p.article
+                WHERE p.orders_count >= %s
+            ) ranked
+            WHERE position <= %s
+        """, (min_support, top_k))
+        
+        cursor.execute("SELECT COUNT(*) FROM changed_articles")
+        changed = cursor.fetchone()[0]
+        
+        cursor.execute("INSERT INTO recommendation_orders (order_id) SELECT order_id FROM new_orders")
+        
+        # Все видимые заказы за границей теперь учтены; граница сдвигается до последнего
+        # достаточно старого из них, и номера до нее больше не нужно хранить по одному
+        cursor.execute("""
+            SELECT COALESCE(MAX(order_id), %s)
+            FROM orders
+            WHERE order_id > %s
+            AND order_date < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+        """, (last_order_id, last_order_id, RECOMMENDATION_ORDER_LAG))
+        last_order_id = cursor.fetchone()[0]
+        
+        cursor.execute("DELETE FROM recommendation_orders WHERE order_id <= %s", (last_order_id,))
+        cursor.execute("""
+            UPDATE recommendation_state
+            SET last_order_id = %s, refreshed_at = CURRENT_TIMESTAMP
+            WHERE state_id = 1
+        """, (last_order_id,))
         
+        connection.commit()
         cursor.close()
         connection.close()
+        return True, changed
         
-        return {
-            'order_id': order_result[0],
-            'order_date': order_result[1].strftime('%d.%m.%Y %H:%M') if order_result[1] else '',
-            'total_amount': str(order_result[2]),
-            'status': order_result[3],
-            'customer_name': f"{order_result[4]} {order_result[5]}",
-            'customer_email': order_result[6],
-            'items': items
-        }
+    except Exception as e:
+        connection.rollback()
+        cursor.close()
+        connection.close()
+        return False, f"Ошибка при обновлении рекомендаций: {e}"
+
+def get_recommendations(articles, limit=RECOMMENDATIONS_SHOWN):
+    # Товары, которые чаще всего покупают вместе с указанными артикулами: одно чтение
+    # по первичному ключу product_recommendations. Для нескольких артикулов (корзина)
+    # число совместных заказов складывается, сами артикулы в ответ не попадают
+    articles = list(articles)
+    if not articles:
+        return []
+    
+    connection = connect_postgres()
+    if not connection:
+        return []
+    
+    try:
+        cursor = connection.cursor()
+        
+        cursor.execute(f"""
+            SELECT {CATALOG_PRODUCT_COLUMNS},
+                r.orders_count
+            FROM product_recommendations r
+            JOIN products p ON p.article = r.recommended_article
+            LEFT JOIN brands b ON p.brand_id = b.brand_id
+            WHERE r.article = ANY(%s)
+            AND r.recommended_article != ALL(%s)
+        """, (articles, articles))
+        
+        products = {}
+        scores = {}
+        for row in cursor.fetchall():
+            product = _catalog_product(row)
+            products[product['article']] = product
+            scores[product['article']] = scores.get(product['article'], 0) + row[14]
+        
+        cursor.close()
+        connection.close()
+        ranked = sorted(products, key=lambda article: (-scores[article], article))
+        return [products[article] for article in ranked[:limit]]
         
     except Exception:
         cursor.close()
         connection.close()
-        return None
\ No newline at end of file
+        return []
\ No newline at end of file
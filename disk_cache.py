@@ -0,0 +1,223 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Предел размера кэша картинок на диске; на киосках с маленьким диском задается переменной окружения
+DISK_CACHE_BYTES = int(os.environ.get('STORE_IMAGE_CACHE_MB', '256')) * 1024 * 1024
+
+# Файл индекса в каталоге кэша
+INDEX_NAME = 'index.sqlite3'
+
+# Время обращения записывается не чаще, чем раз в столько секунд: для порядка вытеснения
+# точнее не нужно, а запись на каждое чтение замедлила бы показ карточек
+ACCESS_UPDATE_INTERVAL = 60
+
+# Сколько самых старых записей выбирается за один шаг вытеснения
+EVICTION_BATCH = 64
+
+
+class DiskImageCache:
+    # Файлы картинок <md5(url)>.png и индекс в SQLite: URL, размер, время последнего обращения,
+    # тип содержимого и ETag. При записи сверх предела удаляются давно не использованные файлы
+    def __init__(self, directory, max_bytes=DISK_CACHE_BYTES):
+        self.directory = Path(directory)
+        self.directory.mkdir(exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        # Сумма размеров по индексу: считается в repair и поддерживается при каждом изменении
+        self.total_bytes = 0
+        self.connection = self.open_index()
+        self.repair()
+
+    def open_index(self):
+        path = self.directory / INDEX_NAME
+        try:
+            return self.create_index(path)
+        except sqlite3.DatabaseError:
+            # Поврежденный индекс не нужен: repair восстановит его по файлам в каталоге
+            path.unlink(missing_ok=True)
+            return self.create_index(path)
+
+    @staticmethod
+    def create_index(path):
+        connection = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                file_name TEXT PRIMARY KEY,
+                url TEXT,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                content_type TEXT,
+                etag TEXT
+            )
+        """)
+        connection.execute("CREATE INDEX IF NOT EXISTS idx_entries_access ON entries (last_access)")
+        return connection
+
+    @staticmethod
+    def get_file_name(url):
+        return f"{hashlib.md5(url.encode()).hexdigest()}.png"
+
+    def get_path(self, url):
+        # Путь к файлу картинки или None, если ее нет в кэше
+        file_name = self.get_file_name(url)
+        path = self.directory / file_name
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT last_access FROM entries WHERE file_name = ?", (file_name,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if not path.exists():
+                # Файл удалили в обход кэша
+                self.delete_entry(file_name)
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            now = time.time()
+            if now - row[0] > ACCESS_UPDATE_INTERVAL:
+                self.connection.execute(
+                    "UPDATE entries SET last_access = ? WHERE file_name = ?", (now, file_name))
+            return path
+
+    def get_entry(self, url):
+        with self.lock:
+            row = self.connection.execute("""
+                SELECT url, size, last_access, content_type, etag
+                FROM entries WHERE file_name = ?
+            """, (self.get_file_name(url),)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('url', 'size', 'last_access', 'content_type', 'etag'), row))
+
+    def put(self, url, data, content_type=None, etag=None):
+        # Файл пишется во временный и подменяется целиком: при сбое не остается половины картинки
+        if len(data) > self.max_bytes:
+            return None
+
+        file_name = self.get_file_name(url)
+        path = self.directory / file_name
+        # У каждой записи свой временный файл: одну картинку могут одновременно сохранять два потока
+        descriptor, temporary_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                file.write(data)
+            os.replace(temporary_path, path)
+        except OSError:
+            Path(temporary_path).unlink(missing_ok=True)
+            raise
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT size FROM entries WHERE file_name = ?", (file_name,)).fetchone()
+            self.connection.execute("""
+                INSERT INTO entries (file_name, url, size, last_access, content_type, etag)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (file_name) DO UPDATE SET
+                    url = excluded.url,
+                    size = excluded.size,
+                    last_access = excluded.last_access,
+                    content_type = excluded.content_type,
+                    etag = excluded.etag
+            """, (file_name, url, len(data), time.time(), content_type, etag))
+            self.total_bytes += len(data) - (row[0] if row else 0)
+            self.writes += 1
+            self.evict(keep=file_name)
+        return path
+
+    def remove(self, url):
+        file_name = self.get_file_name(url)
+        with self.lock:
+            self.delete_entry(file_name)
+        (self.directory / file_name).unlink(missing_ok=True)
+
+    def delete_entry(self, file_name):
+        # Вызывается под блокировкой
+        row = self.connection.execute("SELECT size FROM entries WHERE file_name = ?", (file_name,)).fetchone()
+        if row is not None:
+            self.connection.execute("DELETE FROM entries WHERE file_name = ?", (file_name,))
+            self.total_bytes -= row[0]
+
+    def evict(self, keep=None):
+        # Вызывается под блокировкой. Только что записанный файл не вытесняется
+        while self.total_bytes > self.max_bytes:
+            rows = self.connection.execute("""
+                SELECT file_name, size FROM entries
+                WHERE file_name IS NOT ?
+                ORDER BY last_access
+                LIMIT ?
+            """, (keep, EVICTION_BATCH)).fetchall()
+            if not rows:
+                break
+            for file_name, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                (self.directory / file_name).unlink(missing_ok=True)
+                self.connection.execute("DELETE FROM entries WHERE file_name = ?", (file_name,))
+                self.total_bytes -= size
+                self.evictions += 1
+
+    def repair(self):
+        # Сверка индекса с каталогом при запуске: записи без файлов удаляются, файлы без записей
+        # (скачанные до появления индекса) добавляются со временем изменения файла,
+        # размеры обновляются, недописанные временные файлы удаляются
+        files = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                if entry.name.endswith('.tmp'):
+                    os.remove(entry.path)
+                elif entry.name.endswith('.png'):
+                    stat = entry.stat()
+                    files[entry.name] = (stat.st_size, stat.st_mtime)
+
+        with self.lock:
+            self.connection.execute("BEGIN")
+            indexed = dict(self.connection.execute("SELECT file_name, size FROM entries"))
+            for file_name in indexed.keys() - files.keys():
+                self.connection.execute("DELETE FROM entries WHERE file_name = ?", (file_name,))
+            for file_name, (size, modified) in files.items():
+                if file_name not in indexed:
+                    self.connection.execute(
+                        "INSERT INTO entries (file_name, size, last_access) VALUES (?, ?, ?)",
+                        (file_name, size, modified))
+                elif indexed[file_name] != size:
+                    self.connection.execute(
+                        "UPDATE entries SET size = ? WHERE file_name = ?", (size, file_name))
+            self.total_bytes = self.connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            self.evict()
+            self.connection.execute("COMMIT")
+
+    def clear(self):
+        with self.lock:
+            for (file_name,) in self.connection.execute("SELECT file_name FROM entries").fetchall():
+                (self.directory / file_name).unlink(missing_ok=True)
+            self.connection.execute("DELETE FROM entries")
+            self.total_bytes = 0
+
+    def get_stats(self):
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            total = self.total_bytes
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': total,
+            'max_bytes': self.max_bytes
+        }
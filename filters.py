@@ -1,13 +1,136 @@
+import math
+import threading
+import time
+from array import array
+from collections import defaultdict, namedtuple, OrderedDict
+from functools import wraps
+from operator import attrgetter
+from itertools import compress, repeat
 import config
+from normalization import normalize_text, query_variants
+from query_language import parse_query, price_bounds, format_predicate
+from search_index import (TrigramIndex, SoundIndex, FuzzyIndex, SuggestionIndex, RankedResults,
+                          SortedValueIndex, AttributeIndex, tokenize, rows_to_bitmap, bitmap_to_rows, filter_rows_by_bitmap,
+                          rows_to_flags, inverse_permutation, union_bitmaps)
+
+# Сколько предыдущих состояний фильтра хранится для уточнения результатов при наборе
+REFINEMENT_DEPTH = 8
+
+# Сколько результатов фильтрации помнить для возврата к уже выбранным фильтрам
+RESULT_CACHE_SIZE = 64
+
+# Нечеткий поиск: сколько лучших товаров показывать и сколько времени (с) тратить на запрос
+FUZZY_RESULT_LIMIT = 200
+FUZZY_TIME_BUDGET = 0.012
+
+# Ранжирование: уровень совпадения важнее продаж, продажи (log(1 + шт.)) упорядочивают
+# товары внутри уровня. Уровни: 0 - артикул целиком, 1 - начало названия,
+# 2 - начало слова, 3 - подстрока, 4 - только по звучанию
+TIER_WEIGHT = 10
+SALES_BOOST_LIMIT = 9.0
+SOUND_TIER = 4
+
+# Сколько карточек товаров выводится за раз
+RESULTS_PAGE_SIZE = 60
+
+# Варианты сортировки каталога: ключ -> (подпись, перестановка, по убыванию)
+SORT_ORDERS = {
+    "relevance": ("По релевантности", None, False),
+    "name": ("По названию", "name", False),
+    "price_asc": ("Сначала дешевле", "price", False),
+    "price_desc": ("Сначала дороже", "price", True),
+    "sales": ("Сначала популярные", "sales", True),
+    "newest": ("Сначала новые", "product_id", True)
+}
+
+# Характеристики товара, по которым можно фильтровать: поле -> подпись
+ATTRIBUTE_FILTERS = {
+    "material": "Материал",
+    "color": "Цвет",
+    "size": "Размер",
+    "gender": "Пол",
+    "season": "Сезон",
+    "country": "Страна"
+}
+
+# Шаг плана фильтрации: описание, оценка числа строк и функция, строящая битовую карту шага.
+# У текстового поиска функции нет - он выполняется последним по строкам, отобранным остальными шагами
+PlanStep = namedtuple('PlanStep', 'description estimate get_bitmap')
+
+# Строки каталога для set_catalog_index, подготовленные заранее (prepare_catalog_rows):
+# список строк, номер строки по товару и вес продаж каждой строки
+CatalogRows = namedtuple('CatalogRows', 'rows row_by_product_id sales_boosts')
+
+# Если отобрано больше этой доли каталога, дешевле пройти готовую перестановку,
+# чем сортировать отобранные строки
+PERMUTATION_WALK_SHARE = 0.125
+
+def synchronized(method):
+    # Поиск из строки ввода идет в фоновом потоке: индексы и кэши меняются только под блокировкой
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class ProductFilter:
     def __init__(self):
         self.selected_brands = []
         self.selected_categories = []
         self.search_text = ""
+        self.search_predicates = ()
+        self.search_mode = "exact"
+        self.sort_order = "relevance"
+        self.price_range = None
+        self.selected_attributes = {}
         self.brand_id_to_name = {}
         self.brand_name_to_id = {}
         
+        # Каталог хранится построчно: номер строки - позиция товара в индексе,
+        # у удаленных товаров вместо строки остается None, а вместо ключа - пустая строка
+        self.catalog = None
+        self.rows = []
+        self.search_keys = []
+        self.sales_boosts = []
+        self.row_by_product_id = {}
+        self.search_index = TrigramIndex()
+        self.sound_index = SoundIndex()
+        self.fuzzy_index = None
+        self.suggestion_index = SuggestionIndex()
+        self.catalog_revision = 0
+        
+        # Продажи по артикулам: вес подсказок в строке поиска
+        self.sales = {}
+        
+        # Перестановки строк каталога для сортировки: вариант -> (порядок строк, позиция строки в порядке)
+        self.permutations = {}
+        
+        # Битовые карты строк каталога: бит N установлен, если товар в строке N подходит
+        self.category_bitmaps = {}
+        self.brand_bitmaps = {}
+        self.price_index = SortedValueIndex()
+        self.attribute_index = AttributeIndex(ATTRIBUTE_FILTERS)
+        
+        # Количество товаров по значениям характеристик для последнего запрошенного состояния
+        self.facet_counts = (None, None)
+        
+        # Стек (состояние фильтра -> номера строк результата) для набора запроса по буквам
+        self.refinements = []
+        
+        # Результаты недавних состояний фильтра в порядке использования: состояние -> номера строк.
+        # Состояние включает ревизию каталога, поэтому после изменения каталога кэш сбрасывается
+        self.result_cache = OrderedDict()
+        self.result_cache_revision = None
+        
+        # Число строк у значений фильтров для оценки избирательности: (вид, значение) -> строк
+        self.cardinalities = {}
+        self.cardinalities_revision = None
+        
+        # Время этапов последнего запроса результатов, с: filter - отбор строк, rank - упорядочивание
+        self.last_timings = {}
+        self.lock = threading.RLock()
+        
     def set_selected_brands(self, brand_ids):
         self.selected_brands = brand_ids
         
@@ -15,17 +138,90 @@ class ProductFilter:
         self.selected_categories = categories
         
     def set_search_text(self, text):
-        self.search_text = text.lower().strip()
+        # Условия вида brand:Nike или price<5000 отделяются от текста поиска
+        query = parse_query(text)
+        self.search_text = query.text.lower().strip()
+        self.search_predicates = query.predicates
+        
+    def set_selected_attribute(self, name, values):
+        if values:
+            self.selected_attributes[name] = list(values)
+        else:
+            self.selected_attributes.pop(name, None)
+        
+    def set_price_range(self, low=None, high=None):
+        self.price_range = None if low is None and high is None else (low, high)
+        
+    def set_sort_order(self, sort_order):
+        self.sort_order = sort_order
+        
+    def set_search_mode(self, mode):
+        self.search_mode = mode
+        if mode == "fuzzy" and self.fuzzy_index is None:
+            self.build_fuzzy_index()
         
     def load_brand_mappings(self):
         try:
-            brands = config.get_all_brands()
-            self.brand_id_to_name = {brand['id']: brand['name'] for brand in brands}
-            self.brand_name_to_id = {brand['name']: brand['id'] for brand in brands}
+            self.set_brand_mappings(config.get_all_brands())
         except Exception:
             self.brand_id_to_name = {}
             self.brand_name_to_id = {}
             
+    def set_brand_mappings(self, brands):
+        self.brand_id_to_name = {brand['id']: brand['name'] for brand in brands}
+        self.brand_name_to_id = {brand['name']: brand['id'] for brand in brands}
+            
+    def load_sales(self):
+        try:
+            self.sales = config.get_product_sales()
+        except Exception:
+            self.sales = {}
+            
+    @staticmethod
+    def get_price(product):
+        try:
+            return float(product.get('price') or 0)
+        except ValueError:
+            return 0.0
+            
+    def get_price_bounds(self):
+        return self.price_index.bounds()
+        
+    def get_sales_boost(self, product):
+        return self.compute_sales_boost(self.sales, product)
+        
+    @staticmethod
+    def compute_sales_boost(sales, product):
+        return min(math.log1p(sales.get(product.get('article'), 0)), SALES_BOOST_LIMIT)
+        
+    @staticmethod
+    def prepare_catalog_rows(products, product_ids, sales):
+        # Проходы по всему каталогу для set_catalog_index. ProductFilter не затрагивается,
+        # поэтому их можно выполнить в фоновом потоке вместе с чтением индексов
+        return CatalogRows(list(products), dict(zip(product_ids, range(len(products)))),
+                           [ProductFilter.compute_sales_boost(sales, product) for product in products])
+        
+    @staticmethod
+    def get_suggestion_texts(product):
+        return [product.get('name', ''), product.get('brand', ''), product.get('article', '')]
+        
+    def get_suggestion_items(self, product):
+        weight = self.sales.get(product.get('article'), 0)
+        return [(text, weight) for text in self.get_suggestion_texts(product)]
+        
+    @synchronized
+    def get_suggestions(self, text):
+        for variant in query_variants(text):
+            if variant:
+                suggestions = self.suggestion_index.suggest(variant)
+                if suggestions:
+                    return suggestions
+        return []
+        
+    def get_product(self, product_id):
+        row = self.row_by_product_id.get(product_id)
+        return None if row is None else self.rows[row]
+        
     def get_selected_brand_names(self):
         selected_names = []
         for brand_id in self.selected_brands:
@@ -34,37 +230,557 @@ class ProductFilter:
                 selected_names.append(brand_name)
         return selected_names
         
-    def filter_products(self, all_products):
-        filtered = all_products
+    @staticmethod
+    def get_search_key(product):
+        # Ключ нормализуется один раз при загрузке: регистр, ё, транслитерация в латиницу
+        return f"{normalize_text(product.get('name', ''))}\n{normalize_text(product.get('article', ''))}"
         
-        if self.selected_categories:
-            filtered = [p for p in filtered if p.get('category') in self.selected_categories]
+    @staticmethod
+    def get_search_terms(product):
+        article = normalize_text(product.get('article', ''))
+        terms = set(tokenize(normalize_text(product.get('name', ''))))
+        terms.update(tokenize(article))
+        if article:
+            terms.add(article)
+        return terms
+        
+    @staticmethod
+    def get_product_attributes(product):
+        return [product.get(name) or '' for name in ATTRIBUTE_FILTERS]
+        
+    @synchronized
+    def build_fuzzy_index(self):
+        self.fuzzy_index = FuzzyIndex()
+        for row, product in enumerate(self.rows):
+            if product is not None:
+                self.fuzzy_index.add(row, self.get_search_terms(product))
+        self.fuzzy_index.sort_terms()
+        
+    @synchronized
+    def set_catalog(self, products):
+        self.catalog = products
+        self.rows = []
+        self.search_keys = []
+        self.sales_boosts = []
+        self.row_by_product_id = {}
+        self.search_index.clear()
+        self.sound_index.clear()
+        self.permutations = {}
+        self.catalog_revision += 1
+        
+        category_rows = defaultdict(list)
+        brand_rows = defaultdict(list)
+        for product in products:
+            row = self.append_row(product)
+            category_rows[product.get('category', '')].append(row)
+            brand_rows[product.get('brand_id')].append(row)
+            
+        self.suggestion_index.build(item for product in products
+                                    for item in self.get_suggestion_items(product))
+        
+        self.category_bitmaps = {category: rows_to_bitmap(rows) for category, rows in category_rows.items()}
+        self.brand_bitmaps = {brand_id: rows_to_bitmap(rows) for brand_id, rows in brand_rows.items()}
+        self.price_index.build((self.get_price(product), row) for row, product in enumerate(self.rows))
+        self.attribute_index.build(map(self.get_product_attributes, products))
+        
+        # Индекс опечаток строится только когда нечеткий поиск включен
+        self.fuzzy_index = None
+        if self.search_mode == "fuzzy":
+            self.build_fuzzy_index()
             
+    @synchronized
+    def set_catalog_index(self, products, index, catalog_rows=None):
+        # То же, что set_catalog, но индексы уже собраны (index_file.CatalogIndex) для этого
+        # списка товаров: номер строки - позиция товара в products. Заново считается только то,
+        # что зависит от продаж - они меняются без смены версии каталога. С catalog_rows,
+        # подготовленными для этих товаров и текущих продаж, проходов по каталогу здесь не остается
+        if catalog_rows is None:
+            catalog_rows = self.prepare_catalog_rows(products, index.product_ids, self.sales)
+        self.catalog = products
+        self.rows = catalog_rows.rows
+        self.search_keys = index.search_keys
+        self.row_by_product_id = catalog_rows.row_by_product_id
+        self.search_index.load(index.trigram_postings)
+        self.sound_index.load(index.sound_postings)
+        self.category_bitmaps = dict(index.category_bitmaps)
+        self.brand_bitmaps = dict(index.brand_bitmaps)
+        self.price_index.load(index.price_values, index.price_rows)
+        self.attribute_index.load(index.attribute_profiles, index.row_profiles, index.attribute_postings)
+        self.permutations = dict(index.permutations)
+        self.sales_boosts = catalog_rows.sales_boosts
+        self.catalog_revision += 1
+        
+        # Подсказки разбираются при первом обращении; их веса - продажи, поэтому считаются
+        # по товарам на момент загрузки, а не хранятся в файле
+        rows = tuple(products)
+        
+        def load_suggestions():
+            keys, counts = index.get_suggestions()
+            weights = dict.fromkeys(counts, 0)
+            for product in rows:
+                if self.sales.get(product.get('article')):
+                    for text, weight in self.get_suggestion_items(product):
+                        if text:
+                            weights[text] += weight
+            return keys, counts, weights
+            
+        self.suggestion_index.load(load_suggestions)
+        
+        self.fuzzy_index = None
+        if self.search_mode == "fuzzy":
+            self.build_fuzzy_index()
+            
+    def append_row(self, product):
+        row = len(self.rows)
+        key = self.get_search_key(product)
+        self.rows.append(product)
+        self.search_keys.append(key)
+        self.sales_boosts.append(self.get_sales_boost(product))
+        self.row_by_product_id[product.get('id')] = row
+        self.search_index.add(row, key)
+        self.sound_index.add(row, key)
+        return row
+        
+    @synchronized
+    def add_product(self, product):
+        self.remove_product(product.get('id'))
+        row = self.append_row(product)
+        
+        bit = 1 << row
+        category = product.get('category', '')
+        self.category_bitmaps[category] = self.category_bitmaps.get(category, 0) | bit
+        brand_id = product.get('brand_id')
+        self.brand_bitmaps[brand_id] = self.brand_bitmaps.get(brand_id, 0) | bit
+        self.price_index.add(row, self.get_price(product))
+        self.attribute_index.add(row, self.get_product_attributes(product))
+        
+        if self.fuzzy_index is not None:
+            self.fuzzy_index.add(row, self.get_search_terms(product))
+        for text, weight in self.get_suggestion_items(product):
+            self.suggestion_index.add(text, weight)
+        
+        # Новая строка попадает в конец каталога - перестановки пересчитаются при следующей сортировке.
+        # При удалении они остаются верными: удаленной строки просто нет среди отобранных
+        self.permutations = {}
+        self.catalog_revision += 1
+        return row
+        
+    @synchronized
+    def remove_product(self, product_id):
+        row = self.row_by_product_id.pop(product_id, None)
+        if row is None:
+            return False
+        
+        product = self.rows[row]
+        bit = ~(1 << row)
+        category = product.get('category', '')
+        self.category_bitmaps[category] = self.category_bitmaps.get(category, 0) & bit
+        brand_id = product.get('brand_id')
+        self.brand_bitmaps[brand_id] = self.brand_bitmaps.get(brand_id, 0) & bit
+        self.price_index.remove(row, self.get_price(product))
+        self.attribute_index.remove(row)
+        
+        if self.fuzzy_index is not None:
+            self.fuzzy_index.remove(row, self.get_search_terms(product))
+        for text, weight in self.get_suggestion_items(product):
+            self.suggestion_index.remove(text, weight)
+        
+        self.search_index.remove(row, self.search_keys[row])
+        self.sound_index.remove(row, self.search_keys[row])
+        self.rows[row] = None
+        self.search_keys[row] = ""
+        self.catalog_revision += 1
+        return True
+        
+    def search_rows(self, text, bitmap=None):
+        candidates = self.search_index.candidates(text)
+        keys = self.search_keys
+        
+        if candidates is None:
+            # Для запросов короче триграммы индекс не помогает - просматриваем все строки
+            rows = list(compress(range(len(keys)), map(str.__contains__, keys, repeat(text))))
+            return rows if bitmap is None else filter_rows_by_bitmap(rows, bitmap)
+        
+        # Кандидатов вне остальных фильтров отбрасываем до проверки подстроки
+        if bitmap is not None:
+            candidates = filter_rows_by_bitmap(candidates, bitmap)
+        
+        # Проверка кандидатов целиком на уровне C: без цикла Python по каждой строке
+        candidate_keys = map(keys.__getitem__, candidates)
+        return list(compress(candidates, map(str.__contains__, candidate_keys, repeat(text))))
+        
+    def search_sound_rows(self, text):
+        # Каждое слово запроса должно найтись подстрокой или совпасть по звучанию с целым словом
+        result = None
+        for token in tokenize(text):
+            rows = set(self.search_rows(token))
+            rows.update(self.sound_index.rows(token))
+            result = rows if result is None else result & rows
+            if not result:
+                return []
+        return sorted(result) if result else []
+        
+    def search_query_rows(self, variants, bitmap=None, scan_rows=None):
+        # Берется первый вариант запроса, давший строки среди отобранных остальными фильтрами.
+        # scan_rows - отобранные строки, если их меньше, чем кандидатов из индекса
+        for variant in variants:
+            if scan_rows is not None:
+                rows = self.narrow_rows(scan_rows, variant)
+            else:
+                rows = self.search_rows(variant, bitmap)
+            if rows:
+                return rows
+        for variant in variants:
+            rows = self.search_sound_rows(variant)
+            if bitmap is not None:
+                rows = filter_rows_by_bitmap(rows, bitmap)
+            if rows:
+                return rows
+        return []
+        
+    def score_rows(self, rows):
+        keys = list(map(self.search_keys.__getitem__, rows))
+        boosts = map(self.sales_boosts.__getitem__, rows)
+        
+        # Вариант запроса (как набран или в другой раскладке), который дал эти строки
+        query = next((variant for variant in query_variants(self.search_text)
+                      if keys and variant in keys[0]), None)
+        if query is None:
+            return [SOUND_TIER * TIER_WEIGHT - boost for boost in boosts]
+        
+        # Признаки считаются встроенными методами str по всему списку сразу
+        exact = map(str.endswith, keys, repeat('\n' + query))
+        prefix = map(str.startswith, keys, repeat(query))
+        word = map(str.__contains__, keys, repeat(' ' + query))
+        article = map(str.__contains__, keys, repeat('\n' + query))
+        return [(0 if is_exact else 1 if is_prefix else 2 if is_word or is_article else 3) * TIER_WEIGHT - boost
+                for is_exact, is_prefix, is_word, is_article, boost in zip(exact, prefix, word, article, boosts)]
+        
+    def narrow_rows(self, rows, text):
+        keys = self.search_keys
+        row_keys = map(keys.__getitem__, rows)
+        return list(compress(rows, map(str.__contains__, row_keys, repeat(text))))
+        
+    def get_filter_state(self):
+        # Порядок выбора значений на результат не влияет, поэтому значения упорядочиваются:
+        # одинаковые фильтры дают одно и то же состояние
+        return (self.catalog_revision, self.search_mode, self.search_text,
+                tuple(sorted(self.selected_categories)), tuple(sorted(self.selected_brands)), self.price_range,
+                tuple(sorted((name, tuple(sorted(values))) for name, values in self.selected_attributes.items())),
+                self.search_predicates)
+        
+    @staticmethod
+    def extends_state(previous_state, state):
+        # Новый запрос содержит старый при тех же остальных фильтрах - результат будет подмножеством.
+        # Для нечеткого поиска это не так, поэтому его результаты не уточняются
+        return (previous_state[:2] == state[:2] and state[1] == "exact"
+                and previous_state[3:] == state[3:] and previous_state[2] in state[2])
+        
+    def get_cardinality(self, kind, bitmaps, key):
+        if self.cardinalities_revision != self.catalog_revision:
+            self.cardinalities = {}
+            self.cardinalities_revision = self.catalog_revision
+            
+        count = self.cardinalities.get((kind, key))
+        if count is None:
+            count = bin(bitmaps.get(key, 0)).count('1')
+            self.cardinalities[(kind, key)] = count
+        return count
+        
+    def get_values_step(self, description, kind, bitmaps, keys):
+        # Значения одного фильтра объединяются, поэтому строк не больше суммы их количеств
+        estimate = sum(self.get_cardinality(kind, bitmaps, key) for key in keys)
+        return PlanStep(description, estimate,
+                        lambda: union_bitmaps(bitmaps.get(key, 0) for key in keys))
+        
+    def get_price_step(self, description, low, high, strict_low=False, strict_high=False):
+        return PlanStep(description, self.price_index.count(low, high, strict_low, strict_high),
+                        lambda: rows_to_bitmap(self.price_index.range_rows(low, high, strict_low, strict_high)))
+        
+    def get_predicate_step(self, predicate):
+        description = format_predicate(predicate)
+        field = predicate.field
+        if field == "price":
+            return self.get_price_step(description, *price_bounds(predicate))
+        
+        # Значения в запросе сравниваются без учета регистра
+        if field == "brand":
+            kind, bitmaps = field, self.brand_bitmaps
+            keys = [brand_id for name, brand_id in self.brand_name_to_id.items()
+                    if name.casefold() in predicate.value]
+        elif field == "category":
+            kind, bitmaps = field, self.category_bitmaps
+            keys = [category for category in bitmaps if category.casefold() in predicate.value]
+        else:
+            kind, bitmaps = field, self.attribute_index.postings[field]
+            keys = [value for value in bitmaps if value.casefold() in predicate.value]
+        return self.get_values_step(description, kind, bitmaps, keys)
+        
+    def get_text_estimate(self):
+        estimate = self.search_index.estimate(query_variants(self.search_text)[0])
+        return len(self.rows) if estimate is None else estimate
+        
+    def get_query_plan(self):
+        # Шаги с битовыми картами выполняются от самого избирательного: пересечение быстрее
+        # становится пустым, и оставшиеся шаги можно не выполнять
+        steps = []
+        
+        if self.selected_categories:
+            steps.append(self.get_values_step(f"Категория: {', '.join(self.selected_categories)}",
+                                              "category", self.category_bitmaps, self.selected_categories))
         if self.selected_brands:
-            selected_names = self.get_selected_brand_names()
-            brand_filtered = []
-            for product in filtered:
-                product_brand_name = product.get('brand', '').strip()
-                if product_brand_name and product_brand_name in selected_names:
-                    brand_filtered.append(product)
-            filtered = brand_filtered
+            steps.append(self.get_values_step(f"Бренд: {', '.join(self.get_selected_brand_names())}",
+                                              "brand", self.brand_bitmaps, self.selected_brands))
+        if self.price_range:
+            steps.append(self.get_price_step(f"Цена: {self.get_price_range_text()}", *self.price_range))
+        for name, values in self.selected_attributes.items():
+            steps.append(self.get_values_step(f"{ATTRIBUTE_FILTERS[name]}: {', '.join(values)}",
+                                              name, self.attribute_index.postings[name], values))
+        for predicate in self.search_predicates:
+            steps.append(self.get_predicate_step(predicate))
             
+        steps.sort(key=attrgetter('estimate'))
+        
         if self.search_text:
-            filtered = [p for p in filtered 
-                       if self.search_text in p.get('name', '').lower() 
-                       or self.search_text in p.get('article', '').lower()]
-                       
-        return filtered
+            steps.append(PlanStep(f"Поиск: '{self.search_text}'", self.get_text_estimate(), None))
+        return steps
+        
+    @synchronized
+    def explain(self):
+        # План для отладки: шаги в порядке выполнения с оценкой числа строк
+        return [(step.description, step.estimate) for step in self.get_query_plan()]
+        
+    def get_attribute_bitmap(self, plan=None):
+        # Внутри одного фильтра выбранные значения объединяются (OR), между фильтрами - пересекаются (AND)
+        bitmap = None
+        for step in plan if plan is not None else self.get_query_plan():
+            if step.get_bitmap is None:
+                continue
+            step_bitmap = step.get_bitmap()
+            bitmap = step_bitmap if bitmap is None else bitmap & step_bitmap
+            if not bitmap:
+                break
+        return bitmap
+        
+    def compute_rows(self):
+        # Возвращает (строки, обрезан ли нечеткий поиск по времени)
+        plan = self.get_query_plan()
+        bitmap = self.get_attribute_bitmap(plan)
+        
+        if bitmap == 0:
+            return [], False
+        
+        truncated = False
+        if self.search_text and self.search_mode == "fuzzy":
+            if self.fuzzy_index is None:
+                self.build_fuzzy_index()
+            variants = query_variants(self.search_text)
+            rows = []
+            for variant in variants:
+                rows, variant_truncated = self.fuzzy_index.search(variant, FUZZY_RESULT_LIMIT, FUZZY_TIME_BUDGET, bitmap)
+                truncated = truncated or variant_truncated
+                if rows:
+                    break
+            else:
+                # Опечатки не нашлись - пробуем подстроку и совпадение по звучанию
+                rows = self.search_query_rows(variants, bitmap)
+        elif self.search_text:
+            # Если остальные фильтры отобрали меньше строк, чем кандидатов у текста,
+            # проверяем подстроку прямо в отобранных строках, минуя индекс
+            scan_rows = None
+            if bitmap is not None and plan[0].estimate < plan[-1].estimate:
+                scan_rows = bitmap_to_rows(bitmap)
+            rows = self.search_query_rows(query_variants(self.search_text), bitmap, scan_rows)
+        elif bitmap is not None:
+            rows = bitmap_to_rows(bitmap)
+        else:
+            rows = [row for row, product in enumerate(self.rows) if product is not None]
+            
+        return rows, truncated
+        
+    def get_cached_rows(self, state):
+        if self.result_cache_revision != self.catalog_revision:
+            self.result_cache.clear()
+            self.result_cache_revision = self.catalog_revision
+            
+        rows = self.result_cache.get(state)
+        if rows is not None:
+            self.result_cache.move_to_end(state)
+        return rows
+        
+    def cache_rows(self, state, rows):
+        # Номера строк хранятся массивом int: в несколько раз компактнее списка
+        rows = array('i', rows)
+        self.result_cache[state] = rows
+        if len(self.result_cache) > RESULT_CACHE_SIZE:
+            self.result_cache.popitem(last=False)
+        return rows
+        
+    def get_result_rows(self):
+        started = time.perf_counter()
+        state = self.get_filter_state()
+        
+        rows = self.get_cached_rows(state)
+        if rows is not None:
+            self.refinements.append((state, rows))
+            del self.refinements[:-REFINEMENT_DEPTH]
+            self.last_timings['filter'] = time.perf_counter() - started
+            return rows
+        
+        truncated = False
+        while self.refinements:
+            previous_state, previous_rows = self.refinements[-1]
+            if previous_state == state:
+                return previous_rows
+            if self.extends_state(previous_state, state):
+                # Уточняем по запросу как он набран; если совпадений нет, результат могли дать
+                # другая раскладка или похожее звучание - тогда нужен полный проход
+                rows = self.narrow_rows(previous_rows, query_variants(self.search_text)[0])
+                if not rows:
+                    rows, truncated = self.compute_rows()
+                break
+            # Запрос стал короче или изменились другие фильтры - это состояние больше не поможет
+            self.refinements.pop()
+        else:
+            rows, truncated = self.compute_rows()
+        
+        self.last_timings['filter'] = time.perf_counter() - started
+        if truncated or self.get_filter_state() != state:
+            # Фильтр изменили, пока шел расчет в фоне, или нечеткий поиск не уложился
+            # во время: такие строки не запоминаются, следующий запрос считается заново
+            return rows
+        
+        rows = self.cache_rows(state, rows)
+        self.refinements.append((state, rows))
+        del self.refinements[:-REFINEMENT_DEPTH]
+        return rows
+        
+    @synchronized
+    def get_facet_counts(self):
+        # Фасеты дизъюнктивные: счетчики характеристики считаются без ее собственного выбора.
+        # Строки берутся для фильтра без выбранных характеристик (обычно они уже в кэше
+        # результатов), и один проход по их профилям раскладывает счетчики по характеристикам.
+        # Это отдельный проход при открытии диалога, а не часть отбора строк: поиск
+        # по буквам не платит за счетчики, которые никто не смотрит
+        state = self.get_filter_state()
+        if self.facet_counts[0] != state:
+            selected = self.selected_attributes
+            self.selected_attributes = {}
+            try:
+                if self.has_active_filters():
+                    rows = self.get_result_rows()
+                    # Обрезанный по времени нечеткий поиск не попадает в кэш - как и счетчики по нему
+                    complete = self.get_filter_state() in self.result_cache
+                else:
+                    rows = range(len(self.rows))
+                    complete = True
+            finally:
+                self.selected_attributes = selected
+            counts = self.attribute_index.counts(rows, selected)
+            if not complete:
+                return counts
+            self.facet_counts = (state, counts)
+        return self.facet_counts[1]
+        
+    def get_attribute_values(self, name):
+        return self.attribute_index.get_values(name)
+        
+    @synchronized
+    def filter_products(self, all_products):
+        if all_products is not self.catalog:
+            self.set_catalog(all_products)
+            
+        if not self.has_active_filters():
+            return all_products
+        
+        return list(map(self.rows.__getitem__, self.get_result_rows()))
+        
+    def get_sort_value(self, name, product):
+        if name == "name":
+            return product.get('name', '').casefold()
+        if name == "price":
+            return self.get_price(product)
+        if name == "sales":
+            return self.sales.get(product.get('article'), 0)
+        return product.get('id') or 0
+        
+    def get_permutation(self, sort_order):
+        permutation = self.permutations.get(sort_order)
+        if permutation is None:
+            _, name, descending = SORT_ORDERS[sort_order]
+            # Удаленные строки получают значение пустого товара: 0 нельзя сравнить с названием
+            values = [self.get_sort_value(name, product or {}) for product in self.rows]
+            # Сортировка устойчива и при reverse: равные товары остаются в порядке каталога
+            order = sorted(range(len(values)), key=values.__getitem__, reverse=descending)
+            permutation = (order, inverse_permutation(order))
+            self.permutations[sort_order] = permutation
+        return permutation
+        
+    def sort_rows(self, rows, sort_order):
+        order, inverse = self.get_permutation(sort_order)
+        
+        if len(rows) >= len(order) * PERMUTATION_WALK_SHARE:
+            # Проход по перестановке с отметками отобранных строк - линейно и без сравнений
+            flags = rows_to_flags(rows, len(order))
+            return list(compress(order, map(flags.__getitem__, order)))
+        
+        return sorted(rows, key=inverse.__getitem__)
+        
+    @synchronized
+    def get_ranked_results(self, all_products):
+        self.last_timings = {}
+        started = time.perf_counter()
+        results = self.rank_results(all_products)
+        total = time.perf_counter() - started
+        self.last_timings['rank'] = total - self.last_timings.get('filter', 0.0)
+        self.last_timings['total'] = total
+        return results
+        
+    def rank_results(self, all_products):
+        if all_products is not self.catalog:
+            self.set_catalog(all_products)
+            
+        if self.sort_order != "relevance":
+            if self.has_active_filters():
+                rows = self.sort_rows(self.get_result_rows(), self.sort_order)
+            else:
+                # Без фильтров берем перестановку целиком, пропуская удаленные строки
+                order = self.get_permutation(self.sort_order)[0]
+                rows = list(compress(order, map(self.rows.__getitem__, order)))
+            return RankedResults(rows, lookup=self.rows.__getitem__)
+            
+        if not self.has_active_filters():
+            return RankedResults(all_products)
+        
+        rows = self.get_result_rows()
+        if self.search_text and self.search_mode == "exact":
+            return RankedResults(rows, self.score_rows(rows), self.rows.__getitem__)
+        return RankedResults(rows, lookup=self.rows.__getitem__)
         
     def reset_filters(self):
         self.selected_brands = []
         self.selected_categories = []
         self.search_text = ""
+        self.search_predicates = ()
+        self.price_range = None
+        self.selected_attributes = {}
         
     def has_active_filters(self):
         return (len(self.selected_brands) > 0 or 
                 len(self.selected_categories) > 0 or 
-                self.search_text != "")
+                self.search_text != "" or
+                len(self.search_predicates) > 0 or
+                self.price_range is not None or
+                len(self.selected_attributes) > 0)
+                
+    def get_price_range_text(self):
+        low, high = self.price_range
+        parts = []
+        if low is not None:
+            parts.append(f"от {low:.0f}")
+        if high is not None:
+            parts.append(f"до {high:.0f}")
+        return " ".join(parts) + " руб."
                 
     def get_filter_summary(self):
         parts = []
@@ -89,7 +805,19 @@ class ProductFilter:
                         brand_text += f" (+{len(selected_names) - 2} еще)"
                     parts.append(brand_text)
                 
+        if self.price_range:
+            parts.append(f"Цена: {self.get_price_range_text()}")
+            
+        for name, values in self.selected_attributes.items():
+            parts.append(f"{ATTRIBUTE_FILTERS[name]}: {', '.join(values)}")
+            
+        if self.search_predicates:
+            parts.append(f"Запрос: {' '.join(map(format_predicate, self.search_predicates))}")
+            
         if self.search_text:
-            parts.append(f"Поиск: '{self.search_text}'")
+            if self.search_mode == "fuzzy":
+                parts.append(f"Поиск с учетом опечаток: '{self.search_text}'")
+            else:
+                parts.append(f"Поиск: '{self.search_text}'")
             
         return "; ".join(parts) if parts else "Без фильтров"
\ No newline at end of file
@@ -0,0 +1,455 @@
+import argparse
+import mmap
+import multiprocessing
+import os
+import pickle
+import struct
+import sys
+import time
+from array import array
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from operator import eq
+import config
+import seed_data
+from filters import ProductFilter, SORT_ORDERS, ATTRIBUTE_FILTERS
+from search_index import (SoundIndex, SuggestionIndex, AttributeIndex, SortedValueIndex,
+                          trigrams, rows_to_bitmap, inverse_permutation)
+
+INDEX_FILE = 'catalog_index.bin'
+
+# Заголовок: сигнатура, версия формата, версия каталога, число строк, смещение и длина оглавления.
+# При изменении раскладки файла FORMAT_VERSION увеличивается - старые файлы просто пересобираются.
+# Версия 3: версия каталога читается одним снимком с товарами (config.get_catalog_snapshot).
+# Файлы версии 2 могли получить версию каталога новее строк, из которых собраны
+MAGIC = b'SDIX'
+FORMAT_VERSION = 3
+HEADER = struct.Struct('<4sIqIQQ')
+
+# Блоки данных выравниваются, чтобы срезы памяти можно было читать как массивы чисел
+ALIGNMENT = 8
+
+# Каталоги меньше этого собираются в текущем процессе: запуск пула дороже самой сборки
+PARALLEL_MIN_ROWS = 20000
+
+# Частей на процесс: несколько частей поменьше выравнивают нагрузку между процессами
+SHARDS_PER_WORKER = 4
+
+# Перестановки в файле: только не зависящие от продаж - продажи меняются без смены версии каталога
+FILE_SORT_ORDERS = [sort_order for sort_order, (_, name, _) in SORT_ORDERS.items()
+                    if name is not None and name != "sales"]
+
+# Индексы каталога в том виде, в каком их принимает ProductFilter.set_catalog_index.
+# Прочитанные из файла ключи поиска, списки строк, цены и перестановки - срезы памяти файла, без копирования.
+# get_suggestions возвращает (ключи подсказок, число товаров с подсказкой): из файла они
+# разбираются только при первом запросе подсказок
+CatalogIndex = namedtuple('CatalogIndex', 'revision product_ids search_keys trigram_postings sound_postings '
+                                          'category_bitmaps brand_bitmaps price_values price_rows '
+                                          'attribute_profiles row_profiles attribute_postings permutations '
+                                          'get_suggestions')
+
+# Результат сборки одной части каталога; номера строк - сквозные по всему каталогу
+Shard = namedtuple('Shard', 'product_ids search_keys trigram_rows sound_rows category_rows brand_rows '
+                            'prices attributes sort_values suggestion_counts suggestion_keys')
+
+
+def build_shard(start, products):
+    # Выполняется в процессе пула: здесь самая дорогая часть - нормализация текста и триграммы
+    sound_index = SoundIndex()
+    sorter = ProductFilter()
+    sort_names = {SORT_ORDERS[sort_order][1] for sort_order in FILE_SORT_ORDERS}
+
+    product_ids = []
+    search_keys = []
+    trigram_rows = defaultdict(list)
+    sound_rows = defaultdict(list)
+    category_rows = defaultdict(list)
+    brand_rows = defaultdict(list)
+    prices = []
+    attributes = []
+    sort_values = {name: [] for name in sort_names}
+    suggestion_counts = defaultdict(int)
+
+    for row, product in enumerate(products, start):
+        key = ProductFilter.get_search_key(product)
+        product_ids.append(product.get('id'))
+        search_keys.append(key)
+        for gram in trigrams(key):
+            trigram_rows[gram].append(row)
+        for sound in sound_index.get_keys(key):
+            sound_rows[sound].append(row)
+        category_rows[product.get('category', '')].append(row)
+        brand_rows[product.get('brand_id')].append(row)
+        prices.append(ProductFilter.get_price(product))
+        attributes.append(ProductFilter.get_product_attributes(product))
+        for name, values in sort_values.items():
+            values.append(sorter.get_sort_value(name, product))
+        for text in ProductFilter.get_suggestion_texts(product):
+            if text:
+                suggestion_counts[text] += 1
+
+    suggestion_keys = {text: SuggestionIndex.get_keys(text) for text in suggestion_counts}
+    return Shard(product_ids, search_keys, dict(trigram_rows), dict(sound_rows), dict(category_rows),
+                 dict(brand_rows), prices, attributes, sort_values, dict(suggestion_counts), suggestion_keys)
+
+
+def build_shards(products, workers):
+    if workers <= 1 or len(products) < PARALLEL_MIN_ROWS:
+        return [build_shard(0, products)]
+
+    size = -(-len(products) // (workers * SHARDS_PER_WORKER))
+    starts = range(0, len(products), size)
+    # spawn, а не fork: сборку запускают и из окна приложения, где уже работают потоки Qt
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        return list(executor.map(build_shard, starts, (products[start:start + size] for start in starts)))
+
+
+def merge_rows(parts):
+    # Части идут по порядку строк, поэтому склеенные списки остаются отсортированными
+    merged = {}
+    for part in parts:
+        for key, rows in part.items():
+            posting = merged.get(key)
+            if posting is None:
+                merged[key] = array('i', rows)
+            else:
+                posting.extend(rows)
+    return merged
+
+
+def build_index(products, revision, workers=None):
+    shards = build_shards(products, workers or os.cpu_count() or 1)
+
+    product_ids = array('i')
+    search_keys = []
+    prices = []
+    attributes = []
+    sort_values = defaultdict(list)
+    suggestion_counts = defaultdict(int)
+    suggestion_keys = {}
+    for shard in shards:
+        product_ids.extend(shard.product_ids)
+        search_keys.extend(shard.search_keys)
+        prices.extend(shard.prices)
+        attributes.extend(shard.attributes)
+        for name, values in shard.sort_values.items():
+            sort_values[name].extend(values)
+        for text, count in shard.suggestion_counts.items():
+            suggestion_counts[text] += count
+        suggestion_keys.update(shard.suggestion_keys)
+
+    price_index = SortedValueIndex()
+    price_index.build(zip(prices, range(len(prices))))
+    attribute_index = AttributeIndex(ATTRIBUTE_FILTERS)
+    attribute_index.build(attributes)
+
+    suggestions = (sorted((key, text) for text in suggestion_counts for key in suggestion_keys[text]),
+                   dict(suggestion_counts))
+
+    permutations = {}
+    for sort_order in FILE_SORT_ORDERS:
+        _, name, descending = SORT_ORDERS[sort_order]
+        values = sort_values[name]
+        order = sorted(range(len(values)), key=values.__getitem__, reverse=descending)
+        permutations[sort_order] = (array('i', order), array('i', inverse_permutation(order)))
+
+    return CatalogIndex(
+        revision=revision,
+        product_ids=product_ids,
+        search_keys=search_keys,
+        trigram_postings=merge_rows(shard.trigram_rows for shard in shards),
+        sound_postings=merge_rows(shard.sound_rows for shard in shards),
+        category_bitmaps={key: rows_to_bitmap(rows)
+                          for key, rows in merge_rows(shard.category_rows for shard in shards).items()},
+        brand_bitmaps={key: rows_to_bitmap(rows)
+                       for key, rows in merge_rows(shard.brand_rows for shard in shards).items()},
+        price_values=price_index.values,
+        price_rows=price_index.rows,
+        attribute_profiles=attribute_index.profiles,
+        row_profiles=attribute_index.row_profiles,
+        attribute_postings=attribute_index.postings,
+        permutations=permutations,
+        get_suggestions=lambda: suggestions
+    )
+
+
+class IndexWriter:
+    # Блоки данных пишутся подряд, а их положение собирается в оглавление в конце файла
+    def __init__(self, file):
+        self.file = file
+
+    def write_bytes(self, data):
+        padding = -self.file.tell() % ALIGNMENT
+        self.file.write(bytes(padding))
+        offset = self.file.tell()
+        self.file.write(data)
+        return offset, len(data)
+
+    def write_array(self, values):
+        if not isinstance(values, array):
+            values = array('i', values)
+        offset, _ = self.write_bytes(values.tobytes())
+        return values.typecode, offset, len(values)
+
+    def write_bitmap(self, bitmap, rows):
+        return self.write_bytes(bitmap.to_bytes((rows + 7) // 8, 'little'))
+
+    def write_strings(self, strings):
+        # Строки через \0 и смещения начала каждой: строку можно прочитать, не разбирая остальные
+        data = bytearray()
+        offsets = array('q', [0])
+        for text in strings:
+            data += text.encode('utf-8')
+            data += b'\0'
+            offsets.append(len(data))
+        return self.write_bytes(bytes(data)), self.write_array(offsets)
+
+    def write_postings(self, postings):
+        # Все списки одного индекса - один массив; в оглавлении ключи и границы списков
+        keys = list(postings)
+        bounds = array('q', [0])
+        rows = array('i')
+        for key in keys:
+            rows.extend(postings[key])
+            bounds.append(len(rows))
+        return keys, self.write_array(bounds), self.write_array(rows)
+
+
+class MappedPostings(dict):
+    # Списки строк из файла по ключу: срез памяти создается при первом обращении к ключу,
+    # а не для всех ключей при загрузке. Замененные и удаленные списки хранятся в самом словаре
+    def __init__(self, keys, bounds, values):
+        super().__init__()
+        self.positions = dict(zip(keys, range(len(keys))))
+        self.bounds = bounds
+        self.values = values
+
+    def __missing__(self, key):
+        i = self.positions[key]
+        posting = self[key] = self.values[self.bounds[i]:self.bounds[i + 1]]
+        return posting
+
+    def __delitem__(self, key):
+        self.positions.pop(key, None)
+        self.pop(key, None)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class MappedStrings:
+    # Ключи поиска из файла: строка декодируется при обращении к ней, а весь список -
+    # только при первом просмотре всех строк (запрос короче триграммы) или изменении
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+        self.strings = None
+
+    def __len__(self):
+        return len(self.offsets) - 1 if self.strings is None else len(self.strings)
+
+    def __getitem__(self, row):
+        if self.strings is not None:
+            return self.strings[row]
+        return str(self.data[self.offsets[row]:self.offsets[row + 1] - 1], 'utf-8')
+
+    def __setitem__(self, row, text):
+        self.get_strings()[row] = text
+
+    def __iter__(self):
+        return iter(self.get_strings())
+
+    def append(self, text):
+        self.get_strings().append(text)
+
+    def get_strings(self):
+        if self.strings is None:
+            self.strings = str(self.data[:-1], 'utf-8').split('\0') if len(self) else []
+        return self.strings
+
+
+def write_index_file(path, index):
+    rows = len(index.product_ids)
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'wb') as file:
+        file.write(bytes(HEADER.size))
+        writer = IndexWriter(file)
+        directory = {
+            'byteorder': sys.byteorder,
+            'product_ids': writer.write_array(index.product_ids),
+            'search_keys': writer.write_strings(index.search_keys),
+            'trigram_postings': writer.write_postings(index.trigram_postings),
+            'sound_postings': writer.write_postings(index.sound_postings),
+            'category_bitmaps': {key: writer.write_bitmap(bitmap, rows)
+                                 for key, bitmap in index.category_bitmaps.items()},
+            'brand_bitmaps': {key: writer.write_bitmap(bitmap, rows)
+                              for key, bitmap in index.brand_bitmaps.items()},
+            'price_values': writer.write_array(index.price_values),
+            'price_rows': writer.write_array(index.price_rows),
+            'attribute_profiles': list(index.attribute_profiles),
+            'row_profiles': writer.write_array(index.row_profiles),
+            'attribute_postings': {name: {value: writer.write_bitmap(bitmap, rows)
+                                          for value, bitmap in postings.items()}
+                                   for name, postings in index.attribute_postings.items()},
+            'permutations': {sort_order: (writer.write_array(order), writer.write_array(inverse))
+                             for sort_order, (order, inverse) in index.permutations.items()},
+            'suggestions': writer.write_bytes(pickle.dumps(index.get_suggestions(), pickle.HIGHEST_PROTOCOL))
+        }
+        directory_offset, directory_length = writer.write_bytes(pickle.dumps(directory, pickle.HIGHEST_PROTOCOL))
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, index.revision, rows, directory_offset, directory_length))
+    # Файл подменяется целиком: читатель видит либо старую, либо новую версию
+    os.replace(temporary_path, path)
+
+
+def read_index_file(path, revision):
+    # None, если файла нет, он другой версии формата или собран для другой версии каталога
+    try:
+        with open(path, 'rb') as file:
+            header = file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return None
+            magic, version, file_revision, rows, directory_offset, directory_length = HEADER.unpack(header)
+            if magic != MAGIC or version != FORMAT_VERSION or file_revision != revision:
+                return None
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        directory = pickle.loads(mapped[directory_offset:directory_offset + directory_length])
+        if directory['byteorder'] != sys.byteorder:
+            return None
+        return load_index(memoryview(mapped), directory, file_revision, rows)
+    except Exception:
+        return None
+
+
+def load_index(data, directory, revision, rows):
+    # Срезы memoryview держат отображение файла открытым, пока индексы используются
+
+    def view_array(reference):
+        typecode, offset, count = reference
+        return data[offset:offset + count * array(typecode).itemsize].cast(typecode)
+
+    def view_bytes(reference):
+        offset, length = reference
+        return data[offset:offset + length]
+
+    def read_bitmap(reference):
+        return int.from_bytes(view_bytes(reference), 'little')
+
+    def view_postings(reference):
+        keys, bounds, values = reference
+        return MappedPostings(keys, view_array(bounds), view_array(values))
+
+    def view_strings(reference):
+        strings, offsets = reference
+        return MappedStrings(view_bytes(strings), view_array(offsets))
+
+    return CatalogIndex(
+        revision=revision,
+        product_ids=view_array(directory['product_ids']),
+        search_keys=view_strings(directory['search_keys']),
+        trigram_postings=view_postings(directory['trigram_postings']),
+        sound_postings=view_postings(directory['sound_postings']),
+        category_bitmaps={key: read_bitmap(reference) for key, reference in directory['category_bitmaps'].items()},
+        brand_bitmaps={key: read_bitmap(reference) for key, reference in directory['brand_bitmaps'].items()},
+        price_values=view_array(directory['price_values']),
+        price_rows=view_array(directory['price_rows']),
+        attribute_profiles=directory['attribute_profiles'],
+        row_profiles=view_array(directory['row_profiles']),
+        attribute_postings={name: {value: read_bitmap(reference) for value, reference in postings.items()}
+                            for name, postings in directory['attribute_postings'].items()},
+        permutations={sort_order: (view_array(order), view_array(inverse))
+                      for sort_order, (order, inverse) in directory['permutations'].items()},
+        get_suggestions=lambda: pickle.loads(view_bytes(directory['suggestions']))
+    )
+
+
+def matches_products(index, products):
+    # Номера строк в файле - позиции товаров: список должен совпасть до порядка.
+    # Содержимое строк не сравнивается: read_index_file уже отверг файл с другой версией
+    # каталога, а версия в файле - из того же снимка базы, что и его строки
+    return len(index.product_ids) == len(products) and all(
+        map(eq, index.product_ids, (product.get('id') for product in products)))
+
+
+def prepare_catalog_index(products, revision, path=None, workers=None):
+    # Если файл собран для этой версии каталога, индексы отображаются из него в память;
+    # иначе собираются пулом процессов и сохраняются для следующего запуска.
+    # Без версии каталога (база недоступна) индексы собираются без сохранения.
+    # ProductFilter не затрагивается, поэтому функцию можно вызывать в фоновом потоке.
+    # Возвращает (откуда взяты индексы: "file", "built" или "memory", индексы или None для пустого каталога)
+    if not products:
+        return "memory", None
+
+    if revision is None:
+        return "memory", build_index(products, 0, workers)
+
+    path = path or config.get_data_path(INDEX_FILE)
+    index = read_index_file(path, revision)
+    if index is not None and matches_products(index, products):
+        return "file", index
+
+    index = build_index(products, revision, workers)
+    try:
+        write_index_file(path, index)
+    except OSError:
+        return "built", index
+
+    # Собранные массивы заменяются отображением файла: память отдается системе
+    mapped = read_index_file(path, revision)
+    return "built", mapped if mapped is not None else index
+
+
+def attach_catalog_index(product_filter, products, index, catalog_rows=None):
+    # catalog_rows - ProductFilter.prepare_catalog_rows, выполненный там же, где и prepare_catalog_index
+    if index is None:
+        product_filter.set_catalog(products)
+    else:
+        product_filter.set_catalog_index(products, index, catalog_rows)
+
+
+def load_catalog(product_filter, products, revision, path=None, workers=None):
+    source, index = prepare_catalog_index(products, revision, path, workers)
+    attach_catalog_index(product_filter, products, index)
+    return source
+
+
+def build_command(args):
+    seed_data.apply_connection_arguments(args)
+    started = time.perf_counter()
+    revision, products = config.get_catalog_snapshot()
+    loaded = time.perf_counter()
+    if revision is None:
+        print("Не удалось получить версию каталога из базы данных", file=sys.stderr)
+        return 1
+
+    output = args.output or config.get_data_path(INDEX_FILE)
+    index = build_index(products, revision, args.workers)
+    built = time.perf_counter()
+    write_index_file(output, index)
+    written = time.perf_counter()
+
+    print(f"Товары: {len(products)}, версия каталога: {revision}")
+    print(f"Загрузка {loaded - started:.2f} с, сборка {built - loaded:.2f} с, запись {written - built:.2f} с")
+    print(f"Файл {output}: {os.path.getsize(output) / 1024 / 1024:.1f} MiB")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сборка файла индексов каталога для быстрого запуска приложения")
+    seed_data.add_connection_arguments(parser)
+    parser.add_argument('--output', default=None,
+                        help="Файл индексов, по умолчанию - тот, что читает приложение, в каталоге данных пользователя")
+    parser.add_argument('--workers', type=int, default=None, help="Число процессов сборки, по умолчанию - по числу ядер")
+    return build_command(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
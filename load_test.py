@@ -0,0 +1,225 @@
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+import config
+from bench_utils import percentile
+from seed_data import LOCAL_HOST, add_connection_arguments, apply_connection_arguments
+
+# Относительная частота операций в сценарии покупателя
+OPERATION_WEIGHTS = {
+    'get_all_products': 2,
+    'get_all_brands': 3,
+    'add_to_cart': 10,
+    'update_cart_item': 4,
+    'get_user_cart': 6,
+    'create_order': 2,
+    'get_user_orders': 5,
+    'get_order_details': 4
+}
+
+
+def fetch_shoppers(limit):
+    connection = config.connect_postgres()
+    if not connection:
+        return []
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT user_id FROM users
+            WHERE user_id != (SELECT MIN(user_id) FROM users)
+            ORDER BY random()
+            LIMIT %s
+        """, (limit,))
+        user_ids = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        connection.close()
+        return user_ids
+
+    except Exception:
+        connection.close()
+        return []
+
+
+class Shopper(threading.Thread):
+    def __init__(self, user_id, product_ids, deadline, think_time, seed):
+        super().__init__(daemon=True)
+        self.user_id = user_id
+        self.product_ids = product_ids
+        self.deadline = deadline
+        self.think_time = think_time
+        self.rng = random.Random(seed)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.cart = {}
+        self.order_ids = []
+
+    def run(self):
+        operations = list(OPERATION_WEIGHTS)
+        weights = list(OPERATION_WEIGHTS.values())
+
+        while time.monotonic() < self.deadline:
+            operation = self.rng.choices(operations, weights=weights)[0]
+            self.perform(operation)
+            if self.think_time:
+                time.sleep(self.rng.expovariate(1.0 / self.think_time))
+
+    def perform(self, operation):
+        started = time.perf_counter()
+        try:
+            ok = getattr(self, f"do_{operation}")()
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+
+        if ok is None:
+            return
+        self.latencies[operation].append(elapsed)
+        if not ok:
+            self.errors[operation] += 1
+
+    def do_get_all_products(self):
+        return bool(config.get_all_products())
+
+    def do_get_all_brands(self):
+        return bool(config.get_all_brands())
+
+    def do_add_to_cart(self):
+        product_id = self.rng.choice(self.product_ids)
+        success, line = config.add_to_cart(self.user_id, product_id)
+        if success:
+            self.cart[line['article']] = line['quantity']
+        return success
+
+    def do_update_cart_item(self):
+        if not self.cart:
+            return None
+        article = self.rng.choice(list(self.cart))
+        quantity = self.rng.randint(0, 3)
+        success, line = config.update_cart_item(self.user_id, article, quantity)
+        if success:
+            if line['quantity'] > 0:
+                self.cart[article] = line['quantity']
+            else:
+                self.cart.pop(article, None)
+        return success
+
+    def do_get_user_cart(self):
+        items = config.get_user_cart(self.user_id)
+        self.cart = {item['article']: item['quantity'] for item in items}
+        return True
+
+    def do_create_order(self):
+        if not self.cart:
+            return None
+        items = config.get_user_cart(self.user_id)
+        if not items:
+            self.cart = {}
+            return None
+        success, order_id = config.create_order(self.user_id, items)
+        if success:
+            self.cart = {}
+            self.order_ids.append(order_id)
+        return success
+
+    def do_get_user_orders(self):
+        orders = config.get_user_orders(self.user_id)
+        if orders:
+            self.order_ids = [order['order_id'] for order in orders]
+        return True
+
+    def do_get_order_details(self):
+        if not self.order_ids:
+            return None
+        return config.get_order_details(self.rng.choice(self.order_ids)) is not None
+
+
+def summarize(shoppers, duration):
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    for shopper in shoppers:
+        for operation, values in shopper.latencies.items():
+            latencies[operation].extend(values)
+        for operation, count in shopper.errors.items():
+            errors[operation] += count
+
+    report = {'duration': duration, 'shoppers': len(shoppers), 'operations': {}}
+    total = 0
+    for operation in OPERATION_WEIGHTS:
+        values = sorted(latencies.get(operation, []))
+        if not values:
+            continue
+        total += len(values)
+        report['operations'][operation] = {
+            'count': len(values),
+            'errors': errors.get(operation, 0),
+            'throughput': len(values) / duration,
+            'p50_ms': percentile(values, 0.50) * 1000,
+            'p90_ms': percentile(values, 0.90) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+            'max_ms': values[-1] * 1000
+        }
+    report['total_count'] = total
+    report['total_throughput'] = total / duration
+    return report
+
+
+def print_report(report):
+    print(f"Покупателей: {report['shoppers']}, длительность: {report['duration']:.1f} с, "
+          f"операций: {report['total_count']} ({report['total_throughput']:.1f} оп/с)")
+    print(f"{'операция':<20}{'кол-во':>8}{'ошибки':>8}{'оп/с':>9}"
+          f"{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}  (мс)")
+    for operation, stats in report['operations'].items():
+        print(f"{operation:<20}{stats['count']:>8}{stats['errors']:>8}{stats['throughput']:>9.1f}"
+              f"{stats['p50_ms']:>9.1f}{stats['p90_ms']:>9.1f}{stats['p95_ms']:>9.1f}"
+              f"{stats['p99_ms']:>9.1f}{stats['max_ms']:>9.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест функций config от имени нескольких покупателей")
+    add_connection_arguments(parser)
+    parser.add_argument('--shoppers', type=int, default=10, help="Число одновременных покупателей")
+    parser.add_argument('--duration', type=float, default=30.0, help="Длительность теста в секундах")
+    parser.add_argument('--think-time', type=float, default=0.0, help="Средняя пауза между действиями, с")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="Сохранить отчет в JSON-файл")
+    args = parser.parse_args(argv)
+
+    apply_connection_arguments(args, LOCAL_HOST)
+
+    user_ids = fetch_shoppers(args.shoppers)
+    product_ids = [product['id'] for product in config.get_all_products()]
+    if not user_ids or not product_ids:
+        print("В базе нет покупателей или товаров, сначала запустите seed_data.py", file=sys.stderr)
+        return 1
+
+    deadline = time.monotonic() + args.duration
+    shoppers = [
+        Shopper(user_ids[i % len(user_ids)], product_ids, deadline, args.think_time, args.seed + i)
+        for i in range(args.shoppers)
+    ]
+
+    started = time.monotonic()
+    for shopper in shoppers:
+        shopper.start()
+    for shopper in shoppers:
+        shopper.join()
+    duration = time.monotonic() - started
+
+    report = summarize(shoppers, duration)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -19,6 +19,8 @@ def check_and_init_database():
                 "Приложение будет работать в ограниченном режиме.")
             return False
     
+    config.upgrade_tables()
+    
     return True
 
 def main():
@@ -1,21 +1,32 @@
 import sys
+import math
+import time
+from decimal import Decimal
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                                QHBoxLayout, QLabel, QFrame, QPushButton, QLineEdit, 
                                QGridLayout, QScrollArea, QDialog, 
                                QListWidget, QListWidgetItem, QComboBox, 
                                QTableWidget, QTableWidgetItem, QHeaderView, 
-                               QStackedWidget, QDateEdit, QMessageBox, QCheckBox)
-from PySide6.QtCore import Qt, QTimer, QDate, QSize, QPoint
+                               QStackedWidget, QDateEdit, QMessageBox, QCheckBox, QCompleter,
+                               QSlider)
+from PySide6.QtCore import Qt, QTimer, QDate, QSize, QPoint, QStringListModel, QThreadPool
 from PySide6.QtGui import QColor, QFont, QPixmap, QPainter
 from PySide6.QtCharts import QChart, QChartView, QBarSet, QBarSeries, QBarCategoryAxis, QValueAxis
 import config
-from filters import ProductFilter
+from filters import ProductFilter, RESULTS_PAGE_SIZE, SORT_ORDERS, ATTRIBUTE_FILTERS
+from query_language import format_predicate
+from recommendations import prepare_similar_products, SIMILAR_PRODUCTS_SHOWN
+from index_file import prepare_catalog_index, attach_catalog_index
 from widgets import (
     CategoryConfirmationDialog, ImageLoader, CartItemWidget, DeleteProductDialog,
     PeriodSelectionDialog, AddProductDialog, ProductDetailWidget, BrandCard,
-    ProductCard, CategoryDropdown, AddBrandDialog, image_loader, OrderDetailsDialog
+    ProductCard, CategoryDropdown, AddBrandDialog, image_loader, OrderDetailsDialog,
+    AttributeFilterDialog, SearchWorker, BackgroundTask
 )
 
+# Пауза в наборе (мс), после которой запускается поиск
+SEARCH_DEBOUNCE_MS = 200
+
 
 class MainWindow(QMainWindow):
     def __init__(self, username="user101", user_id=None, current_user=None):
@@ -48,9 +59,18 @@ class MainWindow(QMainWindow):
         ]
         self.brand_cards = []
         self.product_cards = []
+        self.product_results = None
         self.cart_items = []
         self.cart_widgets = []
+        self.cart_widgets_by_article = {}
+        self.cart_lines = {}
+        # Сумма корзины в Decimal: float накапливает ошибку округления за долгую сессию
+        self.cart_total = Decimal(0)
         self.order_history = []
+        self.order_history_exhausted = False
+        self.order_details_cache = {}
+        self.order_details_generation = 0
+        self.prefetch_order_details = True
         self.all_products = []
         self.new_employee_row = None
         self.selected_period = None
@@ -58,6 +78,30 @@ class MainWindow(QMainWindow):
         self.product_filter = ProductFilter()
         self.product_filter.load_brand_mappings()
         
+        # Поиск из строки ввода: запускается после паузы в наборе и считается в фоне
+        self.search_worker = SearchWorker(self.product_filter)
+        self.search_worker.results_ready.connect(self.on_search_results)
+        self.search_timer = QTimer()
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.start_search)
+        self.search_started = None
+        self.search_timings = {}
+        
+        # Индексы каталога читаются из файла или собираются в фоне; ответ для устаревшего
+        # запроса (номер поколения не совпал) отбрасывается
+        self.catalog_task = None
+        self.catalog_generation = 0
+        self.catalog_changed = False
+        
+        # Индекс похожих товаров строится в фоне после загрузки каталога
+        self.similar_products = None
+        self.similar_products_task = None
+        
+        # Рекомендации "С этим товаром покупают" дообновляются в фоне по новым заказам
+        self.recommendations_task = None
+        self.cart_recommendations_articles = None
+        
         # Теперь создаем таймер
         self.resize_timer = QTimer()
         self.resize_timer.setSingleShot(True)
@@ -290,6 +334,7 @@ class MainWindow(QMainWindow):
             self.category_dropdown.clearSelection()
         
         self.reset_brand_selection()
+        self.update_price_slider_bounds()
         self.update_filters_indicators()
         self.content_stack.setCurrentIndex(0)
         if hasattr(self, 'category_dropdown'):
@@ -365,7 +410,11 @@ class MainWindow(QMainWindow):
         dialog = AddProductDialog(self)
         result = dialog.exec()
         if result == QDialog.DialogCode.Accepted:
-            self.load_products_from_db()
+            product = config.get_catalog_product(dialog.product_id)
+            if product:
+                self.add_catalog_product(product)
+            else:
+                self.load_products_from_db()
     
     def on_brand_selected(self, brand_id, is_selected):
         pass
@@ -448,6 +497,31 @@ class MainWindow(QMainWindow):
                 )
                 self.filters_layout.addWidget(brands_widget)
         
+        if self.product_filter.price_range:
+            price_widget = self.create_filter_indicator(
+                "Цена", 
+                self.product_filter.get_price_range_text(),
+                lambda: self.clear_price_filter()
+            )
+            self.filters_layout.addWidget(price_widget)
+        
+        for name, values in self.product_filter.selected_attributes.items():
+            attribute_text = values[0] if len(values) == 1 else f"{len(values)} значений"
+            attribute_widget = self.create_filter_indicator(
+                ATTRIBUTE_FILTERS[name], 
+                attribute_text,
+                lambda checked=False, name=name: self.clear_attribute_filter(name)
+            )
+            self.filters_layout.addWidget(attribute_widget)
+        
+        if self.product_filter.search_predicates:
+            query_widget = self.create_filter_indicator(
+                "Запрос", 
+                " ".join(map(format_predicate, self.product_filter.search_predicates)),
+                lambda: self.clear_search_filter()
+            )
+            self.filters_layout.addWidget(query_widget)
+        
         if self.product_filter.search_text:
             search_widget = self.create_filter_indicator(
                 "Поиск", 
@@ -532,9 +606,15 @@ class MainWindow(QMainWindow):
         self.update_filters_indicators()
         self.show_products()
     
+    def clear_attribute_filter(self, name):
+        self.product_filter.set_selected_attribute(name, [])
+        self.update_filters_indicators()
+        self.display_filtered_products()
+    
     def clear_search_filter(self):
         self.search_bar.clear()
-        self.product_filter.search_text = ""
+        self.search_timer.stop()
+        self.product_filter.set_search_text("")
         self.update_filters_indicators()
         self.display_filtered_products()
     
@@ -542,6 +622,8 @@ class MainWindow(QMainWindow):
         scroll_area = QScrollArea()
         scroll_area.setWidgetResizable(True)
         scroll_area.setStyleSheet("background-color: white; border: none;")
+        scroll_area.verticalScrollBar().valueChanged.connect(self.on_products_scrolled)
+        self.products_scroll = scroll_area
         
         container = QWidget()
         container.setStyleSheet("background-color: white;")
@@ -561,6 +643,7 @@ class MainWindow(QMainWindow):
         self.search_bar.setFixedHeight(40)
         self.search_bar.setFixedWidth(400)
         self.search_bar.setPlaceholderText("Поиск товара...")
+        self.search_bar.setToolTip('Можно уточнять условиями: brand:Nike category:"Велоспорт" price<5000 color:black')
         self.search_bar.setStyleSheet("""
             QLineEdit { 
                 border: 2px solid #dee2e6; 
@@ -575,11 +658,93 @@ class MainWindow(QMainWindow):
             }
         """)
         self.search_bar.textChanged.connect(self.on_search_text_changed)
+        
+        # Подсказки под строкой поиска: список уже отобран и упорядочен фильтром
+        self.search_suggestions = QStringListModel(self)
+        self.search_completer = QCompleter(self.search_suggestions, self)
+        self.search_completer.setCompletionMode(QCompleter.CompletionMode.UnfilteredPopupCompletion)
+        self.search_completer.setMaxVisibleItems(10)
+        self.search_bar.setCompleter(self.search_completer)
+        self.search_bar.textEdited.connect(self.update_search_suggestions)
         search_layout.addWidget(self.search_bar)
+        
+        self.fuzzy_search_checkbox = QCheckBox("С учетом опечаток")
+        self.fuzzy_search_checkbox.setStyleSheet("font-size: 13px; color: #000000;")
+        self.fuzzy_search_checkbox.toggled.connect(self.on_search_mode_changed)
+        search_layout.addWidget(self.fuzzy_search_checkbox)
+        
+        self.sort_combo = QComboBox()
+        self.sort_combo.setFixedHeight(40)
+        self.sort_combo.setStyleSheet("""
+            QComboBox { 
+                background-color: white; 
+                border: 1px solid #dee2e6; 
+                border-radius: 4px; 
+                padding: 6px 10px; 
+                font-size: 14px; 
+                color: #000000; 
+            }
+            QComboBox QAbstractItemView {
+                background-color: white;
+                color: #000000;
+                selection-background-color: #3498db;
+                selection-color: white;
+            }
+        """)
+        for sort_order, (title, _, _) in SORT_ORDERS.items():
+            self.sort_combo.addItem(title, sort_order)
+        self.sort_combo.currentIndexChanged.connect(self.on_sort_order_changed)
+        search_layout.addWidget(self.sort_combo)
         search_layout.addStretch()
         
         layout.addWidget(search_container)
         
+        price_container = QWidget()
+        price_container.setStyleSheet("background-color: white;")
+        price_layout = QHBoxLayout(price_container)
+        price_layout.setContentsMargins(0, 0, 0, 0)
+        price_layout.setSpacing(10)
+        price_layout.addStretch()
+        
+        price_title = QLabel("Цена:")
+        price_title.setStyleSheet("font-size: 14px; font-weight: bold; color: #2c3e50;")
+        price_layout.addWidget(price_title)
+        
+        self.price_from_slider = QSlider(Qt.Orientation.Horizontal)
+        self.price_to_slider = QSlider(Qt.Orientation.Horizontal)
+        self.price_from_label = QLabel()
+        self.price_to_label = QLabel()
+        for slider, label in ((self.price_from_slider, self.price_from_label),
+                              (self.price_to_slider, self.price_to_label)):
+            slider.setFixedWidth(200)
+            slider.valueChanged.connect(self.on_price_slider_changed)
+            label.setFixedWidth(110)
+            label.setStyleSheet("font-size: 13px; color: #000000;")
+            price_layout.addWidget(slider)
+            price_layout.addWidget(label)
+        
+        self.attributes_button = QPushButton("Характеристики")
+        self.attributes_button.setFixedHeight(35)
+        self.attributes_button.setStyleSheet("""
+            QPushButton { 
+                background-color: #3498db; 
+                color: white; 
+                border: none; 
+                border-radius: 6px; 
+                font-size: 13px; 
+                font-weight: bold; 
+                padding: 0 15px;
+            } 
+            QPushButton:hover { 
+                background-color: #2980b9; 
+            }
+        """)
+        self.attributes_button.clicked.connect(self.show_attribute_filter_dialog)
+        price_layout.addWidget(self.attributes_button)
+        price_layout.addStretch()
+        
+        layout.addWidget(price_container)
+        
         self.filters_container = QWidget()
         self.filters_container.setStyleSheet("background-color: white; border: 1px solid #dee2e6; border-radius: 8px; padding: 5px;")
         self.filters_layout = QHBoxLayout(self.filters_container)
@@ -604,36 +769,260 @@ class MainWindow(QMainWindow):
         return scroll_area
     
     def on_search_text_changed(self):
-        search_text = self.search_bar.text()
-        self.product_filter.set_search_text(search_text)
+        # Каждая новая буква откладывает поиск: фильтр запускается, когда набор остановился
+        self.search_timer.start()
+    
+    def start_search(self):
+        self.product_filter.set_search_text(self.search_bar.text())
+        self.update_filters_indicators()
+        if not self.all_products:
+            self.display_filtered_products()
+            return
+        self.search_started = time.perf_counter()
+        self.search_worker.submit(self.all_products)
+    
+    def on_search_results(self, generation, results, timings):
+        if not self.search_worker.is_current(generation):
+            return
+        started = time.perf_counter()
+        self.show_product_results(results)
+        timings['render'] = time.perf_counter() - started
+        timings['latency'] = time.perf_counter() - self.search_started
+        self.search_timings = timings
+    
+    def update_search_suggestions(self, text):
+        suggestions = self.product_filter.get_suggestions(text) if text.strip() else []
+        self.search_suggestions.setStringList(suggestions)
+        if suggestions:
+            self.search_completer.complete()
+        else:
+            self.search_completer.popup().hide()
+    
+    def on_sort_order_changed(self, index):
+        self.product_filter.set_sort_order(self.sort_combo.itemData(index))
+        self.display_filtered_products()
+    
+    def on_search_mode_changed(self, checked):
+        self.product_filter.set_search_mode("fuzzy" if checked else "exact")
         self.update_filters_indicators()
         self.display_filtered_products()
     
     def load_products_from_db(self):
-        try:
-            self.all_products = config.get_all_products()
-        except Exception:
-            self.all_products = []
+        self.catalog_generation += 1
+        self.catalog_changed = False
+        generation = self.catalog_generation
+        
+        def prepare():
+            # Чтение базы и все проходы по каталогу - в фоне. Версия каталога - из того же
+            # снимка базы, что и товары: иначе правка между запросами пометила бы индексы
+            # по старым строкам новой версией. Индексы берутся из файла, если каталог
+            # не менялся с его сборки, иначе собираются. До их готовности окно работает
+            # со старым каталогом
+            try:
+                revision, products = config.get_catalog_snapshot()
+            except Exception:
+                revision, products = None, []
+            try:
+                sales = config.get_product_sales()
+            except Exception:
+                sales = {}
+            try:
+                index = prepare_catalog_index(products, revision)[1]
+                catalog_rows = None
+                if index is not None:
+                    catalog_rows = ProductFilter.prepare_catalog_rows(products, index.product_ids, sales)
+            except Exception:
+                index, catalog_rows = None, None
+            return generation, products, revision, sales, index, catalog_rows
+        
+        self.catalog_task = BackgroundTask(prepare)
+        self.catalog_task.finished.connect(self.on_catalog_index_ready)
+        QThreadPool.globalInstance().start(self.catalog_task)
+        if not self.all_products:
+            self.display_filtered_products()
+    
+    def on_catalog_index_ready(self, result):
+        if result is None or result[0] != self.catalog_generation:
+            return
+        _, products, revision, sales, index, catalog_rows = result
+        self.catalog_task = None
+        
+        if self.catalog_changed:
+            # Пока индексы собирались, товары добавляли или удаляли: прочитанный список уже устарел
+            self.load_products_from_db()
+            return
+        
+        # Фоновый поиск по старому каталогу пересобрал бы индексы заново
+        self.search_worker.cancel()
+        previous_products = self.all_products
+        self.all_products = products
+        self.product_filter.sales = sales
+        # Без готовых индексов (сборка не удалась) каталог индексируется как раньше
+        attach_catalog_index(self.product_filter, products, index, catalog_rows)
+        self.update_price_slider_bounds()
         self.display_filtered_products()
+        
+        if self.similar_products is not None:
+            # Похожие товары уже посчитаны: пересчитываются только изменившиеся товары
+            self.similar_products.update(previous_products, products)
+        elif self.similar_products_task is None:
+            self.build_similar_products(revision)
+    
+    def build_similar_products(self, revision):
+        # Списки похожих берутся из файла для этой версии каталога или считаются пулом процессов.
+        # Каталог меняет только администратор: для него признаки товаров к пересчету
+        # разбираются здесь же, в фоне, а не при первом изменении
+        products = list(self.all_products)
+        editable = self.current_user.get('is_first_user', False)
+        
+        def prepare():
+            index = prepare_similar_products(products, revision)
+            if editable:
+                index.ensure_features()
+            return products, index
+        
+        self.similar_products_task = BackgroundTask(prepare)
+        self.similar_products_task.finished.connect(self.on_similar_products_built)
+        QThreadPool.globalInstance().start(self.similar_products_task)
+    
+    def on_similar_products_built(self, result):
+        self.similar_products_task = None
+        if result is None:
+            return
+        
+        # Пока индекс строился, каталог мог измениться: досчитываем разницу
+        products, index = result
+        index.update(products, self.all_products)
+        self.similar_products = index
+    
+    def get_similar_products(self, product):
+        if self.similar_products is None:
+            return []
+        product_ids = self.similar_products.get(product.get('id'), SIMILAR_PRODUCTS_SHOWN)
+        return [similar for similar in map(self.product_filter.get_product, product_ids) if similar]
+    
+    def refresh_recommendations(self):
+        if self.recommendations_task is not None:
+            return
+        # Недавнее или уже идущее у другого клиента обновление не повторяется
+        self.recommendations_task = BackgroundTask(
+            lambda: config.refresh_recommendations(min_interval=config.RECOMMENDATION_REFRESH_INTERVAL))
+        self.recommendations_task.finished.connect(self.on_recommendations_refreshed)
+        QThreadPool.globalInstance().start(self.recommendations_task)
+    
+    def on_recommendations_refreshed(self, result):
+        self.recommendations_task = None
+        # Рекомендации корзины перечитываются при следующем показе
+        self.cart_recommendations_articles = None
+    
+    def load_bought_together(self, articles, slot):
+        # Рекомендации читаются из базы в фоне: slot получает (артикулы, товары) или None при ошибке
+        articles = frozenset(articles)
+        task = BackgroundTask(lambda: (articles, config.get_recommendations(articles, config.RECOMMENDATIONS_SHOWN)))
+        task.finished.connect(slot)
+        QThreadPool.globalInstance().start(task)
+    
+    def get_catalog_products(self, products):
+        return [product for product in map(self.product_filter.get_product, (p['id'] for p in products)) if product]
+    
+    def add_catalog_product(self, product):
+        self.catalog_changed = self.catalog_task is not None
+        self.all_products.append(product)
+        self.product_filter.add_product(product)
+        if self.similar_products is not None:
+            self.similar_products.add(product)
+        self.update_price_slider_bounds()
+        self.display_filtered_products()
+    
+    def remove_catalog_product(self, product_id):
+        self.catalog_changed = self.catalog_task is not None
+        self.all_products[:] = [p for p in self.all_products if p.get('id') != product_id]
+        self.product_filter.remove_product(product_id)
+        if self.similar_products is not None:
+            self.similar_products.remove(product_id)
+        self.update_price_slider_bounds()
+        self.display_filtered_products()
+    
+    def update_price_slider_bounds(self):
+        bounds = self.product_filter.get_price_bounds() or (0, 0)
+        minimum, maximum = math.floor(bounds[0]), math.ceil(bounds[1])
+        low, high = self.product_filter.price_range or (None, None)
+        
+        for slider, value in ((self.price_from_slider, minimum if low is None else low),
+                              (self.price_to_slider, maximum if high is None else high)):
+            slider.blockSignals(True)
+            slider.setRange(minimum, maximum)
+            slider.setSingleStep(max(1, (maximum - minimum) // 100))
+            slider.setPageStep(max(1, (maximum - minimum) // 10))
+            slider.setValue(int(value))
+            slider.blockSignals(False)
+        self.update_price_labels()
+    
+    def update_price_labels(self):
+        self.price_from_label.setText(f"от {self.price_from_slider.value()} руб.")
+        self.price_to_label.setText(f"до {self.price_to_slider.value()} руб.")
+    
+    def on_price_slider_changed(self):
+        low = self.price_from_slider.value()
+        high = self.price_to_slider.value()
+        
+        # Ползунки не должны заходить друг за друга: двигаем второй вслед за первым
+        if low > high:
+            moved_from = self.sender() is self.price_from_slider
+            other = self.price_to_slider if moved_from else self.price_from_slider
+            other.blockSignals(True)
+            other.setValue(low if moved_from else high)
+            other.blockSignals(False)
+            low = high = low if moved_from else high
+        
+        self.product_filter.set_price_range(
+            low if low > self.price_from_slider.minimum() else None,
+            high if high < self.price_to_slider.maximum() else None
+        )
+        self.update_price_labels()
+        self.update_filters_indicators()
+        self.display_filtered_products()
+    
+    def clear_price_filter(self):
+        self.product_filter.set_price_range()
+        self.update_price_slider_bounds()
+        self.update_filters_indicators()
+        self.display_filtered_products()
+    
+    def show_attribute_filter_dialog(self):
+        dialog = AttributeFilterDialog(self.product_filter, self)
+        result = dialog.exec()
+        if result == QDialog.DialogCode.Accepted:
+            for name, values in dialog.get_selected_attributes().items():
+                self.product_filter.set_selected_attribute(name, values)
+            self.update_filters_indicators()
+            self.display_filtered_products()
     
     def display_filtered_products(self):
+        # Синхронный показ заменяет результат фонового поиска, если тот еще не пришел
+        self.search_worker.cancel()
+        results = self.product_filter.get_ranked_results(self.all_products) if self.all_products else None
+        self.show_product_results(results)
+    
+    def show_product_results(self, results):
         for i in reversed(range(self.grid_layout.count())):
             widget = self.grid_layout.itemAt(i).widget()
             if widget:
                 widget.setParent(None)
         
         self.product_cards = []
+        self.product_results = None
         
         if not self.all_products:
-            no_products_label = QLabel("Нет товаров для отображения")
+            no_products_label = QLabel("Загрузка каталога..." if self.catalog_task is not None else "Нет товаров для отображения")
             no_products_label.setStyleSheet("font-size: 16px; color: #6c757d;")
             no_products_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
             self.grid_layout.addWidget(no_products_label, 0, 0)
             return
         
-        filtered_products = self.product_filter.filter_products(self.all_products)
+        self.product_results = results
         
-        if not filtered_products:
+        if not len(self.product_results):
             filter_info = QLabel(f"Нет товаров, соответствующих фильтрам: {self.product_filter.get_filter_summary()}")
             filter_info.setStyleSheet("font-size: 16px; color: #6c757d; padding: 20px;")
             filter_info.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -641,11 +1030,25 @@ class MainWindow(QMainWindow):
             self.grid_layout.addWidget(filter_info, 0, 0)
             return
     
-        for product_data in filtered_products:
+        self.append_product_page()
+    
+    def append_product_page(self):
+        # Лучшие совпадения выводятся первыми, остальные догружаются при прокрутке
+        columns_count = self.get_columns_count()
+        for product_data in self.product_results.take(RESULTS_PAGE_SIZE):
             product_card = ProductCard(product_data, self)
+            index = len(self.product_cards)
             self.product_cards.append(product_card)
+            self.grid_layout.addWidget(product_card, index // columns_count, index % columns_count)
         
-        self.update_grid_layout()
+        self.adjust_cards_size()
+    
+    def on_products_scrolled(self, value):
+        if self.product_results is None or not self.product_results.has_more():
+            return
+        scroll_bar = self.products_scroll.verticalScrollBar()
+        if value >= scroll_bar.maximum() - 200:
+            self.append_product_page()
     
     def load_cart_from_db(self):
         if self.current_user.get('is_first_user', False):
@@ -670,15 +1073,57 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "Ошибка", "Необходимо войти в систему")
             return
         
-        success, message = config.add_to_cart(self.user_id, product_id)
+        success, result = config.add_to_cart(self.user_id, product_id)
         
         if success:
-            self.load_cart_from_db()
-            
-            if self.current_mode == "cart":
+            self.apply_cart_line(result)
+        else:
+            QMessageBox.warning(self, "Ошибка", result)
+    
+    def apply_cart_line(self, line):
+        if self.current_user.get('is_first_user', False):
+            return
+        
+        article = line['article']
+        quantity = line['quantity']
+        widget = self.cart_widgets_by_article.get(article)
+        item = self.cart_lines.get(article)
+        
+        if item:
+            self.cart_total -= self.get_line_total(item['price'], item['quantity'])
+        
+        if quantity <= 0:
+            if item:
+                self.cart_items.remove(item)
+                del self.cart_lines[article]
+            if widget:
+                self.cart_widgets.remove(widget)
+                del self.cart_widgets_by_article[article]
+                widget.setParent(None)
+                widget.deleteLater()
+            if not self.cart_items:
                 self.update_cart_display()
+                return
+        elif item and widget:
+            item['quantity'] = quantity
+            item['price'] = line['price']
+            self.cart_total += self.get_line_total(line['price'], quantity)
+            widget.set_quantity(quantity)
         else:
-            QMessageBox.warning(self, "Ошибка", message)
+            if item:
+                self.cart_items.remove(item)
+            was_empty = not self.cart_items
+            item = dict(line)
+            self.cart_items.append(item)
+            self.cart_lines[article] = item
+            self.cart_total += self.get_line_total(line['price'], quantity)
+            if was_empty:
+                self.update_cart_display()
+                return
+            self.add_cart_item_widget(line)
+        
+        self.update_cart_total()
+        self.update_cart_recommendations()
     
     def create_cart_section(self):
         cart_widget = QWidget()
@@ -751,10 +1196,11 @@ class MainWindow(QMainWindow):
         history_label.setStyleSheet("font-size: 18px; font-weight: bold; color: #495057;")
         right_layout.addWidget(history_label)
         
-        history_scroll = QScrollArea()
-        history_scroll.setWidgetResizable(True)
-        history_scroll.setFixedHeight(250)
-        history_scroll.setStyleSheet("background-color: white; border: 1px solid #dee2e6; border-radius: 8px;")
+        self.history_scroll = QScrollArea()
+        self.history_scroll.setWidgetResizable(True)
+        self.history_scroll.setFixedHeight(250)
+        self.history_scroll.setStyleSheet("background-color: white; border: 1px solid #dee2e6; border-radius: 8px;")
+        self.history_scroll.verticalScrollBar().valueChanged.connect(self.on_history_scrolled)
         
         self.history_widget = QWidget()
         self.history_widget.setStyleSheet("background-color: white;")
@@ -762,8 +1208,8 @@ class MainWindow(QMainWindow):
         self.history_layout.setSpacing(8)
         self.history_layout.setContentsMargins(15, 15, 15, 15)
         
-        history_scroll.setWidget(self.history_widget)
-        right_layout.addWidget(history_scroll)
+        self.history_scroll.setWidget(self.history_widget)
+        right_layout.addWidget(self.history_scroll)
         
         back_button = QPushButton("Назад")
         back_button.setFixedHeight(45)
@@ -778,6 +1224,19 @@ class MainWindow(QMainWindow):
         
         cart_layout.addWidget(content_container)
         
+        self.cart_recommendations_title = QLabel("С этими товарами покупают")
+        self.cart_recommendations_title.setStyleSheet("font-size: 18px; font-weight: bold; color: #495057;")
+        self.cart_recommendations_title.hide()
+        cart_layout.addWidget(self.cart_recommendations_title)
+        
+        self.cart_recommendations_widget = QWidget()
+        self.cart_recommendations_widget.setStyleSheet("background-color: white;")
+        self.cart_recommendations_layout = QHBoxLayout(self.cart_recommendations_widget)
+        self.cart_recommendations_layout.setContentsMargins(0, 0, 0, 0)
+        self.cart_recommendations_layout.setSpacing(10)
+        self.cart_recommendations_widget.hide()
+        cart_layout.addWidget(self.cart_recommendations_widget)
+        
         return cart_widget
     
     def update_cart_display(self):
@@ -789,6 +1248,10 @@ class MainWindow(QMainWindow):
             if widget:
                 widget.setParent(None)
         
+        self.cart_widgets = []
+        self.cart_widgets_by_article = {}
+        self.cart_lines = {item['article']: item for item in self.cart_items}
+        
         if not self.cart_items:
             empty_label = QLabel("Корзина пуста")
             empty_label.setStyleSheet("font-size: 16px; color: #6c757d;")
@@ -832,27 +1295,63 @@ class MainWindow(QMainWindow):
             
             self.cart_items_layout.addWidget(header_widget)
             
-            self.cart_widgets = []
             for item in self.cart_items:
-                cart_item_widget = CartItemWidget(
-                    item['product_id'],
-                    item['article'],
-                    item['name'],
-                    item['price'],
-                    item['quantity'],
-                    self.user_id
-                )
-                self.cart_widgets.append(cart_item_widget)
-                self.cart_items_layout.addWidget(cart_item_widget)
+                self.add_cart_item_widget(item)
         
+        self.cart_total = self.calculate_cart_total()
         self.update_cart_total()
+        self.update_cart_recommendations()
     
-    def update_cart_total(self):
-        total = 0
-        for widget in self.cart_widgets:
-            total += widget.get_total_price()
+    def update_cart_recommendations(self):
+        # Запрос к базе только при изменении набора артикулов в корзине
+        articles = frozenset(self.cart_lines)
+        if articles == self.cart_recommendations_articles:
+            return
+        self.cart_recommendations_articles = articles
+        
+        if articles:
+            self.load_bought_together(articles, self.on_cart_recommendations_loaded)
+        else:
+            self.show_cart_recommendations([])
+    
+    def on_cart_recommendations_loaded(self, result):
+        if result is None:
+            # Запрос не удался: при следующем изменении корзины он повторится
+            self.cart_recommendations_articles = None
+            return
+        
+        # Пока шел запрос, корзина могла измениться: устаревший ответ отбрасывается
+        articles, products = result
+        if articles == self.cart_recommendations_articles:
+            self.show_cart_recommendations(self.get_catalog_products(products))
+    
+    def show_cart_recommendations(self, products):
+        while self.cart_recommendations_layout.count():
+            widget = self.cart_recommendations_layout.takeAt(0).widget()
+            if widget:
+                widget.deleteLater()
         
-        self.total_label.setText(f"Общая стоимость: {total:.2f} руб.")
+        for product in products:
+            self.cart_recommendations_layout.addWidget(ProductCard(product, self))
+        self.cart_recommendations_layout.addStretch()
+        self.cart_recommendations_title.setVisible(bool(products))
+        self.cart_recommendations_widget.setVisible(bool(products))
+    
+    def add_cart_item_widget(self, item):
+        cart_item_widget = CartItemWidget(
+            item['product_id'],
+            item['article'],
+            item['name'],
+            item['price'],
+            item['quantity'],
+            self.user_id
+        )
+        self.cart_widgets.append(cart_item_widget)
+        self.cart_widgets_by_article[item['article']] = cart_item_widget
+        self.cart_items_layout.addWidget(cart_item_widget)
+    
+    def update_cart_total(self):
+        self.total_label.setText(f"Общая стоимость: {self.cart_total:.2f} руб.")
     
     def checkout_order(self):
         if self.current_user.get('is_first_user', False):
@@ -867,7 +1366,7 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "Корзина пуста", "Добавьте товары в корзину перед оформлением заказа")
             return
         
-        total = self.calculate_cart_total()
+        total = self.cart_total
         
         # Убрали окно подтверждения - сразу создаем заказ
         success, result = config.create_order(self.user_id, self.cart_items)
@@ -881,16 +1380,21 @@ class MainWindow(QMainWindow):
             
             self.load_cart_from_db()
             self.load_order_history()
+            self.refresh_recommendations()
             
             if self.current_mode == "sales":
                 self.update_sales_chart()
         else:
             QMessageBox.warning(self, "Ошибка", result)
     
+    def get_line_total(self, price, quantity):
+        # str() сохраняет десятичное значение цены, пришедшей как float
+        return Decimal(str(price)) * quantity
+    
     def calculate_cart_total(self):
-        total = 0
+        total = Decimal(0)
         for item in self.cart_items:
-            total += float(item['price']) * item['quantity']
+            total += self.get_line_total(item['price'], item['quantity'])
         return total
     
     def load_order_history(self):
@@ -905,8 +1409,39 @@ class MainWindow(QMainWindow):
         except Exception:
             self.order_history = []
         
+        self.order_details_cache = {}
+        self.order_details_generation += 1
+        self.order_history_exhausted = len(self.order_history) < config.ORDERS_PAGE_SIZE
         self.update_order_history_display()
     
+    def load_more_order_history(self):
+        if self.order_history_exhausted or not self.order_history:
+            return
+        
+        before_date, before_id = self.order_history[-1]['cursor']
+        
+        try:
+            orders = config.get_user_orders(self.user_id, before_date, before_id)
+        except Exception:
+            orders = []
+        
+        self.order_history_exhausted = len(orders) < config.ORDERS_PAGE_SIZE
+        self.order_history.extend(orders)
+        self.add_order_history_items(orders)
+    
+    def on_history_scrolled(self, value):
+        scroll_bar = self.history_scroll.verticalScrollBar()
+        if value >= scroll_bar.maximum() - 40:
+            self.load_more_order_history()
+    
+    def fill_order_history(self):
+        # Пока заказы помещаются без прокрутки, событий прокрутки не будет:
+        # следующая страница подгружается сразу, пока не появится полоса прокрутки
+        if self.order_history_exhausted or not self.history_scroll.isVisible():
+            return
+        if self.history_scroll.verticalScrollBar().maximum() == 0:
+            self.load_more_order_history()
+    
     def update_order_history_display(self):
         if self.current_user.get('is_first_user', False):
             return
@@ -957,10 +1492,42 @@ class MainWindow(QMainWindow):
             if hasattr(self, 'history_layout'):
                 self.history_layout.addWidget(header_widget)
             
-            for order in self.order_history:
-                order_widget = self.create_order_history_item(order)
-                if hasattr(self, 'history_layout'):
-                    self.history_layout.addWidget(order_widget)
+            self.add_order_history_items(self.order_history)
+    
+    def add_order_history_items(self, orders):
+        if not hasattr(self, 'history_layout'):
+            return
+        
+        for order in orders:
+            order_widget = self.create_order_history_item(order)
+            self.history_layout.addWidget(order_widget)
+        
+        if self.prefetch_order_details and orders:
+            self.prefetch_orders_details([order['order_id'] for order in orders])
+        
+        # Диапазон полосы прокрутки пересчитывается после раскладки новых строк
+        if orders:
+            QTimer.singleShot(0, self.fill_order_history)
+    
+    def prefetch_orders_details(self, order_ids):
+        missing_ids = [order_id for order_id in order_ids if order_id not in self.order_details_cache]
+        if not missing_ids:
+            return
+        
+        # Детали читаются из базы в фоне, чтобы прокрутка истории не ждала запроса
+        generation = self.order_details_generation
+        task = BackgroundTask(lambda: (generation, config.get_orders_details(missing_ids)))
+        task.finished.connect(self.on_orders_details_loaded)
+        QThreadPool.globalInstance().start(task)
+    
+    def on_orders_details_loaded(self, result):
+        if result is None:
+            return
+        
+        # Ответ для истории, загруженной до перезагрузки, отбрасывается
+        generation, details = result
+        if generation == self.order_details_generation:
+            self.order_details_cache.update(details)
     
     def create_order_history_item(self, order):
         widget = QWidget()
@@ -1031,7 +1598,7 @@ class MainWindow(QMainWindow):
         return widget
     
     def show_order_details(self, order_id):
-        dialog = OrderDetailsDialog(order_id, self)
+        dialog = OrderDetailsDialog(order_id, self, self.order_details_cache.get(order_id))
         dialog.exec()
     
     def create_employees_section(self):
@@ -0,0 +1,49 @@
+import re
+from functools import lru_cache
+
+# Товары и запросы сравниваются в латинской записи: "Адидас" и "Adidas" дают одну строку.
+# Буква ё отдельно не нужна - она переводится так же, как е
+CYRILLIC_TO_LATIN = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '',
+    'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya'
+})
+
+# Одни и те же клавиши в раскладках QWERTY и ЙЦУКЕН
+LATIN_LAYOUT = "`qwertyuiop[]asdfghjkl;'zxcvbnm,."
+CYRILLIC_LAYOUT = "ёйцукенгшщзхъфывапролджэячсмитьбю"
+LAYOUT_SWAP = str.maketrans(LATIN_LAYOUT + CYRILLIC_LAYOUT, CYRILLIC_LAYOUT + LATIN_LAYOUT)
+
+SOUND_REPLACEMENTS = (('ph', 'f'), ('ck', 'k'), ('x', 'ks'))
+SIMPLIFY_LETTERS = str.maketrans('cqw', 'kkv', 'aeiouy')
+REPEATED_LETTERS = re.compile(r'(.)\1+')
+
+
+def normalize_text(text):
+    return text.casefold().translate(CYRILLIC_TO_LATIN)
+
+
+def swap_layout(text):
+    return text.translate(LAYOUT_SWAP)
+
+
+def query_variants(text):
+    # Запрос как он набран и тот же запрос, набранный не в той раскладке
+    text = text.casefold().strip()
+    variants = [normalize_text(text)]
+    swapped = normalize_text(swap_layout(text))
+    if swapped != variants[0]:
+        variants.append(swapped)
+    return variants
+
+
+# Слова в каталоге сильно повторяются, поэтому скелеты запоминаются
+@lru_cache(maxsize=65536)
+def sound_key(token):
+    # Согласный "скелет" слова: "найк" и "nike" дают "nk", "рибок" и "reebok" - "rbk"
+    for old, new in SOUND_REPLACEMENTS:
+        token = token.replace(old, new)
+    token = token.translate(SIMPLIFY_LETTERS)
+    return REPEATED_LETTERS.sub(r'\1', token)
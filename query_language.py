@@ -0,0 +1,90 @@
+import re
+from collections import namedtuple
+
+# Поле в запросе -> поле фильтра. Русские названия работают так же, как английские
+FIELD_ALIASES = {
+    'brand': 'brand', 'бренд': 'brand',
+    'category': 'category', 'категория': 'category',
+    'price': 'price', 'цена': 'price',
+    'material': 'material', 'материал': 'material',
+    'color': 'color', 'цвет': 'color',
+    'size': 'size', 'размер': 'size',
+    'gender': 'gender', 'пол': 'gender',
+    'season': 'season', 'сезон': 'season',
+    'country': 'country', 'страна': 'country'
+}
+
+NUMERIC_FIELDS = {'price'}
+
+# Условие вида поле:значение или поле<число, иначе - слово в кавычках или без
+TERM_PATTERN = re.compile(r'(\w+)(<=|>=|<|>|=|:)("[^"]*"?|[^\s"]*)|"[^"]*"?|\S+')
+
+# value - кортеж значений (через запятую, объединяются по OR) или число для числовых полей
+Predicate = namedtuple('Predicate', 'field operator value')
+ParsedQuery = namedtuple('ParsedQuery', 'text predicates')
+
+
+def unquote(value):
+    return value.strip('"')
+
+
+def parse_predicate(field, operator, value):
+    field = FIELD_ALIASES.get(field.casefold())
+    value = unquote(value).strip()
+    if field is None or not value:
+        return None
+
+    if field in NUMERIC_FIELDS:
+        try:
+            number = float(value.replace(',', '.'))
+        except ValueError:
+            return None
+        return Predicate(field, '=' if operator == ':' else operator, number)
+
+    if operator not in (':', '='):
+        return None
+    values = tuple(part.strip().casefold() for part in value.split(',') if part.strip())
+    return Predicate(field, ':', values) if values else None
+
+
+def parse_query(text):
+    # Условия с известными полями превращаются в предикаты, все остальное остается текстом поиска.
+    # Условие известного поля без значения ("brand:" в процессе набора) или с неверным значением
+    # пропускается целиком
+    words = []
+    predicates = []
+    for match in TERM_PATTERN.finditer(text):
+        field, operator, value = match.groups()
+        if field is None:
+            words.append(unquote(match.group()))
+            continue
+
+        predicate = parse_predicate(field, operator, value)
+        if predicate is not None:
+            predicates.append(predicate)
+        elif FIELD_ALIASES.get(field.casefold()) is None:
+            words.append(match.group())
+
+    return ParsedQuery(" ".join(word for word in words if word), tuple(predicates))
+
+
+def price_bounds(predicate):
+    # (нижняя граница, верхняя граница, нижняя строгая, верхняя строгая)
+    value = predicate.value
+    operator = predicate.operator
+    if operator == '<':
+        return None, value, False, True
+    if operator == '<=':
+        return None, value, False, False
+    if operator == '>':
+        return value, None, True, False
+    if operator == '>=':
+        return value, None, False, False
+    return value, value, False, False
+
+
+def format_predicate(predicate):
+    if predicate.field in NUMERIC_FIELDS:
+        return f"{predicate.field}{predicate.operator}{predicate.value:g}"
+    values = ",".join(f'"{value}"' if ' ' in value else value for value in predicate.value)
+    return f"{predicate.field}:{values}"
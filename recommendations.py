@@ -0,0 +1,445 @@
+import argparse
+import heapq
+import math
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+import config
+import seed_data
+from filters import ProductFilter
+from normalization import normalize_text
+from search_index import tokenize
+
+# Сколько похожих товаров хранится для каждого товара и сколько показывается в карточке
+SIMILAR_LIMIT = 12
+SIMILAR_PRODUCTS_SHOWN = 5
+
+# Вес совпадения признака. Похожими считаются только товары одной категории
+FEATURE_WEIGHTS = {
+    'brand': 3.0,
+    'name': 2.0,
+    'gender': 1.5,
+    'material': 1.0,
+    'color': 1.0,
+    'season': 1.0,
+    'band': 1.0
+}
+
+# Близость цен: полный вес при равной цене, ноль - при разнице в e раз и больше
+PRICE_WEIGHT = 2.0
+
+# Ширина ценового диапазона в log(1 + цена): соседние диапазоны отличаются примерно в 1.65 раза
+PRICE_BAND_STEP = 0.5
+
+# Из каждого списка товаров с общим признаком берется столько ближайших по цене с каждой стороны
+PRICE_WINDOW = 12
+
+SIMILAR_PRODUCTS_FILE = 'similar_products.bin'
+
+# Заголовок файла похожих товаров: сигнатура, версия формата, порядок байтов (1 - little-endian),
+# версия каталога, число товаров. Дальше массивы: границы списков, оценки, товары, соседи
+SIMILAR_MAGIC = b'SDSP'
+SIMILAR_FORMAT_VERSION = 1
+SIMILAR_HEADER = struct.Struct('<4sHHqQ')
+
+# Каталоги меньше этого считаются в текущем потоке: запуск пула дороже самого расчета.
+# Поиск соседей на товар в сотни раз дороже индексов каталога, поэтому порог ниже, чем в index_file
+PARALLEL_MIN_PRODUCTS = 2000
+
+# Частей на процесс: категории разного размера раскладываются ровнее
+SHARDS_PER_WORKER = 4
+
+
+def get_product_features(product):
+    log_price = math.log1p(ProductFilter.get_price(product))
+    features = {('band', int(log_price / PRICE_BAND_STEP))}
+    if product.get('brand_id') is not None:
+        features.add(('brand', product['brand_id']))
+    for name in ('material', 'color', 'gender', 'season'):
+        if product.get(name):
+            features.add((name, product[name]))
+    for token in tokenize(normalize_text(product.get('name', ''))):
+        if not token.isdigit():
+            features.add(('name', token))
+    return product.get('category', ''), frozenset(features), log_price
+
+
+class FeaturePosting:
+    # Товары с одним признаком в одной категории по возрастанию цены
+    def __init__(self):
+        self.prices = []
+        self.product_ids = []
+
+    def add(self, log_price, product_id):
+        i = bisect_left(self.prices, log_price)
+        self.prices.insert(i, log_price)
+        self.product_ids.insert(i, product_id)
+
+    def remove(self, log_price, product_id):
+        i = bisect_left(self.prices, log_price)
+        while i < len(self.prices) and self.prices[i] == log_price:
+            if self.product_ids[i] == product_id:
+                del self.prices[i]
+                del self.product_ids[i]
+                return
+            i += 1
+
+    def window(self, log_price, size):
+        i = bisect_left(self.prices, log_price)
+        return self.product_ids[max(0, i - size):i + size]
+
+
+class MappedNeighbors(dict):
+    # Списки соседей из файла по товару: список разбирается при первом обращении к товару,
+    # а не для всех товаров при загрузке. Замененные списки хранятся в самом словаре
+    def __init__(self, product_ids, bounds, scores, neighbor_ids):
+        super().__init__()
+        self.positions = dict(zip(product_ids, range(len(product_ids))))
+        self.bounds = bounds
+        self.scores = scores
+        self.neighbor_ids = neighbor_ids
+
+    def __missing__(self, product_id):
+        i = self.positions[product_id]
+        start, end = self.bounds[i], self.bounds[i + 1]
+        neighbors = self[product_id] = list(zip(self.scores[start:end], self.neighbor_ids[start:end]))
+        return neighbors
+
+    def __delitem__(self, product_id):
+        self.positions.pop(product_id, None)
+        self.pop(product_id, None)
+
+    def get(self, product_id, default=None):
+        try:
+            return self[product_id]
+        except KeyError:
+            return default
+
+
+class SimilarProductsIndex:
+    # Похожие товары считаются заранее: карточка товара получает их одним обращением к словарю
+    def __init__(self, limit=SIMILAR_LIMIT):
+        self.limit = limit
+        self.products = {}
+        self.postings = {}
+        self.neighbors = {}
+        self.referrers = defaultdict(set)
+        # Товары, признаки которых еще не разобраны: у индекса из готовых списков соседей
+        # признаки нужны только для пересчета при изменении каталога
+        self.pending_products = None
+
+    @classmethod
+    def from_products(cls, products):
+        index = cls()
+        index.build(products)
+        return index
+
+    @classmethod
+    def from_neighbors(cls, products, arrays):
+        index = cls()
+        index.neighbors = MappedNeighbors(*arrays)
+        index.pending_products = products
+        return index
+
+    def build(self, products):
+        self.pending_products = None
+        self.build_features(products)
+        self.neighbors = {}
+        self.referrers = defaultdict(set)
+        for product_id in self.products:
+            self.set_neighbors(product_id, self.find_neighbors(product_id))
+
+    def build_features(self, products):
+        self.products = {}
+        self.postings = {}
+
+        pairs = defaultdict(list)
+        for product in products:
+            product_id = product.get('id')
+            category, features, log_price = get_product_features(product)
+            self.products[product_id] = (category, features, log_price)
+            for feature in features:
+                pairs[(category, feature)].append((log_price, product_id))
+
+        for key, items in pairs.items():
+            items.sort()
+            posting = FeaturePosting()
+            posting.prices = [log_price for log_price, _ in items]
+            posting.product_ids = [product_id for _, product_id in items]
+            self.postings[key] = posting
+
+    def ensure_features(self):
+        # Разбор признаков и обратных ссылок для индекса из готовых списков соседей
+        if self.pending_products is None:
+            return
+        products, self.pending_products = self.pending_products, None
+        self.build_features(products)
+        self.referrers = defaultdict(set)
+        for product_id in self.products:
+            for _, neighbor_id in self.neighbors.get(product_id, ()):
+                self.referrers[neighbor_id].add(product_id)
+
+    def __contains__(self, product_id):
+        self.ensure_features()
+        return product_id in self.products
+
+    def get_product_ids(self):
+        self.ensure_features()
+        return self.products.keys()
+
+    def get_neighbor_arrays(self):
+        # Списки соседей всех товаров подряд: (товары, границы списков, оценки, соседи)
+        self.ensure_features()
+        product_ids = array('i')
+        bounds = array('q', [0])
+        scores = array('d')
+        neighbor_ids = array('i')
+        for product_id in self.products:
+            neighbors = self.neighbors.get(product_id, ())
+            product_ids.append(product_id)
+            scores.extend(score for score, _ in neighbors)
+            neighbor_ids.extend(neighbor_id for _, neighbor_id in neighbors)
+            bounds.append(len(neighbor_ids))
+        return product_ids, bounds, scores, neighbor_ids
+
+    def get(self, product_id, count=SIMILAR_PRODUCTS_SHOWN):
+        return [neighbor_id for _, neighbor_id in self.neighbors.get(product_id, ())[:count]]
+
+    def find_candidates(self, product_id):
+        # Грубая оценка: вес признака добавляется товарам из ценового окна его списка
+        category, features, log_price = self.products[product_id]
+        hits = defaultdict(float)
+        for feature in features:
+            posting = self.postings.get((category, feature))
+            if posting is None:
+                continue
+            weight = FEATURE_WEIGHTS[feature[0]]
+            for other_id in posting.window(log_price, PRICE_WINDOW):
+                hits[other_id] += weight
+        hits.pop(product_id, None)
+        return hits
+
+    def score_candidates(self, product_id, candidates):
+        # Точный счет: вес общих признаков и близость цен
+        _, features, log_price = self.products[product_id]
+        products = self.products
+        weight = FEATURE_WEIGHTS.__getitem__
+        kind = itemgetter(0)
+        scored = []
+        for other_id in candidates:
+            _, other_features, other_log_price = products[other_id]
+            score = sum(map(weight, map(kind, features & other_features)))
+            scored.append((score + PRICE_WEIGHT * max(0.0, 1.0 - abs(log_price - other_log_price)), other_id))
+        return scored
+
+    def find_neighbors(self, product_id, hits=None):
+        # Точно пересчитываются только лучшие по грубой оценке кандидаты
+        if hits is None:
+            hits = self.find_candidates(product_id)
+        candidates = heapq.nlargest(self.limit * 2, hits, key=hits.__getitem__)
+        return heapq.nlargest(self.limit, self.score_candidates(product_id, candidates), key=itemgetter(0))
+
+    def set_neighbors(self, product_id, neighbors):
+        for _, old_id in self.neighbors.get(product_id, ()):
+            self.referrers[old_id].discard(product_id)
+        self.neighbors[product_id] = neighbors
+        for _, neighbor_id in neighbors:
+            self.referrers[neighbor_id].add(product_id)
+
+    def add(self, product):
+        self.ensure_features()
+        product_id = product.get('id')
+        self.remove(product_id)
+
+        category, features, log_price = get_product_features(product)
+        self.products[product_id] = (category, features, log_price)
+        for feature in features:
+            key = (category, feature)
+            posting = self.postings.get(key)
+            if posting is None:
+                posting = self.postings[key] = FeaturePosting()
+            posting.add(log_price, product_id)
+
+        hits = self.find_candidates(product_id)
+        self.set_neighbors(product_id, self.find_neighbors(product_id, hits))
+
+        # Новый товар попадает в списки соседей, где он ближе самого дальнего из них
+        for score, other_id in self.score_candidates(product_id, hits):
+            neighbors = self.neighbors.get(other_id)
+            if neighbors is None:
+                continue
+            if len(neighbors) < self.limit or score > neighbors[-1][0]:
+                neighbors = sorted(neighbors + [(score, product_id)], key=itemgetter(0), reverse=True)
+                self.set_neighbors(other_id, neighbors[:self.limit])
+
+    def remove(self, product_id):
+        self.ensure_features()
+        entry = self.products.pop(product_id, None)
+        if entry is None:
+            return False
+
+        category, features, log_price = entry
+        for feature in features:
+            posting = self.postings.get((category, feature))
+            if posting is not None:
+                posting.remove(log_price, product_id)
+
+        self.set_neighbors(product_id, [])
+        del self.neighbors[product_id]
+
+        # Товары, у которых он был среди похожих, пересчитываются без него
+        for referrer_id in self.referrers.pop(product_id, set()):
+            if referrer_id in self.products:
+                self.set_neighbors(referrer_id, self.find_neighbors(referrer_id))
+        return True
+
+    def update(self, previous_products, products):
+        # Перечитанный каталог: пересчитываются только добавленные, удаленные и измененные товары
+        previous = {product.get('id'): product for product in previous_products}
+        for product in products:
+            if previous.pop(product.get('id'), None) != product:
+                self.add(product)
+        for product_id in previous:
+            self.remove(product_id)
+
+
+def build_neighbor_shard(products):
+    # Выполняется в процессе пула. Похожие ищутся только внутри категории, а часть
+    # состоит из целых категорий, поэтому части считаются независимо
+    return SimilarProductsIndex.from_products(products).get_neighbor_arrays()
+
+
+def build_neighbor_arrays(products, workers=None):
+    # Расчет идет в отдельных процессах: чистый Python в потоке приложения держал бы GIL
+    # и отнимал время у интерфейса
+    workers = workers or os.cpu_count() or 1
+    if len(products) < PARALLEL_MIN_PRODUCTS:
+        parts = [build_neighbor_shard(products)]
+    else:
+        categories = defaultdict(list)
+        for product in products:
+            categories[product.get('category', '')].append(product)
+        # Категории от больших к меньшим кладутся в самую маленькую часть
+        shards = [[] for _ in range(min(len(categories), workers * SHARDS_PER_WORKER))]
+        for group in sorted(categories.values(), key=len, reverse=True):
+            min(shards, key=len).extend(group)
+        # spawn, а не fork: расчет запускают из окна приложения, где уже работают потоки Qt
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            parts = list(executor.map(build_neighbor_shard, shards))
+
+    product_ids = array('i')
+    bounds = array('q', [0])
+    scores = array('d')
+    neighbor_ids = array('i')
+    for part_product_ids, part_bounds, part_scores, part_neighbor_ids in parts:
+        offset = len(neighbor_ids)
+        product_ids.extend(part_product_ids)
+        bounds.extend(bound + offset for bound in part_bounds[1:])
+        scores.extend(part_scores)
+        neighbor_ids.extend(part_neighbor_ids)
+    return product_ids, bounds, scores, neighbor_ids
+
+
+def write_similar_file(path, revision, arrays):
+    product_ids, bounds, scores, neighbor_ids = arrays
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'wb') as file:
+        file.write(SIMILAR_HEADER.pack(SIMILAR_MAGIC, SIMILAR_FORMAT_VERSION, sys.byteorder == 'little',
+                                       revision, len(product_ids)))
+        # Массивы по 8 байт идут первыми: после заголовка в 24 байта они остаются выровненными
+        for values in (bounds, scores, product_ids, neighbor_ids):
+            file.write(values.tobytes())
+    # Файл подменяется целиком: читатель видит либо старую, либо новую версию
+    os.replace(temporary_path, path)
+
+
+def read_similar_file(path, revision):
+    # Массивы соседей - срезы отображенного в память файла; None, если файла нет,
+    # он другой версии формата или собран для другой версии каталога
+    try:
+        with open(path, 'rb') as file:
+            header = file.read(SIMILAR_HEADER.size)
+            if len(header) < SIMILAR_HEADER.size:
+                return None
+            magic, version, little_endian, file_revision, count = SIMILAR_HEADER.unpack(header)
+            if (magic != SIMILAR_MAGIC or version != SIMILAR_FORMAT_VERSION
+                    or bool(little_endian) != (sys.byteorder == 'little') or file_revision != revision):
+                return None
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    data = memoryview(mapped)
+    offset = SIMILAR_HEADER.size
+
+    def view_array(typecode, length):
+        nonlocal offset
+        size = length * array(typecode).itemsize
+        if offset + size > len(data):
+            raise ValueError("Файл похожих товаров обрезан")
+        values = data[offset:offset + size].cast(typecode)
+        offset += size
+        return values
+
+    try:
+        bounds = view_array('q', count + 1)
+        total = bounds[-1]
+        scores = view_array('d', total)
+        product_ids = view_array('i', count)
+        neighbor_ids = view_array('i', total)
+    except ValueError:
+        return None
+    return product_ids, bounds, scores, neighbor_ids
+
+
+def prepare_similar_products(products, revision, path=None, workers=None):
+    # Списки соседей берутся из файла, если он собран для этой версии каталога и тех же товаров;
+    # иначе считаются пулом процессов и сохраняются для следующего запуска.
+    # Окно не затрагивается, поэтому функцию можно вызывать в фоновом потоке
+    if revision is not None:
+        path = path or config.get_data_path(SIMILAR_PRODUCTS_FILE)
+    arrays = read_similar_file(path, revision) if revision is not None else None
+    if arrays is None or len(arrays[0]) != len(products) or (
+            set(arrays[0]) != {product.get('id') for product in products}):
+        arrays = build_neighbor_arrays(products, workers)
+        if revision is not None:
+            try:
+                write_similar_file(path, revision, arrays)
+            except OSError:
+                pass
+            else:
+                # Собранные массивы заменяются отображением файла: память отдается системе
+                arrays = read_similar_file(path, revision) or arrays
+    return SimilarProductsIndex.from_neighbors(products, arrays)
+
+
+def main(argv=None):
+    # Пакетное обновление "С этим товаром покупают": по умолчанию учитываются только новые заказы
+    parser = argparse.ArgumentParser(description="Обновление рекомендаций по совместным покупкам из истории заказов")
+    seed_data.add_connection_arguments(parser)
+    parser.add_argument('--rebuild', action='store_true', help="Пересчитать пары по всем заказам заново")
+    parser.add_argument('--min-support', type=int, default=config.RECOMMENDATION_MIN_SUPPORT,
+                        help="Сколько заказов должно содержать пару, чтобы она стала рекомендацией")
+    parser.add_argument('--top-k', type=int, default=config.RECOMMENDATIONS_PER_ARTICLE,
+                        help="Сколько рекомендаций хранить для каждого артикула")
+    args = parser.parse_args(argv)
+
+    seed_data.apply_connection_arguments(args)
+    success, result = config.refresh_recommendations(args.min_support, args.top_k, args.rebuild)
+    if not success:
+        print(result, file=sys.stderr)
+        return 1
+    print(f"Обновлены рекомендации для артикулов: {result}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,670 @@
+import heapq
+import re
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, defaultdict, deque
+from itertools import compress, repeat
+from normalization import normalize_text, sound_key
+
+
+# Битовые карты хранятся как int; в строку из байтов 0/1 и обратно их переводят
+# встроенные bin()/int(), чтобы не перебирать биты циклом Python
+BIT_CHARS = bytes.maketrans(b'01', b'\x00\x01')
+
+
+def rows_to_bitmap(rows):
+    if not rows:
+        return 0
+    digits = bytearray(b'0') * (max(rows) + 1)
+    deque(map(digits.__setitem__, rows, repeat(ord('1'))), maxlen=0)
+    digits.reverse()
+    return int(digits, 2)
+
+
+def bitmap_bits(bitmap):
+    return bin(bitmap)[:1:-1].encode('ascii').translate(BIT_CHARS)
+
+
+def bitmap_to_rows(bitmap):
+    bits = bitmap_bits(bitmap)
+    return list(compress(range(len(bits)), bits))
+
+
+def filter_rows_by_bitmap(rows, bitmap):
+    if not rows:
+        return []
+    bits = bitmap_bits(bitmap)
+    size = max(rows) + 1
+    if len(bits) < size:
+        bits += bytes(size - len(bits))
+    return list(compress(rows, map(bits.__getitem__, rows)))
+
+
+def rows_to_flags(rows, size):
+    flags = bytearray(size)
+    deque(map(flags.__setitem__, rows, repeat(1)), maxlen=0)
+    return flags
+
+
+def inverse_permutation(permutation):
+    inverse = [0] * len(permutation)
+    deque(map(inverse.__setitem__, permutation, range(len(permutation))), maxlen=0)
+    return inverse
+
+
+def union_bitmaps(bitmaps):
+    result = 0
+    for bitmap in bitmaps:
+        result |= bitmap
+    return result
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def posting_contains(posting, row):
+    i = bisect_left(posting, row)
+    return i < len(posting) and posting[i] == row
+
+
+def intersect_postings(postings):
+    postings = sorted(postings, key=len)
+    result = postings[0]
+    members = None
+    for posting in postings[1:]:
+        if not result:
+            break
+        # Маленький список проверяем бинарным поиском, соизмеримые пересекаем через set
+        if len(result) * 16 < len(posting):
+            if members is not None:
+                result = sorted(members)
+                members = None
+            result = [row for row in result if posting_contains(posting, row)]
+        else:
+            if members is None:
+                members = set(result)
+            members.intersection_update(posting)
+            result = members
+    if members is not None:
+        return sorted(members)
+    return list(result)
+
+
+class TrigramIndex:
+    def __init__(self):
+        self.postings = {}
+
+    def clear(self):
+        self.postings = {}
+
+    def load(self, postings):
+        # Списки из файла индексов (index_file) - срезы отображенного в память файла
+        self.postings = postings
+
+    def get_writable(self, key):
+        # Списки из файла доступны только для чтения: при первом изменении копируются в array
+        posting = self.postings.get(key)
+        if posting is not None and not isinstance(posting, array):
+            posting = self.postings[key] = array('i', posting)
+        return posting
+
+    def get_keys(self, text):
+        return trigrams(text)
+
+    def add(self, row, text):
+        for gram in self.get_keys(text):
+            posting = self.get_writable(gram)
+            if posting is None:
+                self.postings[gram] = array('i', [row])
+            elif posting[-1] < row:
+                posting.append(row)
+            else:
+                i = bisect_left(posting, row)
+                if i == len(posting) or posting[i] != row:
+                    posting.insert(i, row)
+
+    def remove(self, row, text):
+        for gram in self.get_keys(text):
+            posting = self.get_writable(gram)
+            if posting is None:
+                continue
+            i = bisect_left(posting, row)
+            if i < len(posting) and posting[i] == row:
+                del posting[i]
+                if not posting:
+                    del self.postings[gram]
+
+    def candidates(self, query):
+        grams = trigrams(query)
+        if not grams:
+            return None
+
+        postings = []
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if not posting:
+                return []
+            postings.append(posting)
+        return intersect_postings(postings)
+
+    def estimate(self, query):
+        # Кандидатов не больше, чем строк у самой редкой триграммы запроса
+        grams = trigrams(query)
+        if not grams:
+            return None
+        return min(len(self.postings.get(gram, ())) for gram in grams)
+
+
+class AttributeIndex:
+    # Атрибуты товаров со словарным кодированием. Набор значений всех атрибутов строки -
+    # ее профиль: строка хранит только номер профиля, а каждое значение атрибута -
+    # битовую карту своих строк (инвертированный список)
+    def __init__(self, names):
+        self.names = tuple(names)
+        self.clear()
+
+    def clear(self):
+        self.profiles = []
+        self.profile_codes = {}
+        self.row_profiles = array('i')
+        self.postings = {name: {} for name in self.names}
+
+    def get_profile(self, values):
+        profile = tuple(values)
+        code = self.profile_codes.get(profile)
+        if code is None:
+            code = len(self.profiles)
+            self.profile_codes[profile] = code
+            self.profiles.append(profile)
+        return code
+
+    def build(self, rows_values):
+        self.clear()
+        self.row_profiles = array('i', map(self.get_profile, rows_values))
+
+        profile_rows = defaultdict(list)
+        for row, code in enumerate(self.row_profiles):
+            profile_rows[code].append(row)
+
+        value_rows = {name: defaultdict(list) for name in self.names}
+        for code, rows in profile_rows.items():
+            for name, value in zip(self.names, self.profiles[code]):
+                value_rows[name][value].extend(rows)
+        for name, rows_by_value in value_rows.items():
+            self.postings[name] = {value: rows_to_bitmap(rows) for value, rows in rows_by_value.items()}
+
+    def load(self, profiles, row_profiles, postings):
+        # Профили строк из файла индексов - срез отображенного в память файла до первого изменения
+        self.profiles = [tuple(profile) for profile in profiles]
+        self.profile_codes = {profile: code for code, profile in enumerate(self.profiles)}
+        self.row_profiles = row_profiles
+        self.postings = {name: dict(postings.get(name, {})) for name in self.names}
+
+    def make_writable(self):
+        if not isinstance(self.row_profiles, array):
+            self.row_profiles = array('i', self.row_profiles)
+
+    def add(self, row, values):
+        self.make_writable()
+        code = self.get_profile(values)
+        while len(self.row_profiles) <= row:
+            self.row_profiles.append(-1)
+        self.row_profiles[row] = code
+
+        bit = 1 << row
+        for name, value in zip(self.names, self.profiles[code]):
+            postings = self.postings[name]
+            postings[value] = postings.get(value, 0) | bit
+
+    def remove(self, row):
+        code = self.row_profiles[row]
+        if code < 0:
+            return
+        self.make_writable()
+        self.row_profiles[row] = -1
+
+        bit = ~(1 << row)
+        for name, value in zip(self.names, self.profiles[code]):
+            postings = self.postings[name]
+            postings[value] = postings.get(value, 0) & bit
+
+    def get_values(self, name):
+        return sorted(value for value, bitmap in self.postings[name].items() if value and bitmap)
+
+    def bitmap(self, name, values):
+        postings = self.postings[name]
+        return union_bitmaps(postings.get(value, 0) for value in values)
+
+    def counts(self, rows, selected=None):
+        # Один проход по строкам результата считает профили; число атрибутов влияет
+        # только на разбор различных профилей, а их намного меньше, чем строк.
+        # selected - выбранные значения (атрибут -> значения), еще не примененные к rows.
+        # Профиль, не прошедший ровно один выбор, учитывается только в счетчиках этого
+        # атрибута: значения внутри атрибута объединяются, и выбор другого значения
+        # добавит такие строки к выдаче
+        checks = [(position, frozenset(selected[name])) for position, name in enumerate(self.names)
+                  if selected and name in selected]
+        profile_counts = Counter(map(self.row_profiles.__getitem__, rows))
+        counts = {name: Counter() for name in self.names}
+        for code, count in profile_counts.items():
+            if code < 0:
+                continue
+            profile = self.profiles[code]
+            missed = [position for position, values in checks if profile[position] not in values]
+            if not missed:
+                values = zip(self.names, profile)
+            elif len(missed) == 1:
+                values = ((self.names[missed[0]], profile[missed[0]]),)
+            else:
+                continue
+            for name, value in values:
+                if value:
+                    counts[name][value] += count
+        return counts
+
+
+class SortedValueIndex:
+    # Значения по возрастанию и номера их строк в том же порядке: диапазон значений - два bisect
+    def __init__(self):
+        self.values = array('d')
+        self.rows = array('i')
+
+    def build(self, pairs):
+        pairs = sorted(pairs)
+        self.values = array('d', [value for value, _ in pairs])
+        self.rows = array('i', [row for _, row in pairs])
+
+    def load(self, values, rows):
+        # Массивы из файла индексов читаются прямо из отображенного в память файла
+        # и копируются только при первом изменении
+        self.values = values
+        self.rows = rows
+
+    def make_writable(self):
+        if not isinstance(self.values, array):
+            self.values = array('d', self.values)
+            self.rows = array('i', self.rows)
+
+    def add(self, row, value):
+        self.make_writable()
+        i = bisect_right(self.values, value)
+        self.values.insert(i, value)
+        self.rows.insert(i, row)
+
+    def remove(self, row, value):
+        self.make_writable()
+        start = bisect_left(self.values, value)
+        end = bisect_right(self.values, value, start)
+        for i in range(start, end):
+            if self.rows[i] == row:
+                del self.values[i]
+                del self.rows[i]
+                return
+
+    def bounds(self):
+        if not self.values:
+            return None
+        return self.values[0], self.values[-1]
+
+    def span(self, low=None, high=None, strict_low=False, strict_high=False):
+        if low is None:
+            start = 0
+        else:
+            start = (bisect_right if strict_low else bisect_left)(self.values, low)
+        if high is None:
+            end = len(self.values)
+        else:
+            end = (bisect_left if strict_high else bisect_right)(self.values, high)
+        return start, max(start, end)
+
+    def count(self, low=None, high=None, strict_low=False, strict_high=False):
+        start, end = self.span(low, high, strict_low, strict_high)
+        return end - start
+
+    def range_rows(self, low=None, high=None, strict_low=False, strict_high=False):
+        start, end = self.span(low, high, strict_low, strict_high)
+        return self.rows[start:end]
+
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class SoundIndex(TrigramIndex):
+    # Те же списки строк, но ключ - согласный скелет целого слова, а не триграмма
+    def get_keys(self, text):
+        keys = {sound_key(token) for token in tokenize(text)}
+        return {key for key in keys if len(key) >= 2}
+
+    def rows(self, token):
+        return self.postings.get(sound_key(token), ())
+
+
+def edit_distance(source, target, max_distance):
+    # Расстояние Дамерау-Левенштейна (с перестановкой соседних букв) с ранним выходом:
+    # если оно больше max_distance, возвращается max_distance + 1
+    if abs(len(source) - len(target)) > max_distance:
+        return max_distance + 1
+
+    before_previous = None
+    previous = list(range(len(target) + 1))
+    for i in range(1, len(source) + 1):
+        current = [i] + [0] * len(target)
+        row_min = i
+        for j in range(1, len(target) + 1):
+            cost = 0 if source[i - 1] == target[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (i > 1 and j > 1 and source[i - 1] == target[j - 2]
+                    and source[i - 2] == target[j - 1]):
+                value = min(value, before_previous[j - 2] + 1)
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return max_distance + 1
+        before_previous, previous = previous, current
+
+    return min(previous[-1], max_distance + 1)
+
+
+def deletes(word, max_distance):
+    variants = {word}
+    edge = {word}
+    for _ in range(max_distance):
+        next_edge = set()
+        for variant in edge:
+            if len(variant) > 1:
+                for i in range(len(variant)):
+                    next_edge.add(variant[:i] + variant[i + 1:])
+        next_edge -= variants
+        variants |= next_edge
+        edge = next_edge
+    return variants
+
+
+class FuzzyIndex:
+    # Стоимость совпадения слова запроса со словом товара: чем меньше, тем выше товар в выдаче
+    EXACT_COST = 0
+    PREFIX_COST = 1
+    TYPO_COST = 1
+    TYPO_PREFIX_COST = 2
+
+    def __init__(self, max_distance=2, prefix_length=7, prefix_limit=200):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.prefix_limit = prefix_limit
+        self.term_rows = {}
+        self.deletes = {}
+        self.terms = []
+        self.terms_sorted = True
+
+    def add(self, row, terms):
+        for term in terms:
+            posting = self.term_rows.get(term)
+            if posting is None:
+                self.term_rows[term] = array('i', [row])
+                self.terms.append(term)
+                self.terms_sorted = False
+                for variant in deletes(term[:self.prefix_length], self.max_distance):
+                    self.deletes.setdefault(variant, []).append(term)
+            elif not posting or posting[-1] < row:
+                posting.append(row)
+            else:
+                i = bisect_left(posting, row)
+                if i == len(posting) or posting[i] != row:
+                    posting.insert(i, row)
+
+    def remove(self, row, terms):
+        # Слово остается в словаре с пустым списком строк, чтобы не перестраивать индекс удалений
+        for term in terms:
+            posting = self.term_rows.get(term)
+            if posting is None:
+                continue
+            i = bisect_left(posting, row)
+            if i < len(posting) and posting[i] == row:
+                del posting[i]
+
+    def get_max_distance(self, token):
+        # В артикулах и размерах опечатки дают случайные коды, для них ищем только начало
+        if len(token) <= 2 or any(char.isdigit() for char in token):
+            return 0
+        if len(token) <= 4:
+            return min(1, self.max_distance)
+        return self.max_distance
+
+    def term_matches(self, token, deadline):
+        # Возвращает (совпадения, обрезан ли перебор по времени)
+        matches = {}
+        if self.term_rows.get(token):
+            matches[token] = self.EXACT_COST
+
+        self.sort_terms()
+        i = bisect_left(self.terms, token)
+        end = min(len(self.terms), i + self.prefix_limit)
+        while i < end and self.terms[i].startswith(token):
+            matches.setdefault(self.terms[i], self.PREFIX_COST)
+            i += 1
+
+        max_distance = self.get_max_distance(token)
+        if not max_distance:
+            return matches, False
+
+        checked = set(matches)
+        # Сначала варианты с меньшим числом удалений: они ближе к запросу
+        variants = sorted(deletes(token[:self.prefix_length], max_distance), key=len, reverse=True)
+        for variant in variants:
+            for term in self.deletes.get(variant, ()):
+                if term in checked:
+                    continue
+                checked.add(term)
+                distance = edit_distance(token, term, max_distance)
+                if distance <= max_distance:
+                    matches[term] = self.TYPO_COST + distance
+                elif len(term) > len(token):
+                    # Слово могут еще не допечатать: сравниваем с началом слова той же длины
+                    distance = edit_distance(token, term[:len(token)], max_distance)
+                    if distance <= max_distance:
+                        matches[term] = self.TYPO_PREFIX_COST + distance
+                if len(checked) % 64 == 0 and time.perf_counter() > deadline:
+                    return matches, True
+        return matches, False
+
+    def sort_terms(self):
+        if not self.terms_sorted:
+            self.terms.sort()
+            self.terms_sorted = True
+
+    def has_prefix(self, text):
+        self.sort_terms()
+        i = bisect_left(self.terms, text)
+        return i < len(self.terms) and self.terms[i].startswith(text)
+
+    def search(self, text, limit, time_budget, bitmap=None):
+        # Возвращает (строки, обрезан ли поиск по времени): обрезанный результат зависит
+        # от скорости машины в момент запроса и не должен запоминаться как точный
+        deadline = time.perf_counter() + time_budget
+        truncated = False
+
+        # Артикул вроде "art-00012" ищем целиком, а не по отдельным частям
+        tokens = [text] if self.has_prefix(text) else tokenize(text)
+
+        token_matches = []
+        for token in tokens:
+            matches, token_truncated = self.term_matches(token, deadline)
+            truncated = truncated or token_truncated
+            matches = {term: cost for term, cost in matches.items() if self.term_rows[term]}
+            if not matches:
+                return [], truncated
+            token_matches.append(matches)
+        if not token_matches:
+            return [], truncated
+
+        # Начинаем с самого редкого слова запроса, чтобы пересечения были меньше
+        token_matches.sort(key=lambda matches: sum(len(self.term_rows[term]) for term in matches))
+
+        scores = None
+        for matches in token_matches:
+            costs = {}
+            # Более дешевые совпадения записываются последними и перекрывают дорогие
+            for term, cost in sorted(matches.items(), key=lambda item: -item[1]):
+                costs.update(dict.fromkeys(self.term_rows[term], cost))
+            if scores is None:
+                scores = costs
+            else:
+                scores = {row: scores[row] + costs[row] for row in scores.keys() & costs.keys()}
+            if not scores:
+                return [], truncated
+            if time.perf_counter() > deadline:
+                truncated = True
+                break
+
+        rows = list(scores)
+        if bitmap is not None:
+            rows = filter_rows_by_bitmap(rows, bitmap)
+        return heapq.nsmallest(limit, rows, key=lambda row: (scores[row], row)), truncated
+
+
+class SuggestionIndex:
+    # Подсказки ищутся по началу строки и по началу каждого из первых слов:
+    # "air" подскажет "Nike Air Max"
+    MAX_WORD_STARTS = 4
+    MAX_CACHED_PREFIXES = 4096
+
+    def __init__(self, limit=10):
+        self.limit = limit
+        self.keys = []
+        self.weights = {}
+        self.counts = {}
+        self.top_cache = {}
+        self.loader = None
+
+    @classmethod
+    def get_keys(cls, text):
+        normalized = normalize_text(text)
+        starts = [match.start() for match in TOKEN_PATTERN.finditer(normalized)][:cls.MAX_WORD_STARTS]
+        return {normalized[start:] for start in starts}
+
+    def build(self, items):
+        self.loader = None
+        self.weights = {}
+        self.counts = {}
+        self.top_cache = {}
+        for text, weight in items:
+            if text:
+                self.weights[text] = self.weights.get(text, 0) + weight
+                self.counts[text] = self.counts.get(text, 0) + 1
+        self.keys = sorted((key, text) for text in self.weights for key in self.get_keys(text))
+
+    def load(self, loader):
+        # Подсказки из файла индексов разбираются при первом обращении - первому поиску они не нужны.
+        # loader возвращает (ключи, число товаров с подсказкой, веса)
+        self.loader = loader
+        self.keys = []
+        self.weights = {}
+        self.counts = {}
+        self.top_cache = {}
+
+    def ensure_loaded(self):
+        if self.loader is not None:
+            loader, self.loader = self.loader, None
+            keys, counts, self.weights = loader()
+            self.keys = list(keys)
+            self.counts = dict(counts)
+
+    def add(self, text, weight=0):
+        if not text:
+            return
+        self.ensure_loaded()
+        keys = self.get_keys(text)
+        if text in self.weights:
+            self.weights[text] += weight
+            self.counts[text] += 1
+        else:
+            self.weights[text] = weight
+            self.counts[text] = 1
+            for key in keys:
+                insort(self.keys, (key, text))
+
+        # Вес подсказки только вырос: достаточно поставить ее на место в уже посчитанных списках
+        for prefix, top in self.top_cache.items():
+            if any(key.startswith(prefix) for key in keys):
+                if text not in top:
+                    top.append(text)
+                top.sort(key=self.weights.__getitem__, reverse=True)
+                del top[self.limit:]
+
+    def remove(self, text, weight=0):
+        self.ensure_loaded()
+        if text not in self.counts:
+            return
+        self.counts[text] -= 1
+        self.weights[text] -= weight
+        self.forget(text)
+        if self.counts[text] > 0:
+            return
+
+        del self.counts[text]
+        del self.weights[text]
+        for key in self.get_keys(text):
+            i = bisect_left(self.keys, (key, text))
+            if i < len(self.keys) and self.keys[i] == (key, text):
+                del self.keys[i]
+
+    def forget(self, text):
+        # Вес подсказки уменьшился: списки, где она есть, посчитаем заново при следующем запросе
+        for prefix in [prefix for prefix, top in self.top_cache.items() if text in top]:
+            del self.top_cache[prefix]
+
+    def suggest(self, prefix):
+        self.ensure_loaded()
+        top = self.top_cache.get(prefix)
+        if top is not None:
+            return top
+
+        start = bisect_left(self.keys, (prefix,))
+        end = bisect_left(self.keys, (prefix + '\U0010ffff',), start)
+        candidates = dict.fromkeys(text for _, text in self.keys[start:end])
+        top = heapq.nlargest(self.limit, candidates, key=self.weights.__getitem__)
+
+        if len(self.top_cache) >= self.MAX_CACHED_PREFIXES:
+            self.top_cache.clear()
+        self.top_cache[prefix] = top
+        return top
+
+
+class RankedResults:
+    # Результаты отдаются страницами: куча строится за O(n), а каждая страница
+    # снимает с нее только нужные k элементов, не сортируя остальное
+    def __init__(self, rows, scores=None, lookup=None):
+        self.total = len(rows)
+        self.lookup = lookup
+        self.position = 0
+        if scores is None:
+            self.ordered = rows
+            self.heap = None
+        else:
+            self.ordered = None
+            self.heap = list(zip(scores, rows))
+            heapq.heapify(self.heap)
+
+    def __len__(self):
+        return self.total
+
+    def has_more(self):
+        return self.position < self.total
+
+    def take(self, count):
+        if self.heap is not None:
+            count = min(count, len(self.heap))
+            rows = [heapq.heappop(self.heap)[1] for _ in range(count)]
+        else:
+            rows = self.ordered[self.position:self.position + count]
+        self.position += len(rows)
+        if self.lookup is not None:
+            return list(map(self.lookup, rows))
+        return list(rows)
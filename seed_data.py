@@ -0,0 +1,405 @@
+import argparse
+import math
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from psycopg2.extras import execute_values
+import config
+
+CATEGORIES = [
+    "Аксессуары и дополнения",
+    "Зимние виды спорта",
+    "Водные виды спорта",
+    "Велоспорт",
+    "Единоборства и бокс",
+    "Спортивный инвентарь",
+    "Тренажеры и фитнес",
+    "Одежда и обувь"
+]
+
+CATEGORY_WEIGHTS = [8, 6, 4, 7, 3, 9, 5, 20]
+
+CATEGORY_ITEMS = {
+    "Аксессуары и дополнения": ["Бутылка", "Сумка", "Рюкзак", "Повязка", "Перчатки", "Шейкер"],
+    "Зимние виды спорта": ["Лыжи", "Сноуборд", "Коньки", "Шлем", "Маска", "Палки"],
+    "Водные виды спорта": ["Очки для плавания", "Шапочка", "Ласты", "Гидрокостюм", "Доска", "Купальник"],
+    "Велоспорт": ["Велосипед", "Велошлем", "Велоперчатки", "Насос", "Фонарь", "Замок"],
+    "Единоборства и бокс": ["Перчатки боксерские", "Груша", "Бинты", "Капа", "Шлем боксерский", "Кимоно"],
+    "Спортивный инвентарь": ["Мяч", "Ракетка", "Скакалка", "Коврик", "Гантели", "Обруч"],
+    "Тренажеры и фитнес": ["Беговая дорожка", "Велотренажер", "Эспандер", "Степ-платформа", "Гиря", "Турник"],
+    "Одежда и обувь": ["Кроссовки", "Футболка", "Шорты", "Куртка", "Леггинсы", "Толстовка"]
+}
+
+# Медианная цена категории в рублях, цены распределены логнормально вокруг нее
+CATEGORY_PRICES = {
+    "Аксессуары и дополнения": 1200,
+    "Зимние виды спорта": 9000,
+    "Водные виды спорта": 2500,
+    "Велоспорт": 6000,
+    "Единоборства и бокс": 3500,
+    "Спортивный инвентарь": 2000,
+    "Тренажеры и фитнес": 15000,
+    "Одежда и обувь": 4500
+}
+
+BRAND_NAMES = [
+    "Nike", "Adidas", "Puma", "Reebok", "Asics", "New Balance", "Under Armour",
+    "Columbia", "Salomon", "The North Face", "Mizuno", "Head", "Wilson",
+    "Speedo", "Arena", "Everlast", "Venum", "Merida", "Stels", "Torneo",
+    "Demix", "Outventure", "Fischer", "Atomic", "Burton"
+]
+
+ADJECTIVES = ["Pro", "Lite", "Air", "Max", "Classic", "Sport", "Ultra", "Street", "Trail", "Run"]
+MATERIALS = ["Полиэстер", "Хлопок", "Нейлон", "Кожа", "Пластик", "Алюминий", "Сталь", "Резина"]
+COLORS = ["Черный", "Белый", "Синий", "Красный", "Серый", "Зеленый", "Желтый", "Оранжевый"]
+SIZES = ["XS", "S", "M", "L", "XL", "XXL", "38", "40", "42", "44", "Универсальный"]
+COUNTRIES = ["Китай", "Вьетнам", "Россия", "Индонезия", "Германия", "США", "Италия"]
+GENDERS = ["Мужской", "Женский", "Унисекс"]
+SEASONS = ["Весна", "Лето", "Осень", "Зима", "Всесезонный"]
+FIRST_NAMES = ["Александр", "Мария", "Дмитрий", "Анна", "Иван", "Елена", "Сергей", "Ольга", "Андрей", "Наталья"]
+LAST_NAMES = ["Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов", "Михайлов", "Новиков", "Федоров"]
+
+# Относительная доля заказов по месяцам: пик в ноябре-декабре и летом
+MONTH_WEIGHTS = [0.7, 0.6, 0.8, 0.9, 1.0, 1.2, 1.3, 1.2, 1.0, 0.9, 1.4, 1.8]
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 1, 2, 3, 4, 5, 6, 6, 7, 7, 6, 6, 6, 7, 9, 10, 10, 8, 5, 2]
+
+# Генератор и нагрузочные тесты по умолчанию подключаются к локальному серверу,
+# очистка таблиц разрешена только для него
+LOCAL_HOST = 'localhost'
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+
+def zipf_cum_weights(count, exponent):
+    cum_weights = []
+    total = 0.0
+    for rank in range(1, count + 1):
+        total += 1.0 / (rank ** exponent)
+        cum_weights.append(total)
+    return cum_weights
+
+
+def seasonal_datetime(rng, start, end):
+    span_days = max((end - start).days, 1)
+    max_weight = max(MONTH_WEIGHTS) * 1.2
+    while True:
+        day = start + timedelta(days=rng.randrange(span_days))
+        weight = MONTH_WEIGHTS[day.month - 1]
+        if day.weekday() >= 5:
+            weight *= 1.2
+        if rng.random() * max_weight <= weight:
+            break
+    hour = rng.choices(range(24), weights=HOUR_WEIGHTS)[0]
+    return day.replace(hour=hour, minute=rng.randrange(60), second=rng.randrange(60))
+
+
+def generate_price(rng, category):
+    median = CATEGORY_PRICES[category]
+    price = median * math.exp(rng.gauss(0, 0.6))
+    return round(max(price, 99), -1) - 0.01
+
+
+def seed_brands(cursor, rng, count):
+    names = []
+    for i in range(count):
+        if i < len(BRAND_NAMES):
+            names.append(BRAND_NAMES[i])
+        else:
+            names.append(f"{rng.choice(BRAND_NAMES)} {i}")
+
+    rows = execute_values(cursor, """
+        INSERT INTO brands (brand_name)
+        VALUES %s
+        ON CONFLICT (brand_name) DO UPDATE SET brand_name = EXCLUDED.brand_name
+        RETURNING brand_id
+    """, [(name,) for name in names], fetch=True)
+    return [row[0] for row in rows]
+
+
+def seed_products(cursor, rng, count, brand_ids, zipf_exponent, batch_size):
+    cursor.execute("SELECT COALESCE(MAX(product_id), 0) FROM products")
+    offset = cursor.fetchone()[0]
+
+    brand_cum_weights = zipf_cum_weights(len(brand_ids), zipf_exponent)
+    products = []
+    batch = []
+
+    for i in range(count):
+        category = rng.choices(CATEGORIES, weights=CATEGORY_WEIGHTS)[0]
+        brand_id = rng.choices(brand_ids, cum_weights=brand_cum_weights)[0]
+        item = rng.choice(CATEGORY_ITEMS[category])
+        article = f"SD-{offset + i + 1:07d}"
+        name = f"{item} {rng.choice(ADJECTIVES)} {rng.randrange(100, 1000)}"
+        batch.append((
+            article,
+            name,
+            generate_price(rng, category),
+            brand_id,
+            category,
+            rng.choice(MATERIALS),
+            rng.choice(COLORS),
+            rng.choice(SIZES),
+            rng.choice(COUNTRIES),
+            rng.choice(GENDERS),
+            rng.choice(SEASONS)
+        ))
+
+        if len(batch) >= batch_size:
+            products.extend(_insert_products(cursor, batch))
+            batch = []
+
+    if batch:
+        products.extend(_insert_products(cursor, batch))
+
+    return products
+
+
+def _insert_products(cursor, batch):
+    rows = execute_values(cursor, """
+        INSERT INTO products (
+            article, name, price, brand_id, category, material,
+            color, size, country, gender, season
+        )
+        VALUES %s
+        RETURNING article, name, price
+    """, batch, fetch=True)
+    return [(row[0], row[1], float(row[2])) for row in rows]
+
+
+def seed_users(cursor, rng, count, batch_size):
+    cursor.execute("SELECT COUNT(*), COALESCE(MAX(user_id), 0) FROM users")
+    existing, offset = cursor.fetchone()
+    password_hash = config.hash_password("password")
+
+    # Первый пользователь в системе считается администратором
+    if existing == 0:
+        cursor.execute("""
+            INSERT INTO users (first_name, last_name, email)
+            VALUES ('Админ', 'Магазина', 'admin@example.com')
+            RETURNING user_id
+        """)
+        admin_id = cursor.fetchone()[0]
+        cursor.execute("""
+            INSERT INTO user_credentials (user_id, username, password_hash)
+            VALUES (%s, 'admin', %s)
+        """, (admin_id, password_hash))
+        offset = admin_id
+
+    user_ids = []
+    for start in range(0, count, batch_size):
+        batch = []
+        for i in range(start, min(start + batch_size, count)):
+            number = offset + i + 1
+            birth_date = datetime(1960, 1, 1) + timedelta(days=rng.randrange(365 * 45))
+            batch.append((
+                rng.choice(FIRST_NAMES),
+                rng.choice(LAST_NAMES),
+                birth_date.date(),
+                f"shopper{number}@example.com"
+            ))
+
+        rows = execute_values(cursor, """
+            INSERT INTO users (first_name, last_name, birth_date, email)
+            VALUES %s
+            RETURNING user_id
+        """, batch, fetch=True)
+        batch_ids = [row[0] for row in rows]
+
+        execute_values(cursor, """
+            INSERT INTO user_credentials (user_id, username, password_hash)
+            VALUES %s
+        """, [(user_id, f"shopper{user_id}", password_hash) for user_id in batch_ids])
+        user_ids.extend(batch_ids)
+
+    return user_ids
+
+
+def seed_carts(cursor, rng, count, user_ids, products, product_cum_weights, max_items):
+    rows = []
+    for user_id in rng.sample(user_ids, min(count, len(user_ids))):
+        lines = rng.choices(products, cum_weights=product_cum_weights, k=rng.randint(1, max_items))
+        for article in {line[0] for line in lines}:
+            rows.append((user_id, article, rng.randint(1, 3)))
+
+    if rows:
+        execute_values(cursor, """
+            INSERT INTO cart (user_id, article, quantity)
+            VALUES %s
+            ON CONFLICT (user_id, article) DO NOTHING
+        """, rows)
+    return len(rows)
+
+
+def seed_orders(cursor, rng, count, user_ids, products, product_cum_weights,
+                zipf_exponent, max_items, start, end, batch_size):
+    # Несколько постоянных покупателей делают большую часть заказов
+    shuffled_users = list(user_ids)
+    rng.shuffle(shuffled_users)
+    user_cum_weights = zipf_cum_weights(len(shuffled_users), zipf_exponent * 0.7)
+
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        orders = []
+        order_lines = []
+
+        for _ in range(size):
+            user_id = rng.choices(shuffled_users, cum_weights=user_cum_weights)[0]
+            picked = rng.choices(products, cum_weights=product_cum_weights, k=rng.randint(1, max_items))
+            lines = {}
+            for article, name, price in picked:
+                if article in lines:
+                    lines[article][3] += 1
+                else:
+                    lines[article] = [article, name, price, 1]
+
+            total = sum(price * quantity for _, _, price, quantity in lines.values())
+            orders.append((user_id, seasonal_datetime(rng, start, end), round(total, 2), 'Завершен', len(lines)))
+            order_lines.append(list(lines.values()))
+
+        rows = execute_values(cursor, """
+            INSERT INTO orders (user_id, order_date, total_amount, status, items_count)
+            VALUES %s
+            RETURNING order_id
+        """, orders, fetch=True)
+
+        items = []
+        for (order_id,), lines in zip(rows, order_lines):
+            for article, name, price, quantity in lines:
+                items.append((order_id, article, name, quantity, price, round(price * quantity, 2)))
+
+        execute_values(cursor, """
+            INSERT INTO order_items (order_id, article, product_name, quantity, price, total_price)
+            VALUES %s
+        """, items)
+
+        created += size
+
+    return created
+
+
+def truncate_tables(cursor):
+    cursor.execute("""
+        TRUNCATE order_items, orders, cart, products, brands,
+                 employees, user_credentials, users,
+                 product_pairs, product_recommendations, recommendation_state, recommendation_orders
+        RESTART IDENTITY CASCADE
+    """)
+
+
+def seed(args):
+    host = os.environ.get('STORE_DB_HOST')
+    if args.truncate and not is_local_host(host):
+        print(f"Очистка таблиц разрешена только для локальной базы, а не для {host}", file=sys.stderr)
+        return 1
+
+    if not config.check_tables_exist() and not config.create_tables():
+        print("Не удалось создать таблицы", file=sys.stderr)
+        return 1
+    config.upgrade_tables()
+
+    connection = config.connect_postgres()
+    if not connection:
+        print("Не удалось подключиться к базе данных", file=sys.stderr)
+        return 1
+
+    rng = random.Random(args.seed)
+    end = datetime.strptime(args.end_date, '%Y-%m-%d') if args.end_date else datetime.now()
+    start = datetime.strptime(args.start_date, '%Y-%m-%d') if args.start_date else end - timedelta(days=730)
+
+    try:
+        cursor = connection.cursor()
+
+        if args.truncate:
+            truncate_tables(cursor)
+
+        brand_ids = seed_brands(cursor, rng, args.brands)
+        print(f"Бренды: {len(brand_ids)}")
+
+        products = seed_products(cursor, rng, args.products, brand_ids, args.zipf, args.batch_size)
+        print(f"Товары: {len(products)}")
+
+        user_ids = seed_users(cursor, rng, args.users, args.batch_size)
+        print(f"Покупатели: {len(user_ids)}")
+        connection.commit()
+
+        # Популярность товаров подчиняется закону Ципфа
+        rng.shuffle(products)
+        product_cum_weights = zipf_cum_weights(len(products), args.zipf)
+
+        if products and user_ids:
+            cart_lines = seed_carts(cursor, rng, args.carts, user_ids, products,
+                                    product_cum_weights, args.max_items)
+            print(f"Строки корзин: {cart_lines}")
+
+            orders = seed_orders(cursor, rng, args.orders, user_ids, products, product_cum_weights,
+                                 args.zipf, args.max_items, start, end, args.batch_size)
+            print(f"Заказы: {orders}")
+
+        connection.commit()
+        cursor.close()
+        connection.close()
+
+        success, result = config.refresh_recommendations(rebuild=True)
+        if success:
+            print(f"Артикулы с рекомендациями: {result}")
+        else:
+            print(result, file=sys.stderr)
+        return 0
+
+    except Exception as e:
+        connection.rollback()
+        connection.close()
+        print(f"Ошибка при заполнении базы: {e}", file=sys.stderr)
+        return 1
+
+
+def is_local_host(host):
+    # Путь к каталогу сокета - тоже локальный сервер
+    return host in LOCAL_HOSTS or bool(host) and host.startswith('/')
+
+
+def add_connection_arguments(parser):
+    parser.add_argument('--host', help="Хост PostgreSQL (STORE_DB_HOST)")
+    parser.add_argument('--port', help="Порт PostgreSQL (STORE_DB_PORT)")
+    parser.add_argument('--database', help="Имя базы данных (STORE_DB_NAME)")
+    parser.add_argument('--user', help="Пользователь (STORE_DB_USER)")
+    parser.add_argument('--password', help="Пароль (STORE_DB_PASSWORD)")
+
+
+def apply_connection_arguments(args, default_host=None):
+    # default_host заменяет хост приложения по умолчанию: генератор и нагрузочный тест
+    # без явного --host или STORE_DB_HOST работают только с локальной базой
+    for option, variable in [('host', 'STORE_DB_HOST'), ('port', 'STORE_DB_PORT'),
+                             ('database', 'STORE_DB_NAME'), ('user', 'STORE_DB_USER'),
+                             ('password', 'STORE_DB_PASSWORD')]:
+        value = getattr(args, option)
+        if value:
+            os.environ[variable] = value
+    if default_host and not os.environ.get('STORE_DB_HOST'):
+        os.environ['STORE_DB_HOST'] = default_host
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Заполнение локальной базы магазина синтетическими данными")
+    add_connection_arguments(parser)
+    parser.add_argument('--brands', type=int, default=25)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--carts', type=int, default=300, help="Число покупателей с непустой корзиной")
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--max-items', type=int, default=6, help="Максимум строк в заказе или корзине")
+    parser.add_argument('--zipf', type=float, default=1.1, help="Показатель распределения популярности")
+    parser.add_argument('--start-date', help="Начало периода заказов, ГГГГ-ММ-ДД")
+    parser.add_argument('--end-date', help="Конец периода заказов, ГГГГ-ММ-ДД")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--truncate', action='store_true', help="Очистить таблицы перед заполнением")
+    args = parser.parse_args(argv)
+
+    apply_connection_arguments(args, LOCAL_HOST)
+    return seed(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,7 @@
 import sys
 import os
-import hashlib
+import time
+from collections import OrderedDict, deque
 from pathlib import Path
 from PySide6.QtWidgets import (QWidget, QVBoxLayout, 
                                QHBoxLayout, QLabel, QFrame, QPushButton, QLineEdit, 
@@ -8,12 +9,15 @@ from PySide6.QtWidgets import (QWidget, QVBoxLayout,
                                QListWidget, QListWidgetItem, QComboBox, 
                                QTableWidget, QTableWidgetItem, QHeaderView, 
                                QStackedWidget, QDateEdit, QMessageBox, QCheckBox)
-from PySide6.QtCore import Qt, QTimer, QDate, QUrl, QSize, QObject, Signal, Slot
-from PySide6.QtGui import QColor, QPainter, QFont, QPixmap, QIcon, QPainterPath
+from PySide6.QtCore import (Qt, QTimer, QDate, QUrl, QSize, QObject, Signal, Slot, QRunnable, QThreadPool,
+                            QBuffer, QIODevice, QRect, QPoint)
+from PySide6.QtGui import QColor, QPainter, QFont, QPixmap, QIcon, QPainterPath, QImage, QImageReader
 from PySide6.QtNetwork import QNetworkAccessManager, QNetworkRequest, QNetworkReply
 from PySide6.QtCharts import QChart, QChartView, QBarSet, QBarSeries, QBarCategoryAxis, QValueAxis
+from shiboken6 import isValid
 import config
-from filters import ProductFilter
+from disk_cache import DiskImageCache
+from filters import ProductFilter, ATTRIBUTE_FILTERS
 
 
 class CategoryConfirmationDialog(QDialog):
@@ -49,6 +53,120 @@ class CategoryConfirmationDialog(QDialog):
         layout.addWidget(buttons_container)
 
 
+# Размер картинки в карточках товаров и брендов
+IMAGE_SIZE = QSize(120, 120)
+
+# Сколько памяти (байт) могут занимать уже масштабированные картинки
+PIXMAP_CACHE_BYTES = 64 * 1024 * 1024
+
+# Потоки декодирования картинок и предел картинок, которые одновременно скачиваются или декодируются
+IMAGE_DECODE_THREADS = 2
+MAX_IMAGES_IN_FLIGHT = 8
+
+
+class PixmapCache:
+    # Масштабированные картинки в порядке использования: при превышении объема
+    # вытесняются давно не показанные. Ключ - (url, ширина, высота, devicePixelRatio)
+    def __init__(self, max_bytes=PIXMAP_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.pixmaps = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+    @staticmethod
+    def get_cost(pixmap):
+        return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+        
+    def get(self, key):
+        pixmap = self.pixmaps.get(key)
+        if pixmap is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.pixmaps.move_to_end(key)
+        return pixmap
+        
+    def put(self, key, pixmap):
+        cost = self.get_cost(pixmap)
+        if cost > self.max_bytes:
+            return
+        old = self.pixmaps.pop(key, None)
+        if old is not None:
+            self.bytes -= self.get_cost(old)
+        self.pixmaps[key] = pixmap
+        self.bytes += cost
+        while self.bytes > self.max_bytes:
+            _, evicted = self.pixmaps.popitem(last=False)
+            self.bytes -= self.get_cost(evicted)
+            self.evictions += 1
+            
+    def clear(self):
+        self.pixmaps.clear()
+        self.bytes = 0
+        
+    def get_stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.pixmaps),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes
+        }
+
+
+class ImageDecodeTask(QRunnable):
+    # Декодирование сразу в нужный размер и запись скачанного файла в дисковый кэш вне потока
+    # интерфейса. QPixmap можно создавать только в потоке интерфейса, поэтому задача отдает QImage
+    class Signals(QObject):
+        finished = Signal(object, object)
+    
+    def __init__(self, disk_cache, request_info, path=None, data=None, content_type=None, etag=None):
+        super().__init__()
+        self.disk_cache = disk_cache
+        self.request_info = request_info
+        self.path = path
+        self.data = data
+        self.content_type = content_type
+        self.etag = etag
+        self.signals = ImageDecodeTask.Signals()
+        self.finished = self.signals.finished
+        
+    def run(self):
+        image = QImage()
+        try:
+            if self.data is not None:
+                buffer = QBuffer()
+                buffer.setData(self.data)
+                buffer.open(QIODevice.OpenModeFlag.ReadOnly)
+                image = self.read_image(QImageReader(buffer))
+                # В кэш попадают только картинки, которые удалось прочитать
+                if not image.isNull():
+                    self.disk_cache.put(self.request_info['url'], self.data.data(), self.content_type, self.etag)
+            else:
+                image = self.read_image(QImageReader(str(self.path)))
+        except Exception:
+            pass
+        finally:
+            self.finished.emit(self.request_info, image)
+    
+    def read_image(self, reader):
+        # Форматы, которые умеют декодировать с уменьшением (JPEG), не разворачивают
+        # картинку в полном размере, остальные масштабируются внутри QImageReader
+        _, width, height, pixel_ratio = self.request_info['key']
+        target_size = QSize(width, height) * pixel_ratio
+        source_size = reader.size()
+        if source_size.isValid():
+            reader.setScaledSize(source_size.scaled(target_size, Qt.AspectRatioMode.KeepAspectRatio))
+        image = reader.read()
+        if not image.isNull() and not source_size.isValid():
+            image = image.scaled(target_size, Qt.AspectRatioMode.KeepAspectRatio,
+                                 Qt.TransformationMode.SmoothTransformation)
+        return image
+
+
 class ImageLoader(QObject):
     image_loaded = Signal(str, QPixmap)
     
@@ -57,105 +175,181 @@ class ImageLoader(QObject):
         self.network_manager = QNetworkAccessManager()
         self.network_manager.finished.connect(self._on_image_downloaded)
         self.cache_dir = Path("image_cache")
-        self.cache_dir.mkdir(exist_ok=True)
+        self.disk_cache = DiskImageCache(self.cache_dir)
+        self.memory_cache = PixmapCache()
         self.pending_requests = {}
-        
-    def load_image(self, url, target_widget=None, default_icon=None):
+        # Запросы по ключу картинки: карточки с одной картинкой ждут одной загрузки
+        self.waiting = {}
+        self.queue = deque()
+        self.in_flight = 0
+        self.decode_pool = QThreadPool(self)
+        self.decode_pool.setMaxThreadCount(IMAGE_DECODE_THREADS)
+        
+    def load_image(self, url, target_widget=None, default_icon=None, size=IMAGE_SIZE):
+        pixel_ratio = target_widget.devicePixelRatioF() if target_widget else 1.0
         if not url or not url.strip():
-            return self._get_default_icon(default_icon)
+            return self._get_default_icon(default_icon, size, pixel_ratio)
+        
+        # Карточки пересоздаются при каждой смене фильтра: уже масштабированная картинка
+        # берется из памяти без чтения файла и повторного декодирования
+        key = (url, size.width(), size.height(), pixel_ratio)
+        pixmap = self.memory_cache.get(key)
+        if pixmap is not None:
+            return pixmap
         
         if not url.startswith(('http://', 'https://')):
             if os.path.exists(url):
                 pixmap = QPixmap(url)
                 if not pixmap.isNull():
-                    pixmap = self._scale_pixmap(pixmap, QSize(120, 120))
+                    pixmap = self._scale_pixmap(pixmap, size, pixel_ratio)
+                    self.memory_cache.put(key, pixmap)
                     return pixmap
-            return self._get_default_icon(default_icon)
+            return self._get_default_icon(default_icon, size, pixel_ratio)
         
-        cached_path = self._get_cached_path(url)
-        if cached_path.exists():
-            pixmap = QPixmap(str(cached_path))
-            if not pixmap.isNull():
-                pixmap = self._scale_pixmap(pixmap, QSize(120, 120))
-                return pixmap
-        
-        if target_widget:
+        if not target_widget:
+            # Без виджета картинку некуда доставить позже, поэтому файл из кэша читается сразу
+            cached_path = self.disk_cache.get_path(url)
+            if cached_path is not None:
+                pixmap = QPixmap(str(cached_path))
+                if not pixmap.isNull():
+                    pixmap = self._scale_pixmap(pixmap, size, pixel_ratio)
+                    self.memory_cache.put(key, pixmap)
+                    return pixmap
+            return self._get_default_icon(default_icon, size, pixel_ratio)
+        
+        request_info = self.waiting.get(key)
+        if request_info is None:
+            request_info = self.waiting[key] = {'url': url, 'key': key, 'targets': []}
+            self.queue.append(request_info)
+        request_info['targets'].append((target_widget, default_icon))
+        self._start_queued()
+        return self._get_default_icon(default_icon, size, pixel_ratio)
+    
+    def _start_queued(self):
+        # Одновременно читается и скачивается не больше MAX_IMAGES_IN_FLIGHT картинок:
+        # при загрузке каталога ответы не накапливаются в памяти быстрее, чем декодируются
+        while self.queue and self.in_flight < MAX_IMAGES_IN_FLIGHT:
+            request_info = self.queue.popleft()
+            # Пока запрос ждал, карточки могли удалить сменой фильтра
+            request_info['targets'] = [(target, default) for target, default in request_info['targets']
+                                       if isValid(target)]
+            if not request_info['targets']:
+                del self.waiting[request_info['key']]
+                continue
+            
+            self.in_flight += 1
+            url = request_info['url']
+            cached_path = self.disk_cache.get_path(url)
+            if cached_path is not None:
+                request_info['path'] = cached_path
+                self._start_decode(ImageDecodeTask(self.disk_cache, request_info, path=cached_path))
+                continue
+            
             request = QNetworkRequest(QUrl(url))
             request.setRawHeader(b"User-Agent", b"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36")
             request.setAttribute(QNetworkRequest.Attribute.CacheLoadControlAttribute, 
                                  QNetworkRequest.CacheLoadControl.AlwaysNetwork)
             
-            request_id = id(request)
-            self.pending_requests[request_id] = {
-                'url': url,
-                'target': target_widget,
-                'default': default_icon
-            }
+            request_id = id(request_info)
+            self.pending_requests[request_id] = request_info
             
             reply = self.network_manager.get(request)
             reply.setProperty('request_id', request_id)
-            
-        return self._get_default_icon(default_icon)
+    
+    def _start_decode(self, task):
+        task.finished.connect(self._on_image_decoded)
+        self.decode_pool.start(task)
     
     @Slot(QNetworkReply)
     def _on_image_downloaded(self, reply):
         request_id = reply.property('request_id')
-        request_info = self.pending_requests.get(request_id)
+        request_info = self.pending_requests.pop(request_id, None)
         
         if not request_info:
             reply.deleteLater()
             return
         
+        task = None
         try:
-            error = reply.error()
-            if error != QNetworkReply.NetworkError.NoError:
-                pixmap = self._get_default_icon(request_info['default'])
-            else:
-                data = reply.readAll()
-                if data.isEmpty():
-                    pixmap = self._get_default_icon(request_info['default'])
-                else:
-                    cached_path = self._get_cached_path(request_info['url'])
-                    with open(cached_path, 'wb') as f:
-                        f.write(data.data())
-                    
-                    pixmap = QPixmap()
-                    if pixmap.loadFromData(data):
-                        pixmap = self._scale_pixmap(pixmap, QSize(120, 120))
-                    else:
-                        pixmap = self._get_default_icon(request_info['default'])
-            
-            if request_info['target']:
-                if isinstance(request_info['target'], QLabel):
-                    request_info['target'].setPixmap(pixmap)
-                elif hasattr(request_info['target'], 'set_icon'):
-                    request_info['target'].set_icon(pixmap)
-            
-            self.image_loaded.emit(request_info['url'], pixmap)
-            
+            data = reply.readAll() if reply.error() == QNetworkReply.NetworkError.NoError else None
+            if data is not None and not data.isEmpty():
+                task = ImageDecodeTask(self.disk_cache, request_info, data=data,
+                                       content_type=reply.header(QNetworkRequest.KnownHeaders.ContentTypeHeader),
+                                       etag=reply.header(QNetworkRequest.KnownHeaders.ETagHeader))
         except Exception:
             pass
         finally:
-            if request_id in self.pending_requests:
-                del self.pending_requests[request_id]
             reply.deleteLater()
+        
+        if task is None:
+            self._on_image_decoded(request_info, QImage())
+        else:
+            self._start_decode(task)
     
-    def _get_cached_path(self, url):
-        url_hash = hashlib.md5(url.encode()).hexdigest()
-        return self.cache_dir / f"{url_hash}.png"
+    @Slot(object, object)
+    def _on_image_decoded(self, request_info, image):
+        self.in_flight -= 1
+        url = request_info['url']
+        key = request_info['key']
+        
+        if image.isNull() and request_info.pop('path', None) is not None:
+            # Битый файл удаляется из кэша, картинка скачивается заново
+            self.disk_cache.remove(url)
+            self.queue.appendleft(request_info)
+            self._start_queued()
+            return
+        
+        del self.waiting[key]
+        _, width, height, pixel_ratio = key
+        size = QSize(width, height)
+        pixmap = None
+        if not image.isNull():
+            pixmap = QPixmap.fromImage(image)
+            pixmap.setDevicePixelRatio(pixel_ratio)
+            self.memory_cache.put(key, pixmap)
+        
+        for target, default_icon in request_info['targets']:
+            if not isValid(target):
+                continue
+            target_pixmap = pixmap if pixmap is not None else self._get_default_icon(default_icon, size, pixel_ratio)
+            if isinstance(target, QLabel):
+                target.setPixmap(target_pixmap)
+            elif hasattr(target, 'set_icon'):
+                target.set_icon(target_pixmap)
+        
+        # Подписчики image_loaded не знают типа значка карточек: без картинки отдается общий значок
+        self.image_loaded.emit(url, pixmap if pixmap is not None else self._get_default_icon(None, size, pixel_ratio))
+        self._start_queued()
     
-    def _scale_pixmap(self, pixmap, size):
-        return pixmap.scaled(size, Qt.AspectRatioMode.KeepAspectRatio, 
-                            Qt.TransformationMode.SmoothTransformation)
+    def _scale_pixmap(self, pixmap, size, pixel_ratio=1.0):
+        # На экранах с масштабированием картинка масштабируется в физические пиксели
+        pixmap = pixmap.scaled(size * pixel_ratio, Qt.AspectRatioMode.KeepAspectRatio, 
+                               Qt.TransformationMode.SmoothTransformation)
+        pixmap.setDevicePixelRatio(pixel_ratio)
+        return pixmap
+    
+    def get_cache_stats(self):
+        return {
+            'memory': self.memory_cache.get_stats(),
+            'disk': self.disk_cache.get_stats()
+        }
     
-    def _get_default_icon(self, icon_type=None):
-        size = QSize(120, 120)
-        pixmap = QPixmap(size)
+    def _get_default_icon(self, icon_type=None, size=IMAGE_SIZE, pixel_ratio=1.0):
+        pixmap = QPixmap(size * pixel_ratio)
+        pixmap.setDevicePixelRatio(pixel_ratio)
         pixmap.fill(Qt.GlobalColor.transparent)
         
         painter = QPainter(pixmap)
         painter.setRenderHint(QPainter.RenderHint.Antialiasing)
         
+        # Значок задан в координатах IMAGE_SIZE и рисуется сразу в нужном размере,
+        # а не растягивается готовой картинкой
+        scale = min(size.width() / IMAGE_SIZE.width(), size.height() / IMAGE_SIZE.height())
+        painter.translate((size.width() - IMAGE_SIZE.width() * scale) / 2,
+                          (size.height() - IMAGE_SIZE.height() * scale) / 2)
+        painter.scale(scale, scale)
+        rect = QRect(QPoint(0, 0), IMAGE_SIZE)
+        
         if icon_type == 'brand':
             painter.setBrush(QColor("#3498db"))
             painter.setPen(Qt.PenStyle.NoPen)
@@ -163,7 +357,7 @@ class ImageLoader(QObject):
             
             painter.setPen(QColor("white"))
             painter.setFont(QFont("Arial", 32, QFont.Weight.Bold))
-            painter.drawText(pixmap.rect(), Qt.AlignmentFlag.AlignCenter, "B")
+            painter.drawText(rect, Qt.AlignmentFlag.AlignCenter, "B")
         else:
             painter.setBrush(QColor("#f8f9fa"))
             painter.setPen(QColor("#dee2e6"))
@@ -171,7 +365,7 @@ class ImageLoader(QObject):
             
             painter.setPen(QColor("#95a5a6"))
             painter.setFont(QFont("Arial", 32))
-            painter.drawText(pixmap.rect(), Qt.AlignmentFlag.AlignCenter, "📦")
+            painter.drawText(rect, Qt.AlignmentFlag.AlignCenter, "📦")
         
         painter.end()
         return pixmap
@@ -180,6 +374,75 @@ class ImageLoader(QObject):
 image_loader = ImageLoader()
 
 
+class BackgroundTask(QRunnable):
+    # Долгая работа вне потока интерфейса; результат приходит сигналом finished.
+    # Если функция упала, finished все равно приходит, но с None
+    class Signals(QObject):
+        finished = Signal(object)
+    
+    def __init__(self, function):
+        super().__init__()
+        self.function = function
+        self.signals = BackgroundTask.Signals()
+        self.finished = self.signals.finished
+        
+    def run(self):
+        result = None
+        try:
+            result = self.function()
+        except Exception:
+            pass
+        finally:
+            self.finished.emit(result)
+
+
+class SearchTask(QRunnable):
+    def __init__(self, worker, products, generation):
+        super().__init__()
+        self.worker = worker
+        self.products = products
+        self.generation = generation
+        self.created = time.perf_counter()
+        
+    def run(self):
+        # Пока задача ждала в очереди, мог прийти более новый запрос
+        if self.generation != self.worker.generation:
+            return
+        
+        queued = time.perf_counter() - self.created
+        results = self.worker.product_filter.get_ranked_results(self.products)
+        timings = dict(self.worker.product_filter.last_timings)
+        timings['queue'] = queued
+        self.worker.results_ready.emit(self.generation, results, timings)
+
+
+class SearchWorker(QObject):
+    # Фильтрация в фоновом потоке. Каждый запрос получает номер поколения:
+    # результат применяется, только если после него не было новых запросов
+    results_ready = Signal(int, object, object)
+    
+    def __init__(self, product_filter):
+        super().__init__()
+        self.product_filter = product_filter
+        self.generation = 0
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        
+    def submit(self, products):
+        generation = self.cancel()
+        self.pool.start(SearchTask(self, products, generation))
+        return generation
+        
+    def cancel(self):
+        # Задачи из очереди снимаются, а выполняющаяся досчитает, но ее результат будет отброшен
+        self.generation += 1
+        self.pool.clear()
+        return self.generation
+        
+    def is_current(self, generation):
+        return generation == self.generation
+
+
 class CartItemWidget(QWidget):
     def __init__(self, product_id, article, product_name, price, quantity=1, user_id=None, parent=None):
         super().__init__(parent)
@@ -255,43 +518,51 @@ class CartItemWidget(QWidget):
         layout.addWidget(delete_btn)
     
     def increase_quantity(self):
-        self.quantity += 1
-        self.quantity_label.setText(str(self.quantity))
-        self.total_label.setText(f"{self.price * self.quantity:.2f} руб.")
-        
-        if self.user_id:
-            config.update_cart_item(self.user_id, self.article, self.quantity)
-        
-        self.update_cart_total()
+        self.change_quantity(self.quantity + 1)
     
     def decrease_quantity(self):
         if self.quantity > 1:
-            self.quantity -= 1
-            self.quantity_label.setText(str(self.quantity))
-            self.total_label.setText(f"{self.price * self.quantity:.2f} руб.")
-            
-            if self.user_id:
-                config.update_cart_item(self.user_id, self.article, self.quantity)
-            
-            self.update_cart_total()
+            self.change_quantity(self.quantity - 1)
         else:
             self.delete_item()
     
     def delete_item(self):
+        self.change_quantity(0)
+    
+    def change_quantity(self, quantity):
         if self.user_id:
-            config.remove_from_cart(self.user_id, self.article)
+            success, line = config.update_cart_item(self.user_id, self.article, quantity)
+            if not success:
+                QMessageBox.warning(self, "Ошибка", line)
+                return
+        else:
+            line = {
+                'product_id': self.product_id,
+                'article': self.article,
+                'name': self.product_name,
+                'price': str(self.price),
+                'quantity': max(quantity, 0)
+            }
         
-        self.setParent(None)
-        self.deleteLater()
-        self.update_cart_total()
+        self.apply_cart_line(line)
     
-    def update_cart_total(self):
+    def set_quantity(self, quantity):
+        self.quantity = quantity
+        self.quantity_label.setText(str(self.quantity))
+        self.total_label.setText(f"{self.price * self.quantity:.2f} руб.")
+    
+    def apply_cart_line(self, line):
         parent = self.parent()
-        while parent and not hasattr(parent, 'update_cart_total'):
+        while parent and not hasattr(parent, 'apply_cart_line'):
             parent = parent.parent()
         
-        if parent and hasattr(parent, 'update_cart_total'):
-            parent.update_cart_total()
+        if parent and hasattr(parent, 'apply_cart_line'):
+            parent.apply_cart_line(line)
+        elif line['quantity'] > 0:
+            self.set_quantity(line['quantity'])
+        else:
+            self.setParent(None)
+            self.deleteLater()
     
     def get_total_price(self):
         return self.price * self.quantity
@@ -463,9 +734,131 @@ class PeriodSelectionDialog(QDialog):
         return self.start_date_edit.date(), self.end_date_edit.date()
 
 
+class AttributeFilterDialog(QDialog):
+    def __init__(self, product_filter, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Характеристики товара")
+        self.setFixedSize(760, 620)
+        self.setModal(True)
+        self.setStyleSheet("background-color: white; color: #000000;")
+        
+        layout = QVBoxLayout(self)
+        layout.setSpacing(20)
+        layout.setContentsMargins(30, 30, 30, 30)
+        
+        title_label = QLabel("Выберите характеристики")
+        title_label.setStyleSheet("font-size: 22px; font-weight: bold; color: #2c3e50;")
+        layout.addWidget(title_label)
+        
+        attributes_widget = QWidget()
+        attributes_widget.setStyleSheet("background-color: white; color: #000000;")
+        attributes_layout = QGridLayout(attributes_widget)
+        attributes_layout.setSpacing(15)
+        
+        # Рядом со значением - сколько товаров с ним подходит под остальные фильтры: значения
+        # одной характеристики объединяются, поэтому выбор еще одного добавит эти товары.
+        # Значения без товаров недоступны, если они не выбраны
+        counts = product_filter.get_facet_counts()
+        self.value_lists = {}
+        for position, (name, title) in enumerate(ATTRIBUTE_FILTERS.items()):
+            selected = product_filter.selected_attributes.get(name, [])
+            
+            attribute_label = QLabel(title)
+            attribute_label.setStyleSheet("font-size: 14px; font-weight: bold; color: #495057;")
+            
+            value_list = QListWidget()
+            value_list.setStyleSheet("""
+                QListWidget {
+                    background-color: white;
+                    border: 1px solid #dee2e6;
+                    outline: none;
+                    font-size: 13px;
+                    color: #000000;
+                    border-radius: 6px;
+                }
+                QListWidget::item {
+                    padding: 4px 8px;
+                    color: #000000;
+                }
+                QListWidget::item:disabled {
+                    color: #adb5bd;
+                }
+            """)
+            for value in product_filter.get_attribute_values(name):
+                count = counts[name].get(value, 0)
+                item = QListWidgetItem(f"{value} ({count})" if count else value)
+                item.setData(Qt.ItemDataRole.UserRole, value)
+                item.setFlags(Qt.ItemFlag.ItemIsUserCheckable | Qt.ItemFlag.ItemIsEnabled)
+                item.setCheckState(Qt.CheckState.Checked if value in selected else Qt.CheckState.Unchecked)
+                if not count and value not in selected:
+                    item.setFlags(Qt.ItemFlag.NoItemFlags)
+                value_list.addItem(item)
+            self.value_lists[name] = value_list
+            
+            row, column = divmod(position, 3)
+            attributes_layout.addWidget(attribute_label, row * 2, column)
+            attributes_layout.addWidget(value_list, row * 2 + 1, column)
+        
+        layout.addWidget(attributes_widget, 1)
+        
+        buttons_container = QWidget()
+        buttons_container.setStyleSheet("background-color: white; color: #000000;")
+        buttons_layout = QHBoxLayout(buttons_container)
+        buttons_layout.setSpacing(15)
+        
+        self.cancel_button = QPushButton("Отменить")
+        self.cancel_button.setFixedHeight(45)
+        self.cancel_button.setStyleSheet("""
+            QPushButton { 
+                background-color: #95a5a6; 
+                color: #000000; 
+                border: none; 
+                border-radius: 8px; 
+                font-size: 16px; 
+                font-weight: bold; 
+            } 
+            QPushButton:hover { 
+                background-color: #7f8c8d; 
+            }
+        """)
+        self.cancel_button.clicked.connect(self.reject)
+        
+        self.confirm_button = QPushButton("Применить")
+        self.confirm_button.setFixedHeight(45)
+        self.confirm_button.setStyleSheet("""
+            QPushButton { 
+                background-color: #3498db; 
+                color: #000000; 
+                border: none; 
+                border-radius: 8px; 
+                font-size: 16px; 
+                font-weight: bold; 
+            } 
+            QPushButton:hover { 
+                background-color: #2980b9; 
+            }
+        """)
+        self.confirm_button.clicked.connect(self.accept)
+        
+        buttons_layout.addStretch()
+        buttons_layout.addWidget(self.cancel_button)
+        buttons_layout.addWidget(self.confirm_button)
+        
+        layout.addWidget(buttons_container)
+    
+    def get_selected_attributes(self):
+        selected = {}
+        for name, value_list in self.value_lists.items():
+            selected[name] = [value_list.item(i).data(Qt.ItemDataRole.UserRole)
+                              for i in range(value_list.count())
+                              if value_list.item(i).checkState() == Qt.CheckState.Checked]
+        return selected
+
+
 class AddProductDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
+        self.product_id = None
         self.setWindowTitle("Добавить товар")
         self.setFixedSize(600, 850)
         self.setModal(True)
@@ -662,6 +1055,7 @@ class AddProductDialog(QDialog):
         success, result = config.add_product(db_product_data)
         
         if success:
+            self.product_id = result
             QMessageBox.information(self, "Успех", f"Товар '{product_data['Название товара']}' успешно добавлен!")
             self.accept()
         else:
@@ -707,12 +1101,13 @@ class ProductDetailWidget(QWidget):
             pixmap = image_loader.load_image(
                 product_data['image_url'],
                 self.image_label,
-                'product'
+                'product',
+                QSize(280, 280)
             )
-            self.image_label.setPixmap(pixmap.scaled(280, 280, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
+            self.image_label.setPixmap(pixmap)
         else:
-            pixmap = image_loader._get_default_icon('product')
-            self.image_label.setPixmap(pixmap.scaled(280, 280, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
+            pixmap = image_loader._get_default_icon('product', QSize(280, 280), self.image_label.devicePixelRatioF())
+            self.image_label.setPixmap(pixmap)
         
         image_layout.addWidget(self.image_label)
         
@@ -754,6 +1149,19 @@ class ProductDetailWidget(QWidget):
         
         main_layout.addWidget(content_widget, 1)
         
+        similar_products = main_window.get_similar_products(product_data) if main_window else []
+        self.add_products_row(main_layout, "Похожие товары", similar_products)
+        
+        # Рекомендации читаются из базы в фоне и показываются, когда придут
+        self.bought_together_widget = QWidget()
+        self.bought_together_widget.setStyleSheet("background-color: white; color: #000000;")
+        self.bought_together_layout = QVBoxLayout(self.bought_together_widget)
+        self.bought_together_layout.setContentsMargins(0, 0, 0, 0)
+        self.bought_together_widget.hide()
+        main_layout.addWidget(self.bought_together_widget)
+        if main_window:
+            main_window.load_bought_together([product_data.get('article')], self.on_bought_together_loaded)
+        
         buttons_widget = QWidget()
         buttons_widget.setStyleSheet("background-color: white; color: #000000;")
         buttons_layout = QHBoxLayout(buttons_widget)
@@ -782,6 +1190,30 @@ class ProductDetailWidget(QWidget):
         
         main_layout.addWidget(buttons_widget)
     
+    def on_bought_together_loaded(self, result):
+        products = self.main_window.get_catalog_products(result[1]) if result else []
+        if products:
+            self.add_products_row(self.bought_together_layout, "С этим товаром покупают", products)
+            self.bought_together_widget.show()
+    
+    def add_products_row(self, layout, title, products):
+        if not products:
+            return
+        
+        row_title = QLabel(title)
+        row_title.setStyleSheet("font-size: 18px; font-weight: bold; color: #2c3e50;")
+        layout.addWidget(row_title)
+        
+        row_widget = QWidget()
+        row_widget.setStyleSheet("background-color: white; color: #000000;")
+        row_layout = QHBoxLayout(row_widget)
+        row_layout.setContentsMargins(0, 0, 0, 0)
+        row_layout.setSpacing(10)
+        for product in products:
+            row_layout.addWidget(ProductCard(product, self.main_window))
+        row_layout.addStretch()
+        layout.addWidget(row_widget)
+    
     def create_info_field(self, field_name, field_value):
         field_widget = QWidget()
         field_widget.setStyleSheet("background-color: white; color: #000000;")
@@ -829,7 +1261,7 @@ class ProductDetailWidget(QWidget):
                 QMessageBox.information(self, "Успех", message)
                 # Обновляем список товаров в главном окне
                 if self.main_window:
-                    self.main_window.load_products_from_db()
+                    self.main_window.remove_catalog_product(self.product_data['id'])
                 self.go_back()  # Возвращаемся к списку товаров
             else:
                 QMessageBox.warning(self, "Ошибка", message)
@@ -870,7 +1302,7 @@ class BrandCard(QFrame):
             )
             self.icon_label.setPixmap(pixmap)
         else:
-            pixmap = image_loader._get_default_icon('brand')
+            pixmap = image_loader._get_default_icon('brand', IMAGE_SIZE, self.icon_label.devicePixelRatioF())
             self.icon_label.setPixmap(pixmap)
         
         layout.addWidget(self.icon_label)
@@ -1003,7 +1435,7 @@ class ProductCard(QFrame):
             )
             self.image_label.setPixmap(pixmap)
         else:
-            pixmap = image_loader._get_default_icon('product')
+            pixmap = image_loader._get_default_icon('product', IMAGE_SIZE, self.image_label.devicePixelRatioF())
             self.image_label.setPixmap(pixmap)
         
         layout.addWidget(self.image_label)
@@ -1302,9 +1734,10 @@ class AddBrandDialog(QDialog):
 
 
 class OrderDetailsDialog(QDialog):
-    def __init__(self, order_id, parent=None):
+    def __init__(self, order_id, parent=None, order_details=None):
         super().__init__(parent)
         self.order_id = order_id
+        self.order_details = order_details
         self.setWindowTitle(f"Детали заказа #{order_id}")
         self.setFixedSize(700, 600)
         self.setModal(True)
@@ -1386,7 +1819,7 @@ class OrderDetailsDialog(QDialog):
         self.load_order_data()
     
     def load_order_data(self):
-        order_details = config.get_order_details(self.order_id)
+        order_details = self.order_details or config.get_order_details(self.order_id)
         
         if not order_details:
             QMessageBox.warning(self, "Ошибка", "Не удалось загрузить детали заказа")